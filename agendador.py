@@ -0,0 +1,256 @@
+# agendador.py
+#
+# Pré-geração dos relatórios depois do fechamento de cada mercado, para o primeiro clique do dia já
+# encontrar o PDF pronto em vez de pagar coleta e renderização. Cada regra tem uma expressão cron
+# (minuto hora dia mês dia-da-semana) no fuso do mercado e os relatórios que gera.
+#
+# Os processos que chamam iniciar() disputam uma trava de arquivo: quem a pega vira o líder e roda as
+# regras; os outros continuam tentando, para assumir se o líder cair. Ao terminar uma regra, o líder
+# registra os arquivos em ARQUIVO_AGENDADOS (troca atômica), que os endpoints consultam antes de
+# enfileirar: até a próxima execução agendada daquele relatório, o pedido recebe o arquivo pronto.
+# Com o app em várias máquinas, a pasta do registro e da trava precisa ser compartilhada.
+
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+from zoneinfo import ZoneInfo
+import metricas
+
+try:
+    import fcntl
+except ImportError:  # sem fcntl (Windows) não há disputa: cada processo que iniciar o agendador é líder
+    fcntl = None
+
+# Liga o agendador nos processos que geram relatórios (app no modo local, worker_relatorios no durável)
+ATIVO = os.environ.get('AGENDADOR', '0') == '1'
+
+# Regras padrão: depois do fechamento de Hong Kong, da B3 e da NYSE, em dias úteis. AGENDA_REGRAS
+# (lista JSON no mesmo formato) substitui todas
+REGRAS_PADRAO = [
+    {'nome': 'fechamento_asia', 'cron': '30 16 * * 1-5', 'fuso': 'Asia/Hong_Kong', 'relatorios': ['pdf3']},
+    {'nome': 'fechamento_b3', 'cron': '30 18 * * 1-5', 'fuso': 'America/Sao_Paulo',
+     'relatorios': ['pdf1', 'pdf2', 'pdf3']},
+    {'nome': 'fechamento_nyse', 'cron': '30 16 * * 1-5', 'fuso': 'America/New_York',
+     'relatorios': ['pdf1', 'pdf2', 'pdf3']},
+]
+
+# Registro dos arquivos pré-gerados e das últimas execuções, e a trava da liderança
+ARQUIVO_AGENDADOS = os.environ.get('AGENDA_ARQUIVO', os.path.join('dados', 'agendados.json'))
+
+# De quanto em quanto tempo os processos sem liderança tentam a trava (e o líder revisa as regras)
+VERIFICACAO_SEGUNDOS = int(os.environ.get('AGENDA_VERIFICACAO_SEGUNDOS', '30'))
+
+# Um arquivo pré-gerado continua valendo por esse tempo além da próxima execução, enquanto ela roda
+TOLERANCIA_SEGUNDOS = int(os.environ.get('AGENDA_TOLERANCIA_SEGUNDOS', '1800'))
+
+# Execuções perdidas (líder fora do ar no horário) são recuperadas se tiverem até essa idade
+RECUPERAR_HORAS = float(os.environ.get('AGENDA_RECUPERAR_HORAS', '6'))
+
+_CAMPOS = [('minuto', 0, 59), ('hora', 0, 23), ('dia', 1, 31), ('mês', 1, 12), ('dia da semana', 0, 7)]
+
+_thread = None
+_trava = threading.Lock()
+_lido = (None, None)  # (mtime_ns, conteúdo) do registro, para não reler o JSON a cada pedido
+
+
+def _valores(campo, nome, minimo, maximo):
+    # '*', 'a', 'a-b', listas com vírgula e passos ('*/15', '8-18/2', '5/10')
+    valores = set()
+    for parte in campo.split(','):
+        faixa, _, passo = parte.partition('/')
+        try:
+            if faixa == '*':
+                inicio, fim = minimo, maximo
+            elif '-' in faixa:
+                inicio, fim = (int(valor) for valor in faixa.split('-', 1))
+            else:
+                inicio = int(faixa)
+                fim = maximo if passo else inicio
+            passo = int(passo) if passo else 1
+        except ValueError:
+            raise ValueError(f"Campo de {nome} inválido na expressão cron: {campo!r}.")
+        if not minimo <= inicio <= fim <= maximo or passo < 1:
+            raise ValueError(f"Campo de {nome} fora do intervalo {minimo}-{maximo}: {campo!r}.")
+        valores.update(range(inicio, fim + 1, passo))
+    return valores
+
+
+class Regra:
+    def __init__(self, nome, cron, fuso, relatorios):
+        campos = cron.split()
+        if len(campos) != 5:
+            raise ValueError(f"A regra '{nome}' precisa de uma expressão cron com 5 campos: {cron!r}.")
+        self.nome = nome
+        self.cron = cron
+        self.fuso = ZoneInfo(fuso)
+        self.relatorios = list(relatorios)
+        minutos, horas, self.dias, self.meses, dias_semana = (
+            _valores(campo, *limites) for campo, limites in zip(campos, _CAMPOS))
+        self.horarios = sorted(datetime.time(hora, minuto) for hora in horas for minuto in minutos)
+        self.dias_semana = {dia % 7 for dia in dias_semana}  # 0 e 7 são domingo
+        self.dia_livre, self.semana_livre = campos[2] == '*', campos[4] == '*'
+
+    def _confere(self, data):
+        if data.month not in self.meses:
+            return False
+        no_mes, na_semana = data.day in self.dias, (data.weekday() + 1) % 7 in self.dias_semana
+        # Como no cron: com dia do mês e dia da semana restritos, basta um dos dois
+        if self.dia_livre or self.semana_livre:
+            return no_mes and na_semana
+        return no_mes or na_semana
+
+    def _ocorrencias(self, referencia, passo):
+        # Horários da regra a partir de 'referencia' (no fuso do mercado), para frente ou para trás
+        data = referencia.astimezone(self.fuso).date()
+        for _ in range(366 * 5):
+            if self._confere(data):
+                for horario in (self.horarios if passo > 0 else reversed(self.horarios)):
+                    yield datetime.datetime.combine(data, horario, self.fuso)
+            data += datetime.timedelta(days=passo)
+
+    def proxima(self, depois):
+        return next((momento for momento in self._ocorrencias(depois, 1) if momento > depois), None)
+
+    def anterior(self, antes):
+        return next((momento for momento in self._ocorrencias(antes, -1) if momento <= antes), None)
+
+
+def carregar_regras():
+    configuracao = os.environ.get('AGENDA_REGRAS')
+    regras = json.loads(configuracao) if configuracao else REGRAS_PADRAO
+    return [Regra(regra['nome'], regra['cron'], regra.get('fuso', 'America/Sao_Paulo'), regra['relatorios'])
+            for regra in regras]
+
+
+def _ler_registro():
+    global _lido
+    try:
+        mtime = os.stat(ARQUIVO_AGENDADOS).st_mtime_ns
+    except FileNotFoundError:
+        return {'relatorios': {}, 'execucoes': {}}
+    if _lido[0] != mtime:
+        with open(ARQUIVO_AGENDADOS) as arquivo:
+            _lido = (mtime, json.load(arquivo))
+    return _lido[1]
+
+
+def _gravar_registro(registro):
+    # Troca atômica: quem lê nunca vê o registro pela metade
+    temporario = f'{ARQUIVO_AGENDADOS}.{os.getpid()}.tmp'
+    with open(temporario, 'w') as arquivo:
+        json.dump(registro, arquivo, indent=1)
+    os.replace(temporario, ARQUIVO_AGENDADOS)
+
+
+def pronto(tipo):
+    # Arquivo pré-gerado do relatório (parâmetros padrão), se ainda estiver na validade
+    try:
+        entrada = _ler_registro()['relatorios'].get(tipo)
+    except (OSError, ValueError) as e:
+        logging.error(f"Erro ao ler o registro do agendador: {e}")
+        return None
+    if not entrada or time.time() > entrada['valido_ate'] or not os.path.exists(entrada['arquivo']):
+        return None
+    metricas.CACHE_TOTAL.incrementar(tipo=tipo, resultado='agendado')
+    return entrada['arquivo']
+
+
+def executar(regra, regras, pasta):
+    # Atualiza os dados e gera os relatórios da regra numa única coleta; cada PDF já entra na pasta
+    # com troca atômica (cache_relatorios), e o registro passa a apontar para ele
+    import relatorios
+    import cache_relatorios
+    inicio = time.perf_counter()
+    logging.info(f"Agendador: regra '{regra.nome}' gerando {', '.join(regra.relatorios)}.")
+    registro = _ler_registro()
+    registro = {'relatorios': dict(registro['relatorios']), 'execucoes': dict(registro['execucoes'])}
+    agora = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        arquivos = relatorios.gerar_varios(pasta, tipos=regra.relatorios)
+        resultado = 'ok'
+    except Exception as e:
+        logging.error(f"Agendador: erro na regra '{regra.nome}': {e}")
+        arquivos, resultado = {}, 'erro'
+
+    for tipo, arquivo in arquivos.items():
+        if cache_relatorios.desatualizados([arquivo]):
+            # Com dados desatualizados o pedido volta a ser gerado na hora (e tenta o provedor de novo)
+            logging.warning(f"Agendador: {tipo} saiu com dados desatualizados e não foi publicado.")
+            resultado = 'parcial'
+            continue
+        proximas = [r.proxima(agora) for r in regras if tipo in r.relatorios]
+        proximas = [momento.timestamp() for momento in proximas if momento is not None]
+        valido_ate = (min(proximas) if proximas else agora.timestamp()) + TOLERANCIA_SEGUNDOS
+        registro['relatorios'][tipo] = {'arquivo': arquivo, 'gerado_em': agora.timestamp(),
+                                        'valido_ate': valido_ate, 'regra': regra.nome}
+    registro['execucoes'][regra.nome] = agora.timestamp()
+    _gravar_registro(registro)
+    metricas.AGENDA_TOTAL.incrementar(regra=regra.nome, resultado=resultado)
+    logging.info(f"Agendador: regra '{regra.nome}' concluída ({resultado}) em {time.perf_counter() - inicio:.1f}s.")
+
+
+def _pendentes(regras, agora):
+    # Regras cujo último horário ainda não foi executado (e não ficou velho demais para recuperar)
+    execucoes = _ler_registro()['execucoes']
+    pendentes = []
+    for regra in regras:
+        anterior = regra.anterior(agora)
+        if anterior is None or execucoes.get(regra.nome, 0) >= anterior.timestamp():
+            continue
+        if (agora - anterior).total_seconds() <= RECUPERAR_HORAS * 3600:
+            pendentes.append(regra)
+    return pendentes
+
+
+def _tentar_lideranca():
+    pasta = os.path.dirname(ARQUIVO_AGENDADOS)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    arquivo = open(f'{ARQUIVO_AGENDADOS}.trava', 'w')
+    if fcntl is None:
+        return arquivo
+    try:
+        fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        arquivo.close()
+        return None
+    return arquivo
+
+
+def _laco(regras, pasta):
+    lideranca = None
+    while True:
+        espera = VERIFICACAO_SEGUNDOS
+        try:
+            if lideranca is None:
+                lideranca = _tentar_lideranca()
+                if lideranca is not None:
+                    logging.info(f"Agendador: processo {os.getpid()} assumiu a liderança.")
+            if lideranca is not None:
+                for regra in _pendentes(regras, datetime.datetime.now(datetime.timezone.utc)):
+                    executar(regra, regras, pasta)
+                agora = datetime.datetime.now(datetime.timezone.utc)
+                proximas = [momento for momento in (regra.proxima(agora) for regra in regras) if momento]
+                if proximas:
+                    espera = min(espera, (min(proximas) - agora).total_seconds())
+        except Exception as e:
+            logging.error(f"Agendador: {e}")
+        time.sleep(max(espera, 1))
+
+
+def iniciar(pasta='outputs'):
+    # Sobe a thread do agendador uma vez por processo (só com AGENDADOR=1)
+    global _thread
+    if not ATIVO:
+        return
+    with _trava:
+        if _thread is not None:
+            return
+        regras = carregar_regras()
+        _thread = threading.Thread(target=_laco, args=(regras, pasta), name='agendador', daemon=True)
+        _thread.start()
+    logging.info(f"Agendador iniciado com {len(regras)} regra(s): "
+                 f"{', '.join(f'{regra.nome} ({regra.cron})' for regra in regras)}.")
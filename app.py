@@ -1,10 +1,19 @@
 # app.py
 
-from flask import Flask, render_template, send_file, abort, jsonify
-import pdf_gerador1
-import pdf_gerador2
-import pdf_gerador3
+from flask import Flask, render_template, send_file, abort, jsonify, url_for, Response, request
+from werkzeug.security import safe_join
+import relatorios
+import fila_relatorios
+import fila_duravel
+import perfilamento
+import agendador
+import cache_relatorios
+import dados_relatorios
+import fluxo_variacao
+import metricas
+from functools import partial
 import os
+import json
 import logging
 
 app = Flask(__name__)
@@ -20,56 +29,231 @@ os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 def home():
     return render_template('index.html')
 
+def ler_parametros(tipo):
+    # Corpo JSON opcional com universo, horizontes, janelas e data de referência
+    # (nos GET, o mesmo JSON vem no parâmetro 'parametros' da URL)
+    if request.method == 'GET':
+        if not request.args.get('parametros'):
+            return {}
+        try:
+            corpo = json.loads(request.args['parametros'])
+        except ValueError:
+            raise ValueError("O parâmetro 'parametros' não é um JSON válido.")
+        return relatorios.normalizar_parametros(tipo, corpo)
+    if not request.get_data():
+        return {}
+    corpo = request.get_json(silent=True)
+    if corpo is None:
+        raise ValueError("O corpo do pedido não é um JSON válido.")
+    return relatorios.normalizar_parametros(tipo, corpo)
+
+def pedido_perfilado():
+    # Perfilamento pedido pelo cabeçalho X-Perfil ou pelo parâmetro ?perfil=, com o token de administrador
+    return perfilamento.autorizar(request.headers.get('X-Perfil') or request.args.get('perfil'))
+
+def enfileirar(tipo, tarefa, parametros=None, mensagem_erro='Erro ao gerar o PDF.', perfilar=False):
+    # Com FILA_MODO=duravel o pedido vai para a fila em SQLite e os workers (worker_relatorios.py) geram;
+    # no modo local a geração roda no próprio processo web. Pedidos perfilados não se juntam aos comuns
+    chave = cache_relatorios.chave_pedido(tipo, parametros) + ('|perfil' if perfilar else '')
+    if fila_duravel.MODO == 'duravel':
+        return fila_duravel.enfileirar(tipo, parametros, chave=chave, mensagem_erro=mensagem_erro, perfilar=perfilar)
+    if perfilar:
+        def executar(progresso):
+            arquivo, perfil = perfilamento.perfilar(partial(tarefa, progresso=progresso, forcar=True))
+            return {'arquivos': [arquivo], 'perfil': perfil}
+    else:
+        def executar(progresso):
+            return tarefa(progresso=progresso)
+    return fila_relatorios.enfileirar(tipo, executar, chave=chave, mensagem_erro=mensagem_erro)
+
+def enfileirar_relatorio(tipo):
+    nome = relatorios.RELATORIOS[tipo][0]
+    try:
+        parametros = ler_parametros(tipo)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    try:
+        perfilar = pedido_perfilado()
+    except PermissionError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 403
+    if perfilar and fila_duravel.MODO != 'duravel' and perfilamento.ocupado():
+        # No modo durável quem perfila é o worker, que devolve o job à fila se estiver ocupado
+        return jsonify({'status': 'error',
+                        'message': 'Já há um perfilamento em andamento; tente de novo depois.'}), 409
+    try:
+        # Relatório pré-gerado pelo agendador ou gerado há pouco para o mesmo pedido: devolve direto,
+        # sem passar pela fila (um pedido perfilado sempre gera, para medir a geração inteira)
+        output_file = None
+        if not perfilar:
+            output_file = ((not parametros and agendador.pronto(tipo))
+                           or cache_relatorios.recente(tipo, parametros, OUTPUT_FOLDER))
+        if output_file:
+            return jsonify({'status': 'success', 'file_path': output_file, 'cache': True}), 200
+
+        tarefa = partial(relatorios.gerar_relatorio, tipo, OUTPUT_FOLDER, parametros=parametros)
+        job_id = enfileirar(tipo, tarefa, parametros, mensagem_erro=f'Erro ao gerar o PDF de {nome}.',
+                            perfilar=perfilar)
+        return jsonify({'status': 'queued', 'job_id': job_id, 'perfilado': perfilar,
+                        'status_url': url_for('api_status', job_id=job_id)}), 202
+    except Exception as e:
+        logging.error(f"Erro ao enfileirar {tipo}: {e}")
+        return jsonify({'status': 'error', 'message': f'Erro ao gerar o PDF de {nome}.'}), 500
+
 # Endpoint para gerar PDF 1 via AJAX
 @app.route('/api/gerar_pdf1', methods=['POST'])
 def api_gerar_pdf1():
-    try:
-        output_file = os.path.join(OUTPUT_FOLDER, "analise_dispersao.pdf")
-        pdf_gerador1.gerar_pdf_analise_dispersao(output_file)
-        if not os.path.exists(output_file):
-            logging.error("O arquivo PDF de Análise de Dispersão não foi gerado.")
-            return jsonify({'status': 'error', 'message': 'Erro ao gerar o PDF de Análise de Dispersão.'}), 500
-        return jsonify({'status': 'success', 'file_path': output_file}), 200
-    except Exception as e:
-        logging.error(f"Erro ao gerar PDF 1: {e}")
-        return jsonify({'status': 'error', 'message': 'Erro ao gerar o PDF de Análise de Dispersão.'}), 500
+    return enfileirar_relatorio('pdf1')
 
 # Endpoint para gerar PDF 2 via AJAX
 @app.route('/api/gerar_pdf2', methods=['POST'])
 def api_gerar_pdf2():
-    try:
-        output_file = os.path.join(OUTPUT_FOLDER, "analise_zscore.pdf")
-        pdf_gerador2.gerar_pdf(output_file)
-        if not os.path.exists(output_file):
-            logging.error("O arquivo PDF de Análise Z-Score não foi gerado.")
-            return jsonify({'status': 'error', 'message': 'Erro ao gerar o PDF de Análise Z-Score.'}), 500
-        return jsonify({'status': 'success', 'file_path': output_file}), 200
-    except Exception as e:
-        logging.error(f"Erro ao gerar PDF 2: {e}")
-        return jsonify({'status': 'error', 'message': 'Erro ao gerar o PDF de Análise Z-Score.'}), 500
+    return enfileirar_relatorio('pdf2')
 
 # Endpoint para gerar PDF 3 via AJAX
 @app.route('/api/gerar_pdf3', methods=['POST'])
 def api_gerar_pdf3():
+    return enfileirar_relatorio('pdf3')
+
+# Endpoint para gerar PDF 4 via AJAX
+@app.route('/api/gerar_pdf4', methods=['POST'])
+def api_gerar_pdf4():
+    return enfileirar_relatorio('pdf4')
+
+# Endpoint para gerar todos os PDFs de uma vez, com uma única coleta de dados
+@app.route('/api/gerar_todos', methods=['POST'])
+def api_gerar_todos():
     try:
-        output_file = os.path.join(OUTPUT_FOLDER, "Variação_Diária.pdf")
-        pdf_gerador3.gerar_pdf_variacao_diaria(output_file)
-        if not os.path.exists(output_file):
-            logging.error("O arquivo PDF de Variação Diária não foi gerado.")
-            return jsonify({'status': 'error', 'message': 'Erro ao gerar o PDF de Variação Diária.'}), 500
-        return jsonify({'status': 'success', 'file_path': output_file}), 200
+        arquivos = [agendador.pronto(tipo) or cache_relatorios.recente(tipo, pasta=OUTPUT_FOLDER)
+                    for tipo in relatorios.RELATORIOS]
+        if all(arquivos):
+            return jsonify({'status': 'success', 'file_path': arquivos[0], 'files': arquivos, 'cache': True}), 200
+
+        tarefa = partial(relatorios.gerar_todos, OUTPUT_FOLDER)
+        job_id = enfileirar('todos', tarefa, mensagem_erro='Erro ao gerar os PDFs.')
+        return jsonify({'status': 'queued', 'job_id': job_id,
+                        'status_url': url_for('api_status', job_id=job_id)}), 202
     except Exception as e:
-        logging.error(f"Erro ao gerar PDF 3: {e}")
-        return jsonify({'status': 'error', 'message': 'Erro ao gerar o PDF de Variação Diária.'}), 500
+        logging.error(f"Erro ao enfileirar a geração combinada: {e}")
+        return jsonify({'status': 'error', 'message': 'Erro ao gerar os PDFs.'}), 500
+
+# Endpoint para acompanhar o andamento de um job (etapas fetch, compute e render)
+@app.route('/api/status/<job_id>')
+def api_status(job_id):
+    if fila_duravel.MODO == 'duravel':
+        # O worker grava no job os tickers desatualizados; este processo não gerou o arquivo
+        job = fila_duravel.obter_status(job_id)
+        if job is None:
+            return jsonify({'status': 'error', 'message': 'Job não encontrado.'}), 404
+        return jsonify(job), 200
+    job = fila_relatorios.obter_status(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job não encontrado.'}), 404
+    if job['status'] == 'success':
+        # Tickers que entraram com a última série guardada porque o provedor falhou
+        job['desatualizados'] = cache_relatorios.desatualizados(job['files'])
+    return jsonify(job), 200
 
-# Endpoint para baixar arquivos PDF
+# Resultados calculados de um relatório em JSON, sem gerar o PDF (cacheados em memória)
+@app.route('/api/dados/<tipo>', methods=['GET', 'POST'])
+def api_dados(tipo):
+    if tipo not in relatorios.RELATORIOS:
+        return jsonify({'status': 'error', 'message': 'Relatório não encontrado.'}), 404
+    try:
+        parametros = ler_parametros(tipo)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    try:
+        return jsonify(dados_relatorios.dados(tipo, parametros)), 200
+    except Exception as e:
+        logging.error(f"Erro ao calcular os dados de {tipo}: {e}")
+        return jsonify({'status': 'error', 'message': 'Erro ao calcular os dados do relatório.'}), 500
+
+# Um gráfico (página) do relatório em PNG ou SVG, desenhado a partir dos resultados cacheados
+@app.route('/api/grafico/<tipo>/<int:pagina>.<formato>')
+def api_grafico(tipo, pagina, formato):
+    if tipo not in relatorios.RELATORIOS or formato not in dados_relatorios.FORMATOS:
+        return jsonify({'status': 'error', 'message': 'Gráfico não encontrado.'}), 404
+    try:
+        parametros = ler_parametros(tipo)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    try:
+        imagem = dados_relatorios.grafico(tipo, pagina, formato, parametros)
+    except Exception as e:
+        logging.error(f"Erro ao desenhar o gráfico {pagina} de {tipo}: {e}")
+        return jsonify({'status': 'error', 'message': 'Erro ao desenhar o gráfico.'}), 500
+    if imagem is None:
+        return jsonify({'status': 'error', 'message': 'Gráfico não encontrado.'}), 404
+    return Response(imagem, mimetype=dados_relatorios.FORMATOS[formato],
+                    headers={'Cache-Control': f'private, max-age={cache_relatorios.TTL_SEGUNDOS}'})
+
+# Painel da variação diária ao vivo
+@app.route('/ao-vivo')
+def ao_vivo():
+    return render_template('ao_vivo.html')
+
+# Variação diária ao vivo por Server-Sent Events: o estado inteiro ao conectar e um evento por cotação
+@app.route('/api/stream/variacao')
+def api_stream_variacao():
+    if not fluxo_variacao.reservar_assinatura():
+        return jsonify({'status': 'error', 'message': 'Limite de conexões ao vivo atingido.'}), 503
+    try:
+        eventos = fluxo_variacao.eventos_sse(request.headers.get('Last-Event-ID'))
+        # O primeiro evento sai já aqui, para erros ao iniciar o fluxo virarem uma resposta de erro
+        primeiro = next(eventos)
+    except Exception as e:
+        fluxo_variacao.liberar_assinatura()
+        logging.error(f"Erro ao iniciar o fluxo de variação ao vivo: {e}")
+        return jsonify({'status': 'error', 'message': 'Erro ao iniciar o fluxo ao vivo.'}), 500
+
+    def corpo():
+        yield primeiro
+        yield from eventos
+
+    resposta = Response(corpo(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    resposta.call_on_close(fluxo_variacao.liberar_assinatura)
+    return resposta
+
+# PDF da variação diária gerado na hora a partir do estado ao vivo, sem baixar dados
+@app.route('/api/gerar_pdf3_ao_vivo', methods=['POST'])
+def api_gerar_pdf3_ao_vivo():
+    try:
+        return jsonify({'status': 'success', 'file_path': fluxo_variacao.gerar_pdf(OUTPUT_FOLDER)}), 200
+    except Exception as e:
+        logging.error(f"Erro ao gerar o PDF da variação ao vivo: {e}")
+        return jsonify({'status': 'error', 'message': 'Erro ao gerar o PDF da variação ao vivo.'}), 500
+
+# Métricas de tempo por etapa e contadores no formato de exposição do Prometheus
+@app.route('/metrics')
+def metrics():
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Endpoint para baixar arquivos PDF. Os links trazem o caminho devolvido pela API ('outputs/...'), mas só
+# se serve o que está dentro da pasta de saída. ETag forte (hash do conteúdo), Last-Modified, 304 e pedidos
+# parciais (Range) ficam a cargo do send_file; os nomes com o hash do conteúdo ficam em cache para sempre
 @app.route('/download/<path:filename>')
 def download_file(filename):
+    relativo = filename[len(OUTPUT_FOLDER) + 1:] if filename.startswith(f'{OUTPUT_FOLDER}/') else filename
+    caminho = safe_join(os.path.abspath(OUTPUT_FOLDER), relativo)
+    # Arquivos ocultos são temporários e índices do cache
+    if caminho is None or os.path.basename(caminho).startswith('.') or not os.path.isfile(caminho):
+        abort(404, description="Arquivo não encontrado.")
     try:
-        return send_file(filename, as_attachment=True)
-    except Exception as e:
+        conteudo = cache_relatorios.hash_arquivo(caminho)
+        resposta = send_file(caminho, as_attachment=True, etag=conteudo, conditional=True)
+    except OSError as e:
         logging.error(f"Erro ao baixar o arquivo {filename}: {e}")
         abort(404, description="Arquivo não encontrado.")
+    # O werkzeug só anuncia o suporte a Range nas respostas parciais; o cliente precisa saber antes para retomar
+    resposta.headers['Accept-Ranges'] = 'bytes'
+    if os.path.splitext(os.path.basename(caminho))[0].endswith(f'_{conteudo[:16]}'):
+        resposta.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta
 
 if __name__ == '__main__':
+    if fila_duravel.MODO == 'local':
+        agendador.iniciar(OUTPUT_FOLDER)
     app.run(debug=True)
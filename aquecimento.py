@@ -0,0 +1,42 @@
+# aquecimento.py
+
+import io
+import time
+import logging
+import relatorios
+import renderizacao
+
+
+def aquecer(tipos=None):
+    # Faz uma vez, no processo que chama (ex.: o mestre do gunicorn antes do fork), o trabalho que
+    # o primeiro relatório pagaria: importar os geradores, varrer as fontes do sistema, carregar
+    # estilos e colormaps e exercitar o backend de PDF
+    inicio = time.perf_counter()
+    modulos = [relatorios.gerador(tipo)[0] for tipo in tipos or relatorios.RELATORIOS]
+
+    import matplotlib
+    import matplotlib.style
+    from matplotlib import font_manager
+    from matplotlib.figure import Figure
+    font_manager.findfont(font_manager.FontProperties(family=['sans-serif']))
+    matplotlib.style.library
+    matplotlib.colormaps['RdYlGn']
+    for modulo in modulos:
+        # Geradores que montam o estilo uma vez por processo expõem estilo()
+        if hasattr(modulo, 'estilo'):
+            modulo.estilo()
+
+    fig = Figure(figsize=(2, 2))
+    ax = fig.subplots()
+    ax.bar(['a', 'b'], [1, -1], color=matplotlib.colormaps['RdYlGn']([0.0, 1.0]))
+    ax.set_title('Variação (%)')
+    fig.savefig(io.BytesIO(), format='pdf')
+
+    try:
+        import yfinance  # noqa: F401
+    except ImportError:
+        pass
+
+    # Os processos de renderização também nascem com os geradores já importados
+    renderizacao.pre_carregar([modulo.__name__ for modulo in modulos])
+    logging.info(f"Aquecimento concluído em {time.perf_counter() - inicio:.2f}s.")
@@ -0,0 +1,256 @@
+# armazem_precos.py
+
+import os
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from urllib.parse import quote
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import provedor_dados
+import metricas
+
+# Pasta do armazém local de preços (um arquivo Parquet por ticker, indexado por data)
+PASTA_PRECOS = os.environ.get('PASTA_PRECOS', os.path.join('dados', 'precos'))
+
+# Intervalo mínimo entre duas consultas de complemento para o mesmo ticker
+VALIDADE_MINUTOS = int(os.environ.get('PRECOS_VALIDADE_MINUTOS', '30'))
+
+# Tempo máximo de busca no provedor por atualização; o que não chegar até lá sai do que já está guardado
+PRAZO_SEGUNDOS = float(os.environ.get('PRECOS_PRAZO_SEGUNDOS', '30'))
+
+# Depois de uma falha, por quanto tempo o ticker é servido do armazém sem consultar o provedor de novo
+ESPERA_FALHA_SEGUNDOS = int(os.environ.get('PRECOS_ESPERA_FALHA_SEGUNDOS', '60'))
+
+COLUNAS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+_falhas = {}  # ticker -> (quando a última atualização falhou, data da última barra guardada)
+_em_busca = {}  # ticker -> Event da busca em andamento no provedor, avisado quando ela termina
+_trava = threading.Lock()
+
+
+def _caminho(ticker):
+    # Tickers como '^GSPC' e 'USDBRL=X' precisam ser escapados para virar nome de arquivo
+    return os.path.join(PASTA_PRECOS, quote(ticker, safe='') + '.parquet')
+
+
+def _metadados(esquema):
+    return {k.decode(): v.decode() for k, v in (esquema.metadata or {}).items() if k.startswith(b'armazem.')}
+
+
+def _ler(ticker):
+    caminho = _caminho(ticker)
+    if not os.path.exists(caminho):
+        return pd.DataFrame(columns=COLUNAS, index=pd.DatetimeIndex([], name='Date')), {}
+    tabela = pq.read_table(caminho)
+    return tabela.to_pandas(), _metadados(tabela.schema)
+
+
+def _ler_metadados(ticker):
+    # Só o esquema do Parquet, sem carregar as barras
+    caminho = _caminho(ticker)
+    return _metadados(pq.read_schema(caminho)) if os.path.exists(caminho) else {}
+
+
+def _gravar(ticker, historico, metadados):
+    os.makedirs(PASTA_PRECOS, exist_ok=True)
+    tabela = pa.Table.from_pandas(historico)
+    tabela = tabela.replace_schema_metadata({
+        **(tabela.schema.metadata or {}),
+        **{k.encode(): str(v).encode() for k, v in metadados.items()},
+    })
+    # Grava em arquivo temporário e troca atomicamente para não expor arquivos pela metade
+    caminho = _caminho(ticker)
+    temporario = f'{caminho}.{os.getpid()}.{threading.get_ident()}.tmp'
+    pq.write_table(tabela, temporario)
+    os.replace(temporario, caminho)
+
+
+def _marcar_falha(ticker, historico):
+    # O ticker segue com a última série guardada, que fica marcada como desatualizada até uma busca dar certo
+    ultima = historico.index[-1] if not historico.empty else None
+    _falhas[ticker] = (time.time(), ultima)
+    metricas.ARMAZEM_TOTAL.incrementar(resultado='desatualizado')
+
+
+def desatualizados(tickers):
+    # {ticker: data da última barra guardada (ou None)} dos tickers cuja última atualização falhou
+    with _trava:
+        return {ticker: _falhas[ticker][1] for ticker in dict.fromkeys(tickers) if ticker in _falhas}
+
+
+def atualizar(tickers, inicio, provedor=None, carregar=True):
+    # Devolve {ticker: histórico}. Com carregar=False só vêm os tickers que precisaram ir ao provedor:
+    # os demais são conferidos pelos metadados, sem ler as barras (ver obter_fechamentos)
+    inicio = pd.Timestamp(inicio).normalize()
+    agora = datetime.datetime.now()
+    amanha = (pd.Timestamp(agora).normalize() + pd.Timedelta(days=1))
+    prazo = time.monotonic() + PRAZO_SEGUNDOS
+    historicos = {}
+    prontos, aguardar, buscar = [], [], {}
+
+    with _trava:
+        # Só decide o que vai ao provedor: a busca roda fora da trava, para uma busca lenta não parar os
+        # outros pedidos do processo. Cada ticker tem no máximo uma busca em andamento; quem o pede
+        # durante ela espera o resultado em vez de repetir a busca
+        for ticker in dict.fromkeys(tickers):
+            metadados = _ler_metadados(ticker)
+            inicio_coberto = pd.Timestamp(metadados.get('armazem.inicio_coberto', amanha))
+            atualizado_em = metadados.get('armazem.atualizado_em')
+
+            if (inicio_coberto <= inicio and atualizado_em is not None
+                    and agora - pd.Timestamp(atualizado_em) < pd.Timedelta(minutes=VALIDADE_MINUTOS)):
+                metricas.ARMAZEM_TOTAL.incrementar(resultado='acerto')
+                prontos.append(ticker)
+            elif ticker in _falhas and time.time() - _falhas[ticker][0] < ESPERA_FALHA_SEGUNDOS:
+                # Falhou há pouco: não insiste no provedor a cada pedido
+                metricas.ARMAZEM_TOTAL.incrementar(resultado='desatualizado')
+                prontos.append(ticker)
+            elif ticker in _em_busca:
+                aguardar.append((ticker, _em_busca[ticker]))
+            else:
+                _em_busca[ticker] = threading.Event()
+                buscar[ticker] = inicio_coberto
+
+    try:
+        # Agrupa os tickers pela data a partir da qual precisam ser baixados,
+        # para que cada grupo vire uma única chamada em lote ao provedor
+        pendentes = {}
+        for ticker, inicio_coberto in buscar.items():
+            historico = historicos[ticker] = _ler(ticker)[0]
+            if historico.empty or inicio < inicio_coberto:
+                # Armazém frio (ou início pedido anterior ao já coberto): baixa a janela inteira
+                baixar_desde = min(inicio, inicio_coberto)
+                metricas.ARMAZEM_TOTAL.incrementar(resultado='frio')
+            else:
+                # Armazém quente: baixa apenas a cauda a partir da última barra, que pode estar incompleta
+                baixar_desde = historico.index[-1]
+                metricas.ARMAZEM_TOTAL.incrementar(resultado='complemento')
+            pendentes.setdefault(baixar_desde, []).append((ticker, inicio_coberto))
+
+        if pendentes:
+            provedor = provedor or provedor_dados.obter_provedor()
+        for baixar_desde, grupo in pendentes.items():
+            inicio_busca = time.perf_counter()
+            try:
+                if time.monotonic() >= prazo:
+                    raise TimeoutError(f"prazo de {PRAZO_SEGUNDOS:.0f}s esgotado")
+                dados = provedor.baixar([ticker for ticker, _ in grupo], baixar_desde, amanha, prazo=prazo)
+            except Exception as e:
+                logging.error(f"Erro ao atualizar o armazém de preços desde {baixar_desde.date()}: {e}")
+                metricas.TICKERS_TOTAL.incrementar(len(grupo), provedor=provedor.nome, resultado='falha')
+                with _trava:
+                    for ticker, _ in grupo:
+                        _marcar_falha(ticker, historicos[ticker])
+                continue
+            finally:
+                # O provedor busca em lote: a latência por ticker é o tempo do lote dividido entre eles
+                duracao = time.perf_counter() - inicio_busca
+                metricas.BUSCA_SEGUNDOS.observar(duracao, provedor=provedor.nome)
+                for _ in grupo:
+                    metricas.BUSCA_TICKER_SEGUNDOS.observar(duracao / len(grupo), provedor=provedor.nome)
+
+            baixados = set(dados.columns.get_level_values(1))
+            falhas = set(dados.attrs.get('falhas', ()))
+            metricas.TICKERS_TOTAL.incrementar(len(baixados), provedor=provedor.nome, resultado='ok')
+            metricas.TICKERS_TOTAL.incrementar(len(grupo) - len(baixados), provedor=provedor.nome, resultado='falha')
+            for ticker, inicio_coberto in grupo:
+                historico = historicos[ticker]
+                if ticker in falhas:
+                    # Não grava: o arquivo continua com a data da última atualização bem-sucedida
+                    with _trava:
+                        _marcar_falha(ticker, historico)
+                    continue
+                if ticker in baixados:
+                    novos = dados.xs(ticker, axis=1, level=1).dropna(how='all')
+                    if novos.empty:
+                        # Veio sem nenhuma barra (falha silenciosa do provedor num lote): gravar cortaria a
+                        # última barra guardada e marcaria o ticker como atualizado
+                        with _trava:
+                            _marcar_falha(ticker, historico)
+                        continue
+                    # Só é substituído o que veio de novo; barras guardadas antes da primeira nova ficam
+                    base = historico[historico.index < novos.index[0]]
+                    historico = pd.concat([base, novos]) if not base.empty else novos
+                    historico = historico[~historico.index.duplicated(keep='last')].sort_index()
+
+                with _trava:
+                    _gravar(ticker, historico, {
+                        'armazem.inicio_coberto': min(baixar_desde, inicio_coberto).isoformat(),
+                        'armazem.atualizado_em': agora.isoformat(),
+                        **_ultima_barra(historico),
+                    })
+                    _falhas.pop(ticker, None)
+                historicos[ticker] = historico
+            logging.info(f"Armazém de preços: {len(baixados)}/{len(grupo)} tickers atualizados desde {baixar_desde.date()}"
+                         + (f", {len(falhas)} servidos do armazém por falha na busca." if falhas else "."))
+    finally:
+        with _trava:
+            for ticker in buscar:
+                _em_busca.pop(ticker).set()
+
+    for ticker, evento in aguardar:
+        if not evento.wait(max(prazo - time.monotonic(), 0)):
+            logging.warning(f"Armazém de preços: busca de {ticker} em outra thread passou do prazo; "
+                            f"usando o que está guardado.")
+    if carregar:
+        for ticker in prontos + [ticker for ticker, _ in aguardar]:
+            historicos[ticker] = _ler(ticker)[0]
+    return historicos
+
+
+def _recortar(historico, inicio, fim=None):
+    historico = historico[historico.index >= pd.Timestamp(inicio)]
+    if fim is not None:
+        historico = historico[historico.index <= pd.Timestamp(fim)]
+    return historico
+
+
+def obter_historicos(tickers, inicio, fim=None):
+    return {ticker: _recortar(historico, inicio, fim)
+            for ticker, historico in atualizar(tickers, inicio).items()}
+
+
+def obter_historico(ticker, inicio, fim=None):
+    return obter_historicos([ticker], inicio, fim)[ticker]
+
+
+def obter_fechamentos(tickers, inicio, fim=None):
+    # Matriz larga (data x ticker) de fechamentos em float32, fatiada da matriz mapeada em memória
+    # compartilhada entre os processos; nenhum histórico completo é carregado no processo
+    import matriz_precos  # matriz_precos depende deste módulo
+    tickers = list(dict.fromkeys(tickers))
+    atualizar(tickers, inicio, carregar=False)
+    fechamentos = matriz_precos.fechamentos(tickers, inicio, fim)
+    ausentes = [ticker for ticker in tickers if ticker not in fechamentos.columns]
+    if ausentes:
+        logging.warning(f"Sem dados para os ativos: {', '.join(ausentes)}.")
+    return fechamentos
+
+
+def _ultima_barra(historico):
+    # Metadados com a última barra (data e fechamento), usados na marca sem reler o arquivo
+    if historico.empty:
+        return {}
+    return {'armazem.ultima_barra': historico.index[-1].isoformat(),
+            'armazem.ultimo_fechamento': repr(float(historico['Close'].iloc[-1]))}
+
+
+def marca_dados(tickers):
+    # Impressão digital dos dados de mercado: última barra (data e fechamento) de cada ticker, lida dos
+    # metadados do Parquet. Se nada mudou desde a última geração, a marca é a mesma e o relatório pode
+    # ser reaproveitado
+    partes = []
+    for ticker in dict.fromkeys(tickers):
+        metadados = _ler_metadados(ticker)
+        if 'armazem.ultima_barra' not in metadados:
+            # Arquivo gravado antes desses metadados existirem (ou ainda inexistente)
+            historico = _ler(ticker)[0]
+            metadados = _ultima_barra(historico)
+            if not metadados:
+                continue
+        partes.append(f"{ticker}:{metadados['armazem.ultima_barra']}:{metadados['armazem.ultimo_fechamento']}")
+    return hashlib.sha256('|'.join(sorted(partes)).encode()).hexdigest()
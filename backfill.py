@@ -0,0 +1,180 @@
+# backfill.py
+#
+# Gera os relatórios como eram em cada pregão de um intervalo passado (arquivo e backtesting):
+#
+#   python backfill.py                                         # último ano, um PDF por relatório e data
+#   python backfill.py --inicio 2026-01-01 --fim 2026-06-30 --relatorios pdf1 pdf3
+#   python backfill.py --combinado --processos 8               # um documento por relatório com todas as datas
+#
+# A matriz de fechamentos é carregada uma vez para a união dos universos; as métricas de todas as
+# datas são calculadas de uma vez ao longo do eixo das datas e as páginas de todas as datas vão juntas
+# para o pool de renderização.
+
+import os
+import time
+import logging
+import argparse
+import pandas as pd
+import armazem_precos
+import motor_variacoes
+import relatorios
+import renderizacao
+import pdf_gerador1
+import pdf_gerador2
+import pdf_gerador3
+from zscore_rolante import serie_z_scores
+
+PASTA_HISTORICO = os.path.join('outputs', 'historico')
+
+
+def historico_dispersao(precos, datas, carteiras=None, horizontes=pdf_gerador1.HORIZONTES, inicio_anual=None):
+    # {data: páginas} do relatório de dispersão. Sem marco fixo, a variação anual de cada data
+    # começa no primeiro pregão do ano daquela data
+    carteiras = carteiras or pdf_gerador1.CARTEIRAS
+    ativos, _ = pdf_gerador1.universo_dados(carteiras)
+    precos = precos.reindex(columns=[a for a in ativos if a in precos.columns])
+    marcos = inicio_anual or datas.to_period('Y').to_timestamp()
+    periodos = {
+        'Variação_Anual': marcos,
+        **{f'Variação_{dias}_Dias': int(dias) for dias in horizontes},
+    }
+    variacoes = motor_variacoes.calcular_variacoes_historicas(precos, periodos, datas)
+
+    paginas = {}
+    for data in datas:
+        df_variacoes = pd.DataFrame({nome: tabela.loc[data] for nome, tabela in variacoes.items()}).dropna(how='all')
+        df_variacoes = pdf_gerador1.montar_tabela(df_variacoes, carteiras)
+        paginas[data] = pdf_gerador1.paginas_dispersao(df_variacoes, carteiras, horizontes,
+                                                       sufixo=f' em {data:%d/%m/%Y}')
+    return paginas
+
+
+def historico_zscore(precos, datas, carteiras=None, janelas=(20,)):
+    # {data: páginas} do relatório de Z-score: a série completa de cada janela é calculada uma vez
+    # e cada data usa a última linha até ela
+    carteiras = carteiras or pdf_gerador2.CARTEIRAS
+    series = {}
+    for nome_carteira, carteira in carteiras.items():
+        ativos = list(carteira)
+        dados = precos.reindex(columns=[a for a in ativos if a in precos.columns]).dropna(how='all').ffill()
+        if dados.empty:
+            logging.error(f"Nenhum dado disponível para {nome_carteira}.")
+            continue
+        series[nome_carteira] = {janela: serie_z_scores(dados, janela).reindex(datas, method='ffill')
+                                 for janela in janelas}
+
+    paginas = {}
+    for data in datas:
+        analises = []
+        for nome_carteira, por_janela in series.items():
+            carteira = carteiras[nome_carteira]
+            z_scores = pd.DataFrame({janela: serie.loc[data] for janela, serie in por_janela.items()}).T
+            if z_scores.isna().all().all():
+                continue
+            z_scores = z_scores.reindex(columns=list(carteira), fill_value=0)
+            z_scores.columns = [carteira[ativo] for ativo in z_scores.columns]
+            analises.append((z_scores, nome_carteira))
+        paginas[data] = pdf_gerador2.paginas_zscore(analises, data.strftime('%d/%m/%Y'))
+    return paginas
+
+
+def historico_variacao(precos, datas, carteiras=None):
+    # {data: páginas} do relatório de variação diária: variação de cada pregão da categoria em
+    # relação ao anterior, e cada data usa o último pregão até ela
+    carteiras = carteiras or pdf_gerador3.CARTEIRAS
+    categorias = {}
+    for categoria, carteira in carteiras.items():
+        dados = precos.reindex(columns=[t for t in carteira if t in precos.columns]).dropna(how='all')
+        variacao = (dados - dados.shift(1)) / dados.shift(1) * 100
+        categorias[categoria] = (variacao, dados.index.searchsorted(datas, side='right') - 1)
+
+    paginas = {}
+    for i, data in enumerate(datas):
+        resultados = {}
+        for categoria, (variacao, posicoes) in categorias.items():
+            posicao = posicoes[i]
+            if posicao < 1:
+                resultados[categoria] = (pd.Series(dtype=float), None)
+                continue
+            linha = variacao.iloc[posicao].dropna().rename(index=carteiras[categoria])
+            resultados[categoria] = (linha, variacao.index[posicao].strftime('%d/%m/%Y'))
+        paginas[data] = pdf_gerador3.paginas_variacao(resultados)
+    return paginas
+
+
+# Relatório -> (nome nas métricas, função que monta as páginas de todas as datas)
+HISTORICOS = {
+    'pdf1': ('dispersao', historico_dispersao),
+    'pdf2': ('zscore', historico_zscore),
+    'pdf3': ('variacao_diaria', historico_variacao),
+}
+
+
+def executar(inicio, fim, tipos=None, pasta=PASTA_HISTORICO, combinado=False, sobrescrever=False):
+    tipos = list(tipos or HISTORICOS)
+    inicio, fim = pd.Timestamp(inicio), pd.Timestamp(fim)
+
+    # Uma única carga para a união dos universos, desde o que a primeira data precisa
+    tickers, _ = relatorios.universo_combinado(tipos)
+    inicio_dados = min(pd.Timestamp(relatorios.gerador(tipo)[0].universo_dados(data_referencia=inicio)[1])
+                       for tipo in tipos)
+    precos = armazem_precos.obter_fechamentos(tickers, inicio_dados, fim)
+    if precos.empty:
+        logging.error("Nenhum dado disponível para o intervalo pedido.")
+        return []
+    datas = precos.index[(precos.index >= inicio) & (precos.index <= fim)]
+    if datas.empty:
+        logging.error(f"Nenhum pregão entre {inicio.date()} e {fim.date()}.")
+        return []
+    logging.info(f"Backfill: {len(datas)} pregões de {inicio.date()} a {fim.date()}, {len(tickers)} tickers.")
+
+    os.makedirs(pasta, exist_ok=True)
+    renderizacao.pre_carregar(['pdf_gerador1', 'pdf_gerador2', 'pdf_gerador3'])
+    arquivos = []
+    for tipo in tipos:
+        relatorio, montar = HISTORICOS[tipo]
+        nome, extensao = os.path.splitext(relatorios.RELATORIOS[tipo][1])
+        comeco = time.perf_counter()
+        paginas = montar(precos, datas)
+
+        if combinado:
+            destino = os.path.join(pasta, f'{nome}_{datas[0]:%Y-%m-%d}_{datas[-1]:%Y-%m-%d}{extensao}')
+            documentos = {destino: [pagina for data in datas for pagina in paginas[data]]}
+        else:
+            documentos = {os.path.join(pasta, f'{nome}_{data:%Y-%m-%d}{extensao}'): paginas[data] for data in datas}
+            if not sobrescrever:
+                documentos = {destino: p for destino, p in documentos.items() if not os.path.exists(destino)}
+
+        # Grava em temporários e troca no fim, para uma execução interrompida não deixar PDFs pela metade
+        temporarios = {destino: os.path.join(pasta, f'.{os.path.basename(destino)}.tmp') for destino in documentos}
+        renderizacao.renderizar_pdfs({temporarios[destino]: p for destino, p in documentos.items()},
+                                     relatorio=relatorio)
+        for destino, temporario in temporarios.items():
+            os.replace(temporario, destino)
+        arquivos.extend(documentos)
+        logging.info(f"Backfill {tipo}: {len(documentos)} arquivo(s) em {time.perf_counter() - comeco:.1f}s.")
+    return arquivos
+
+
+def main():
+    hoje = pd.Timestamp.today().normalize()
+    parser = argparse.ArgumentParser(description='Gera os relatórios para cada pregão de um intervalo passado.')
+    parser.add_argument('--inicio', default=(hoje - pd.DateOffset(years=1)).date().isoformat())
+    parser.add_argument('--fim', default=hoje.date().isoformat())
+    parser.add_argument('--relatorios', nargs='*', choices=list(HISTORICOS), default=list(HISTORICOS))
+    parser.add_argument('--pasta', default=PASTA_HISTORICO)
+    parser.add_argument('--combinado', action='store_true', help='Um documento por relatório com todas as datas.')
+    parser.add_argument('--sobrescrever', action='store_true', help='Refaz PDFs de datas que já existem.')
+    parser.add_argument('--processos', type=int, help='Processos de renderização (padrão: RENDER_PROCESSOS).')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    if args.processos:
+        renderizacao.PROCESSOS = args.processos
+    inicio = time.perf_counter()
+    arquivos = executar(args.inicio, args.fim, args.relatorios, args.pasta, args.combinado, args.sobrescrever)
+    logging.info(f"{len(arquivos)} arquivo(s) gerados em {time.perf_counter() - inicio:.1f}s.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+# benchmarks/benchmark_geradores.py
+#
+# Mede os três geradores sem acesso à rede, a partir de fixtures de preços (gravadas com
+# provedor_dados.gravar_fixtures ou sintéticas), e grava os resultados em JSON para comparar execuções.
+#
+#   python benchmarks/benchmark_geradores.py                       # universo sintético: 50, 500 e 5000 ativos
+#   python benchmarks/benchmark_geradores.py --escalas 50 500      # só algumas escalas
+#   python benchmarks/benchmark_geradores.py --fixtures dados/fixtures --escalas   # só o universo real gravado
+#
+# Cada caso (gerador x escala) roda num processo próprio, com armazém de preços vazio, para que o
+# pico de memória e os tempos de um caso não contaminem os outros. O pico de memória é o do processo
+# que gera o relatório; com RENDER_PROCESSOS > 1 as páginas são desenhadas em outros processos.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# Geradores medidos: nome usado nas métricas -> (módulo, função geradora)
+GERADORES = {
+    'dispersao': ('pdf_gerador1', 'gerar_pdf_analise_dispersao'),
+    'zscore': ('pdf_gerador2', 'gerar_pdf'),
+    'variacao_diaria': ('pdf_gerador3', 'gerar_pdf_variacao_diaria'),
+}
+
+ESCALAS = [50, 500, 5000]
+ETAPAS = ['fetch', 'compute', 'render']
+
+# Histórico sintético suficiente para todos os horizontes dos relatórios
+INICIO_SINTETICO = pd.Timestamp('2023-06-01')
+
+
+def _pico_rss_mb():
+    # ru_maxrss vem em KiB no Linux e em bytes no macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024) if platform.system() == 'Darwin' else pico / 1024
+
+
+def _ticker_sintetico(i):
+    return f'SINT{i:05d}'
+
+
+def gravar_fixtures_sinteticas(pasta, quantidade, semente=42):
+    # Passeio aleatório geométrico em dias úteis até hoje, um Parquet por ticker (formato do ProvedorReplay)
+    os.makedirs(pasta, exist_ok=True)
+    datas = pd.bdate_range(INICIO_SINTETICO, pd.Timestamp.today().normalize(), name='Date')
+    gerador = np.random.default_rng(semente)
+    retornos = gerador.normal(0, 0.012, size=(len(datas), quantidade))
+    fechamentos = 100 * np.exp(np.cumsum(retornos, axis=0))
+    for i in range(quantidade):
+        fechamento = fechamentos[:, i]
+        historico = pd.DataFrame({
+            'Open': fechamento * (1 + gerador.normal(0, 0.002, len(datas))),
+            'High': fechamento * 1.01,
+            'Low': fechamento * 0.99,
+            'Close': fechamento,
+            'Volume': gerador.integers(1_000, 1_000_000, len(datas)).astype(float),
+        }, index=datas)
+        historico.to_parquet(os.path.join(pasta, quote(_ticker_sintetico(i), safe='') + '.parquet'))
+    return pasta
+
+
+def carteiras_sinteticas(carteiras_padrao, quantidade):
+    # Distribui 'quantidade' tickers sintéticos entre as mesmas carteiras do relatório
+    nomes = list(carteiras_padrao)
+    carteiras = {nome: {} for nome in nomes}
+    for i in range(quantidade):
+        ticker = _ticker_sintetico(i)
+        carteiras[nomes[i % len(nomes)]][ticker] = ticker
+    return carteiras
+
+
+def executar_caso(gerador, escala, saida):
+    # Roda dentro do processo filho: o ambiente (provedor, pastas) já foi preparado pelo processo pai
+    import importlib
+    import metricas
+
+    nome_modulo, nome_funcao = GERADORES[gerador]
+    modulo = importlib.import_module(nome_modulo)
+    gerar = getattr(modulo, nome_funcao)
+    carteiras = carteiras_sinteticas(modulo.CARTEIRAS, escala) if escala else None
+
+    # O callback de progresso marca o início de cada etapa: o pico de memória visto nesse momento
+    # é o pico acumulado até o fim da etapa anterior
+    picos, atual = {}, [None]
+
+    def progresso(etapa):
+        if atual[0] is not None:
+            picos[atual[0]] = _pico_rss_mb()
+        atual[0] = etapa
+
+    arquivo = os.path.join(os.path.dirname(saida), f'{gerador}.pdf')
+    inicio = time.perf_counter()
+    gerar(arquivo, progresso=progresso, carteiras=carteiras)
+    total = time.perf_counter() - inicio
+    if atual[0] is not None:
+        picos[atual[0]] = _pico_rss_mb()
+
+    etapas = {}
+    for etapa in ETAPAS:
+        segundos, _ = metricas.ETAPA_SEGUNDOS.resumo(relatorio=gerador, etapa=etapa)
+        etapas[etapa] = {'segundos': round(segundos, 4), 'pico_rss_mb': round(picos.get(etapa, 0.0), 1)}
+    paginas, quantidade_paginas = metricas.PAGINA_SEGUNDOS.resumo(relatorio=gerador)
+
+    resultado = {
+        'gerador': gerador,
+        'ativos': escala or len(modulo.universo_dados()[0]),
+        'universo': 'sintetico' if escala else 'gravado',
+        'segundos': round(total, 4),
+        'pico_rss_mb': round(_pico_rss_mb(), 1),
+        'pdf_bytes': os.path.getsize(arquivo) if os.path.exists(arquivo) else 0,
+        'paginas': quantidade_paginas,
+        'segundos_por_pagina': round(paginas / quantidade_paginas, 4) if quantidade_paginas else None,
+        'etapas': etapas,
+    }
+    with open(saida, 'w') as f:
+        json.dump(resultado, f)
+
+
+def _rodar_em_subprocesso(gerador, escala, fixtures, pasta, processos, detalhado):
+    saida = os.path.join(pasta, 'resultado.json')
+    ambiente = {
+        **os.environ,
+        'PROVEDOR_DADOS': 'replay',
+        'PASTA_FIXTURES': fixtures,
+        'PASTA_PRECOS': os.path.join(pasta, 'precos'),
+    }
+    if processos is not None:
+        ambiente['RENDER_PROCESSOS'] = str(processos)
+    comando = [sys.executable, os.path.abspath(__file__), '--caso', gerador, str(escala), saida]
+    saida_padrao = None if detalhado else subprocess.DEVNULL
+    subprocess.run(comando, env=ambiente, cwd=pasta, check=True, stdout=saida_padrao, stderr=saida_padrao)
+    with open(saida) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline dos geradores de PDF.')
+    parser.add_argument('--escalas', type=int, nargs='*', default=ESCALAS,
+                        help='Quantidades de ativos sintéticos (padrão: 50 500 5000).')
+    parser.add_argument('--fixtures', help='Pasta com fixtures gravadas do universo real (ProvedorReplay).')
+    parser.add_argument('--geradores', nargs='*', choices=list(GERADORES), default=list(GERADORES))
+    parser.add_argument('--processos', type=int, help='Processos de renderização (RENDER_PROCESSOS).')
+    parser.add_argument('--saida', help='Arquivo JSON de resultados.')
+    parser.add_argument('--detalhado', action='store_true', help='Mostra a saída dos geradores.')
+    parser.add_argument('--caso', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.caso:
+        gerador, escala, saida = args.caso
+        executar_caso(gerador, int(escala), saida)
+        return
+
+    saida = args.saida or os.path.join(RAIZ, 'benchmarks',
+                                       f'resultados_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
+    temporaria = tempfile.mkdtemp(prefix='benchmark_geradores_')
+    resultados = []
+    try:
+        # Universo real gravado (escala 0) e universos sintéticos, que compartilham as mesmas fixtures
+        casos = [(0, os.path.abspath(args.fixtures))] if args.fixtures else []
+        if args.escalas:
+            fixtures = os.path.join(temporaria, 'fixtures')
+            print(f'Gravando fixtures sintéticas para {max(args.escalas)} ativos...')
+            gravar_fixtures_sinteticas(fixtures, max(args.escalas))
+            casos += [(escala, fixtures) for escala in args.escalas]
+
+        for escala, fixtures in casos:
+            for gerador in args.geradores:
+                pasta = tempfile.mkdtemp(dir=temporaria)
+                resultado = _rodar_em_subprocesso(gerador, escala, fixtures, pasta, args.processos, args.detalhado)
+                resultados.append(resultado)
+                etapas = ' '.join(f"{etapa}={info['segundos']:.2f}s" for etapa, info in resultado['etapas'].items())
+                print(f"{gerador:<16} {resultado['ativos']:>6} ativos  {resultado['segundos']:8.2f}s  "
+                      f"{resultado['pico_rss_mb']:8.1f} MB  {resultado['pdf_bytes'] / 1024:9.1f} KiB  {etapas}")
+                shutil.rmtree(pasta, ignore_errors=True)
+    finally:
+        shutil.rmtree(temporaria, ignore_errors=True)
+
+    with open(saida, 'w') as f:
+        json.dump({
+            'executado_em': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'processos_render': args.processos,
+            'resultados': resultados,
+        }, f, indent=2, ensure_ascii=False)
+    print(f'Resultados gravados em {saida}')
+
+
+if __name__ == '__main__':
+    main()
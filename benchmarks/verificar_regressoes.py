@@ -0,0 +1,475 @@
+# benchmarks/verificar_regressoes.py
+#
+# Confere as implementações vetorizadas contra as versões em pandas que elas substituíram (copiadas
+# do histórico do repositório para este arquivo) sobre fixtures sintéticas, sem rede nem armazém de
+# preços. Também confere a dispersão em universos grandes (rótulos sem sobreposição, pontos reduzidos),
+# o agendador (expressões cron) contra uma varredura minuto a minuto e os prazos de posse da fila
+# durável num banco temporário. Rode depois de mexer nesses módulos:
+#
+#   python benchmarks/verificar_regressoes.py                      # todas as verificações
+#   python benchmarks/verificar_regressoes.py variacoes zscore     # só algumas
+#
+# Sai com código 1 se alguma diferença passar da tolerância.
+
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# Data de referência fixa para as fixtures (e os resultados) não mudarem de um dia para o outro
+HOJE = pd.Timestamp('2025-09-30 15:00')
+INICIO_ANO = pd.Timestamp('2025-01-01')
+
+RTOL, ATOL = 1e-7, 1e-9
+
+
+def precos_sinteticos(quantidade=40, semente=7, inicio='2023-06-01', lacunas=0.03):
+    # Passeio aleatório geométrico em dias úteis até HOJE, com lacunas (NaN) espalhadas e alguns zeros
+    # (cotação inválida) no segundo semestre de 2024, longe das datas-base dos horizontes
+    gerador = np.random.default_rng(semente)
+    datas = pd.bdate_range(inicio, HOJE.normalize(), name='Date')
+    fechamentos = 100 * np.exp(np.cumsum(gerador.normal(0, 0.012, size=(len(datas), quantidade)), axis=0))
+    fechamentos[gerador.random(fechamentos.shape) < lacunas] = np.nan
+    fechamentos[:3] = 100.0
+    faixa_zeros = np.flatnonzero((datas >= '2024-06-01') & (datas <= '2024-10-31'))
+    fechamentos[gerador.choice(faixa_zeros, 10), gerador.integers(0, quantidade, 10)] = 0.0
+    return pd.DataFrame(fechamentos, index=datas, columns=[f'SINT{i:05d}' for i in range(quantidade)])
+
+
+def _comparar(nome, esperado, obtido, falhas):
+    esperado, obtido = np.asarray(esperado, dtype=float), np.asarray(obtido, dtype=float)
+    if esperado.shape != obtido.shape:
+        falhas.append(f'{nome}: formato {obtido.shape}, esperado {esperado.shape}')
+        return
+    nan_diferente = np.isnan(esperado) != np.isnan(obtido)
+    validos = ~np.isnan(esperado) & ~np.isnan(obtido)
+    desvio = float(np.max(np.abs(esperado[validos] - obtido[validos]), initial=0.0))
+    if nan_diferente.any():
+        falhas.append(f'{nome}: {int(nan_diferente.sum())} valor(es) ausente(s) em só um dos lados')
+    elif not np.allclose(esperado[validos], obtido[validos], rtol=RTOL, atol=ATOL):
+        falhas.append(f'{nome}: desvio máximo {desvio:.3g}')
+    print(f'  {nome:<44} desvio máximo {desvio:.3g}')
+
+
+def _conferir(nome, condicao, falhas):
+    if not condicao:
+        falhas.append(nome)
+    print(f"  {nome:<60} {'ok' if condicao else 'FALHOU'}")
+
+
+# --- motor_variacoes (pdf_gerador1 antes de a2be712) ---
+
+def _variacoes_antigas(precos, inicio_ano, horizontes, hoje):
+    # Um laço por ativo sobre o histórico dele: limpa lacunas e zeros, fechamento exato (ou asof) em
+    # cada data-base e o primeiro pregão do ano como base da variação anual
+    periodos = {dias: hoje - pd.offsets.BDay(dias) for dias in horizontes}
+    linhas = {}
+    for ativo in precos.columns:
+        historico = precos[[ativo]].rename(columns={ativo: 'Close'})
+        historico = historico[historico.index <= hoje]
+        if historico.isnull().any().any():
+            historico = historico.dropna()
+        if (historico == 0).any().any():
+            historico = historico[historico != 0]
+        historico_ano = historico[historico.index >= inicio_ano]
+        if historico_ano.empty:
+            continue
+        preco_atual = historico_ano['Close'].iloc[-1]
+        preco_inicio = historico_ano['Close'].iloc[0]
+        linha = {'Variação_Anual': (preco_atual - preco_inicio) / preco_inicio * 100}
+        for dias, data in periodos.items():
+            if data in historico.index:
+                base = historico['Close'].loc[data]
+            else:
+                base = historico['Close'].asof(data)
+            linha[f'Variação_{dias}_Dias'] = (preco_atual - base) / base * 100
+        linhas[ativo] = linha
+    return pd.DataFrame.from_dict(linhas, orient='index')
+
+
+def verificar_variacoes():
+    import motor_variacoes
+    falhas = []
+    horizontes = [7, 45, 90]
+    precos = precos_sinteticos()
+    # Um ativo que só começa depois do início do ano e outro que some antes dele
+    precos.loc[precos.index < '2025-03-03', 'SINT00001'] = np.nan
+    precos.loc[precos.index > '2024-11-29', 'SINT00002'] = np.nan
+    periodos = {'Variação_Anual': INICIO_ANO, **{f'Variação_{dias}_Dias': dias for dias in horizontes}}
+
+    antigas = _variacoes_antigas(precos, INICIO_ANO, horizontes, HOJE)
+    novas = motor_variacoes.calcular_variacoes(precos, periodos, HOJE)
+    novas = novas[novas['Variação_Anual'].notna()]  # pdf_gerador1 descarta quem não tem variação anual
+    if sorted(novas.index) != sorted(antigas.index):
+        falhas.append(f'calcular_variacoes: ativos {sorted(set(novas.index) ^ set(antigas.index))} '
+                      f'em só um dos lados')
+    else:
+        _comparar('calcular_variacoes', antigas.loc[novas.index, list(periodos)], novas[list(periodos)], falhas)
+
+    # Histórico: cada data de referência contra o laço antigo refeito naquela data
+    datas = precos.index[(precos.index >= '2025-06-02') & (precos.index <= HOJE)][::7]
+    historicas = motor_variacoes.calcular_variacoes_historicas(precos, periodos, datas)
+    esperado, obtido = [], []
+    for data in datas:
+        antigas = _variacoes_antigas(precos, INICIO_ANO, horizontes, data).reindex(precos.columns)
+        novas = pd.DataFrame({nome: historicas[nome].loc[data] for nome in periodos})
+        # O laço antigo pulava o ativo inteiro quando não havia variação anual
+        novas[novas['Variação_Anual'].isna()] = np.nan
+        esperado.append(antigas[list(periodos)].to_numpy())
+        obtido.append(novas.to_numpy())
+    _comparar(f'calcular_variacoes_historicas ({len(datas)} datas)', esperado, obtido, falhas)
+    return falhas
+
+
+# --- zscore_rolante (pdf_gerador2 antes de 0e0105f) ---
+
+def _zscore_antigo(dados, dias_media):
+    # Última cotação contra a média e o desvio padrão das últimas 'dias_media' linhas
+    recente = dados.tail(dias_media).ffill().bfill()
+    return (recente.iloc[-1] - recente.mean()) / recente.std()
+
+
+def verificar_zscore():
+    from zscore_rolante import ZScoreRolante, serie_z_scores
+    falhas = []
+    janelas = [20, 60, 120, 250]
+    # A matriz que o relatório passa ao motor: sem linhas vazias e com as lacunas preenchidas para frente
+    dados = precos_sinteticos(semente=11).replace(0.0, np.nan).dropna(how='all').ffill()
+
+    z = ZScoreRolante(janelas, dados.columns).carregar(dados).z_scores()
+    for janela in janelas:
+        _comparar(f'ZScoreRolante.carregar (janela {janela})', _zscore_antigo(dados, janela), z.loc[janela], falhas)
+
+    # Pregões acrescentados um a um devem dar o mesmo que carregar o histórico inteiro
+    corte = len(dados) - 30
+    incremental = ZScoreRolante(janelas, dados.columns).carregar(dados.iloc[:corte])
+    for data, linha in dados.iloc[corte:].iterrows():
+        incremental.adicionar(linha, data)
+    for janela in janelas:
+        _comparar(f'ZScoreRolante.adicionar (janela {janela})', _zscore_antigo(dados, janela),
+                  incremental.z_scores().loc[janela], falhas)
+
+    # Série completa contra a janela móvel do pandas
+    for janela in (20, 120):
+        movel = dados.rolling(janela, min_periods=2)
+        _comparar(f'serie_z_scores (janela {janela})', (dados - movel.mean()) / movel.std(),
+                  serie_z_scores(dados, janela), falhas)
+    return falhas
+
+
+# --- regressao_pares (um ajuste por par com pandas, como seria sem as matrizes) ---
+
+def _pares_por_par(retornos, minimo):
+    colunas = retornos.columns
+    estatisticas = {nome: np.full((len(colunas),) * 2, np.nan)
+                    for nome in ('n', 'beta', 'alfa', 'r2', 'correlacao', 'desvio_residuo')}
+    for i, y in enumerate(colunas):
+        for j, x in enumerate(colunas):
+            if i == j:
+                continue
+            dados = retornos[[y, x]].dropna()
+            estatisticas['n'][i, j] = len(dados)
+            if len(dados) < minimo:
+                continue
+            beta = dados[y].cov(dados[x]) / dados[x].var()
+            alfa = dados[y].mean() - beta * dados[x].mean()
+            correlacao = dados[y].corr(dados[x])
+            estatisticas['beta'][i, j], estatisticas['alfa'][i, j] = beta, alfa
+            estatisticas['correlacao'][i, j], estatisticas['r2'][i, j] = correlacao, correlacao ** 2
+            estatisticas['desvio_residuo'][i, j] = np.std(dados[y] - alfa - beta * dados[x], ddof=2)
+    return estatisticas
+
+
+def _residuos_por_par(retornos, estatisticas, dias=5):
+    colunas = retornos.columns
+    z = np.full((len(colunas),) * 2, np.nan)
+    recentes = retornos.iloc[-dias:]
+    for i, y in enumerate(colunas):
+        for j, x in enumerate(colunas):
+            dados = recentes[[y, x]].dropna()
+            if i != j and not dados.empty:
+                ultimo = dados.iloc[-1]
+                z[i, j] = ((ultimo[y] - estatisticas['alfa'][i, j] - estatisticas['beta'][i, j] * ultimo[x])
+                           / estatisticas['desvio_residuo'][i, j])
+    return z
+
+
+def verificar_pares():
+    import regressao_pares
+    falhas = []
+    # Retornos com um fator comum (para haver correlação), lacunas e um ativo no limite de observações
+    gerador = np.random.default_rng(5)
+    precos = precos_sinteticos(quantidade=25, semente=5).iloc[-300:].replace(0.0, np.nan)
+    fator = np.cumsum(gerador.normal(0, 0.01, len(precos)))
+    precos = precos * np.exp(np.outer(fator, gerador.uniform(-1, 1, precos.shape[1])))
+    precos.iloc[:-43, 3] = np.nan  # em torno de MIN_OBSERVACOES retornos em comum com os outros
+    retornos = regressao_pares.retornos_log(precos)
+
+    minimo = regressao_pares.MIN_OBSERVACOES
+    esperado = _pares_por_par(retornos, minimo)
+    obtido = regressao_pares.estatisticas_pares(retornos, minimo)
+    diagonal = np.eye(len(retornos.columns), dtype=bool)
+    for nome in ('n', 'beta', 'alfa', 'r2', 'correlacao', 'desvio_residuo'):
+        matriz = np.array(obtido[nome], dtype=float)
+        matriz[diagonal] = np.nan
+        _comparar(f'estatisticas_pares: {nome}', esperado[nome], matriz, falhas)
+
+    z, _ = regressao_pares.residuos_recentes(retornos, obtido)
+    z[diagonal] = np.nan
+    _comparar('residuos_recentes', _residuos_por_par(retornos, esperado), z, falhas)
+    return falhas
+
+
+# --- dispersão em universos grandes (pdf_gerador1: rótulos sem sobreposição e pontos reduzidos) ---
+
+def _sobrepostas(caixas):
+    # Pares de caixas (x0, y0, x1, y1) que se cruzam
+    return [(a, b) for a in range(len(caixas)) for b in range(a + 1, len(caixas))
+            if caixas[a][0] < caixas[b][2] and caixas[b][0] < caixas[a][2]
+            and caixas[a][1] < caixas[b][3] and caixas[b][1] < caixas[a][3]]
+
+
+def verificar_dispersao():
+    import io
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import modelos_graficos
+    import pdf_gerador1
+    falhas = []
+    gerador = np.random.default_rng(13)
+
+    # O posicionador sozinho: caixas aceitas nunca se cruzam nem saem da área
+    ancoras = gerador.uniform(0, 500, (400, 2))
+    tamanhos = [(gerador.uniform(20, 80), 10.4) for _ in ancoras]
+    area = (0, 0, 500, 500)
+    escolhas = modelos_graficos.posicionar_rotulos(ancoras, tamanhos, pdf_gerador1._deslocamentos_rotulo, area)
+    caixas = [(x + dx - w / 2, y + dy - h / 2, x + dx + w / 2, y + dy + h / 2)
+              for (x, y), (w, h), escolha in zip(ancoras, tamanhos, escolhas) if escolha is not None
+              for dx, dy in [escolha]]
+    _conferir(f'posicionar_rotulos: {len(caixas)}/{len(ancoras)} colocados sem sobreposição',
+              not _sobrepostas(caixas), falhas)
+    _conferir('posicionar_rotulos: todos dentro da área',
+              all(c[0] >= 0 and c[1] >= 0 and c[2] <= 500 and c[3] <= 500 for c in caixas), falhas)
+
+    # A página inteira, medida no desenho: rótulos visíveis, pontos desenhados e tamanho do PDF
+    limite_rotulos = 4 * pdf_gerador1.ROTULOS_EXTREMOS  # extremos dos dois lados + até 2x outliers
+    for quantidade in (500, 5000, 20000):
+        valores = np.sort(gerador.standard_t(3, quantidade) * 8)
+        nomes = [f'Ativo {i:05d}' for i in range(quantidade)]
+        fig = pdf_gerador1.desenhar_dispersao(nomes, valores, 'Bolsa', 'Teste')
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='pdf')
+        # As caixas reais dos textos, medidas num desenho do Agg (a estimativa do posicionador é outra)
+        canvas = FigureCanvasAgg(fig)
+        canvas.draw()
+        renderizador = canvas.get_renderer()
+        modelo = modelos_graficos.obter(pdf_gerador1.ModeloDispersao)
+        visiveis = [rotulo for rotulo in modelo.rotulos if rotulo.get_visible()]
+        caixas = [tuple(rotulo.get_window_extent(renderizador).extents) for rotulo in visiveis]
+        eixos = modelo.axs.get_window_extent(renderizador).extents
+        desenhados = len(modelo.scatter.get_offsets())
+        extremos = {float(valores.min()), float(valores.max())}
+
+        _conferir(f'{quantidade} ativos: {len(visiveis)} rótulos (máx. {limite_rotulos})',
+                  0 < len(visiveis) <= limite_rotulos, falhas)
+        _conferir(f'{quantidade} ativos: rótulos sem sobreposição no desenho', not _sobrepostas(caixas), falhas)
+        _conferir(f'{quantidade} ativos: rótulos dentro dos eixos',
+                  all(c[0] >= eixos[0] - 1 and c[1] >= eixos[1] - 1 and c[2] <= eixos[2] + 1 and c[3] <= eixos[3] + 1
+                      for c in caixas), falhas)
+        maximo = quantidade if quantidade <= pdf_gerador1.LIMITE_PONTOS else pdf_gerador1.LIMITE_PONTOS + limite_rotulos
+        _conferir(f'{quantidade} ativos: {desenhados} pontos desenhados (máx. {maximo})', desenhados <= maximo, falhas)
+        _conferir(f'{quantidade} ativos: mínimo e máximo continuam desenhados',
+                  extremos <= set(modelo.scatter.get_offsets()[:, 1].tolist()), falhas)
+        print(f'  {quantidade} ativos: página com {len(buffer.getvalue()) / 1024:.0f} KiB')
+    return falhas
+
+
+# --- agendador (expressões cron contra uma varredura minuto a minuto) ---
+
+# (expressão, fuso, de, até): horários de fechamento em fusos com e sem horário de verão, passos, listas
+# e dia do mês com dia da semana (basta um dos dois). Horários dentro da troca de horário (1h-3h) ficam
+# de fora: no cron eles dependem da implementação
+CASOS_CRON = [
+    ('30 16 * * 1-5', 'America/New_York', '2025-02-24', '2025-03-20'),
+    ('30 16 * * 1-5', 'America/New_York', '2025-10-20', '2025-11-12'),
+    ('30 18 * * 1-5', 'America/Sao_Paulo', '2025-02-24', '2025-03-20'),
+    ('30 16 * * 1-5', 'Asia/Hong_Kong', '2025-12-20', '2026-01-10'),
+    ('*/15 9-17/4 * * 1-5', 'Europe/London', '2025-03-24', '2025-04-04'),
+    ('5/20 8 1,15 2-3 *', 'Europe/London', '2025-01-25', '2025-03-20'),
+    ('0 12 13 * 5', 'UTC', '2025-05-25', '2025-07-20'),
+    ('0 0 * * 0,7', 'America/Sao_Paulo', '2025-06-01', '2025-06-30'),
+]
+
+CRON_INVALIDOS = ['60 * * * *', '* * *', '5-1 * * * *', '*/0 * * * *', 'a * * * *', '0 0 0 * *', '0 0 * 13 *']
+
+
+def _campo_casa(campo, valor, minimo, maximo):
+    # Confere um valor contra um campo cron sem montar o conjunto de valores
+    for parte in campo.split(','):
+        faixa, _, passo = parte.partition('/')
+        if faixa == '*':
+            inicio, fim = minimo, maximo
+        elif '-' in faixa:
+            inicio, fim = map(int, faixa.split('-'))
+        else:
+            inicio = int(faixa)
+            fim = maximo if passo else inicio
+        if inicio <= valor <= fim and (valor - inicio) % int(passo or 1) == 0:
+            return True
+    return False
+
+
+def _horarios_cron(cron, fuso, de, ate):
+    # Instantes (UTC) em que a expressão casa, percorrendo todos os minutos do intervalo
+    from zoneinfo import ZoneInfo
+    minuto, hora, dia, mes, semana = cron.split()
+    instantes = []
+    for momento in pd.date_range(pd.Timestamp(de, tz='UTC'), pd.Timestamp(ate, tz='UTC'), freq='min'):
+        local = momento.tz_convert(ZoneInfo(fuso))
+        dia_semana = (local.weekday() + 1) % 7
+        no_mes = _campo_casa(dia, local.day, 1, 31)
+        na_semana = _campo_casa(semana, dia_semana, 0, 7) or (dia_semana == 0 and _campo_casa(semana, 7, 0, 7))
+        no_dia = no_mes and na_semana if '*' in (dia, semana) else no_mes or na_semana
+        if (no_dia and _campo_casa(mes, local.month, 1, 12) and _campo_casa(hora, local.hour, 0, 23)
+                and _campo_casa(minuto, local.minute, 0, 59)):
+            instantes.append(momento.timestamp())
+    return np.array(instantes)
+
+
+def verificar_agendador():
+    import bisect
+    import datetime
+    import agendador
+    falhas = []
+    gerador = np.random.default_rng(3)
+    for cron, fuso, de, ate in CASOS_CRON:
+        regra = agendador.Regra('verificacao', cron, fuso, [])
+        horarios = _horarios_cron(cron, fuso, de, ate)
+        # Consultas sorteadas e exatamente nos horários (proxima é estritamente depois, anterior inclui)
+        inicio, fim = pd.Timestamp(de, tz='UTC').timestamp(), pd.Timestamp(ate, tz='UTC').timestamp()
+        consultas = np.sort(np.concatenate([gerador.uniform(inicio, fim, 200), horarios]))
+        esperado, obtido = [], []
+        for consulta in consultas:
+            momento = datetime.datetime.fromtimestamp(consulta, datetime.timezone.utc)
+            posicao = bisect.bisect_right(horarios, consulta)
+            if 0 < posicao < len(horarios):
+                esperado.append((horarios[posicao], horarios[posicao - 1]))
+                obtido.append((regra.proxima(momento).timestamp(), regra.anterior(momento).timestamp()))
+        if not len(horarios):
+            falhas.append(f"'{cron}' ({fuso}): nenhum horário na varredura de {de} a {ate}")
+            continue
+        _comparar(f"'{cron}' {fuso} ({len(horarios)})", esperado, obtido, falhas)
+
+    aceitas = []
+    for cron in CRON_INVALIDOS:
+        try:
+            agendador.Regra('verificacao', cron, 'UTC', [])
+            aceitas.append(cron)
+        except ValueError:
+            pass
+    falhas += [f"'{cron}': expressão inválida aceita" for cron in aceitas]
+    print(f'  expressões inválidas recusadas: {len(CRON_INVALIDOS) - len(aceitas)}/{len(CRON_INVALIDOS)}')
+    return falhas
+
+
+# --- fila_duravel (prazo de posse, retomada e esgotamento das tentativas) ---
+
+def verificar_fila():
+    import shutil
+    import tempfile
+    import fila_duravel
+    falhas = []
+    pasta = tempfile.mkdtemp(prefix='verificar_fila_')
+    # Banco novo e prazos curtos; a conexão por thread é aberta no primeiro uso, já com este caminho
+    fila_duravel.CAMINHO_BANCO = os.path.join(pasta, 'fila.sqlite3')
+    fila_duravel.LEASE_SEGUNDOS, fila_duravel.MAX_TENTATIVAS = 1, 2
+    logging.disable(logging.ERROR)  # os avisos de posse vencida e falhas são o esperado aqui
+    try:
+        job_id = fila_duravel.enfileirar('pdf1', chave='a')
+        _conferir('pedido igual na fila compartilha o job', fila_duravel.enfileirar('pdf1', chave='a') == job_id,
+                  falhas)
+        job = fila_duravel.reivindicar('A')
+        _conferir('A reivindica o job (tentativa 1)', job and job['job_id'] == job_id and job['tentativas'] == 1,
+                  falhas)
+        _conferir('B não pega o job com a posse de A em dia', fila_duravel.reivindicar('B') is None, falhas)
+        _conferir('A renova a posse', fila_duravel.renovar(job_id, 'A'), falhas)
+
+        time.sleep(fila_duravel.LEASE_SEGUNDOS + 0.2)
+        job = fila_duravel.reivindicar('B')
+        _conferir('B retoma o job com a posse vencida (tentativa 2)',
+                  job and job['job_id'] == job_id and job['tentativas'] == 2, falhas)
+        _conferir('A não renova mais', not fila_duravel.renovar(job_id, 'A'), falhas)
+        _conferir('resultado de A é descartado', not fila_duravel.concluir(job_id, 'A', ['a.pdf']), falhas)
+        _conferir('B conclui', fila_duravel.concluir(job_id, 'B', ['b.pdf']), falhas)
+        status = fila_duravel.obter_status(job_id)
+        _conferir('job termina com o arquivo de B', status['status'] == 'success' and status['file_path'] == 'b.pdf',
+                  falhas)
+
+        # Abandonado em todas as tentativas: encerra com erro em vez de voltar para a fila
+        job_id = fila_duravel.enfileirar('pdf2', chave='b')
+        fila_duravel.reivindicar('A')
+        time.sleep(fila_duravel.LEASE_SEGUNDOS + 0.2)
+        fila_duravel.reivindicar('B')
+        time.sleep(fila_duravel.LEASE_SEGUNDOS + 0.2)
+        _conferir('sem tentativas restantes ninguém retoma', fila_duravel.reivindicar('C') is None, falhas)
+        _conferir('job abandonado termina com erro', fila_duravel.obter_status(job_id)['status'] == 'error', falhas)
+
+        # Falha comum volta para a fila com espera; falha permanente encerra na hora
+        job_id = fila_duravel.enfileirar('pdf3', chave='c')
+        fila_duravel.reivindicar('A')
+        fila_duravel.falhar(job_id, 'A', 'erro de teste')
+        status = fila_duravel.obter_status(job_id)
+        _conferir('falha comum volta para a fila com espera',
+                  status['status'] == 'queued' and status['disponivel_em'] > time.time(), falhas)
+        job_id = fila_duravel.enfileirar('pdf4', chave='d')
+        fila_duravel.reivindicar('A')
+        fila_duravel.falhar(job_id, 'A', 'arquivo não gerado', permanente=True)
+        _conferir('falha permanente encerra na primeira tentativa',
+                  fila_duravel.obter_status(job_id)['status'] == 'error', falhas)
+    finally:
+        logging.disable(logging.NOTSET)
+        fila_duravel._local.conexao.close()
+        fila_duravel._local.conexao = None
+        shutil.rmtree(pasta, ignore_errors=True)
+    return falhas
+
+
+VERIFICACOES = {
+    'variacoes': verificar_variacoes,
+    'zscore': verificar_zscore,
+    'pares': verificar_pares,
+    'dispersao': verificar_dispersao,
+    'agendador': verificar_agendador,
+    'fila': verificar_fila,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Confere os motores vetorizados contra as versões antigas.')
+    parser.add_argument('verificacoes', nargs='*', metavar='verificacao',
+                        help=f"Quais rodar (padrão: todas): {', '.join(VERIFICACOES)}.")
+    args = parser.parse_args()
+    desconhecidas = set(args.verificacoes) - set(VERIFICACOES)
+    if desconhecidas:
+        parser.error(f"verificação desconhecida: {', '.join(sorted(desconhecidas))}")
+
+    falhas = []
+    for nome in args.verificacoes or VERIFICACOES:
+        inicio = time.perf_counter()
+        print(f'{nome}:')
+        falhas_caso = VERIFICACOES[nome]()
+        print(f"  {'ok' if not falhas_caso else 'FALHOU'} em {time.perf_counter() - inicio:.2f}s")
+        falhas += [f'{nome}: {falha}' for falha in falhas_caso]
+
+    for falha in falhas:
+        print(f'FALHA {falha}')
+    sys.exit(1 if falhas else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# busca_resiliente.py
+#
+# Execução das requisições aos provedores de dados: um pool limitado de threads, limite de taxa por
+# balde de fichas, retentativas com espera exponencial e jitter, prazo por requisição e para o pedido
+# inteiro, e um disjuntor por provedor que corta as chamadas enquanto o serviço estiver fora do ar
+# (quem chama cai para a última série guardada no armazém).
+
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as TempoEsgotadoFuturo
+import metricas
+
+# Requisições simultâneas ao provedor e ritmo máximo (requisições por segundo, com rajada de até RAJADA)
+TRABALHADORES = int(os.environ.get('PROVEDOR_TRABALHADORES', '4'))
+TAXA = float(os.environ.get('PROVEDOR_TAXA', '5'))
+RAJADA = int(os.environ.get('PROVEDOR_RAJADA', '5'))
+
+# Tentativas por requisição e limites da espera exponencial entre elas (em segundos)
+TENTATIVAS = int(os.environ.get('PROVEDOR_TENTATIVAS', '3'))
+ESPERA_BASE = float(os.environ.get('PROVEDOR_ESPERA_BASE', '0.5'))
+ESPERA_MAXIMA = float(os.environ.get('PROVEDOR_ESPERA_MAXIMA', '8'))
+
+# Tempo máximo de cada requisição individual
+TEMPO_REQUISICAO = float(os.environ.get('PROVEDOR_TEMPO_REQUISICAO', '10'))
+
+# Falhas seguidas que abrem o disjuntor e por quanto tempo ele fica aberto antes de testar de novo
+DISJUNTOR_FALHAS = int(os.environ.get('DISJUNTOR_FALHAS', '5'))
+DISJUNTOR_ABERTO_SEGUNDOS = float(os.environ.get('DISJUNTOR_ABERTO_SEGUNDOS', '30'))
+
+FECHADO, ABERTO, MEIO_ABERTO = 'fechado', 'aberto', 'meio_aberto'
+
+
+class ErroTransitorio(Exception):
+    # Falha que pode passar sozinha (tempo esgotado, conexão recusada, HTTP 429 ou 5xx): vale tentar de novo
+    pass
+
+
+class CircuitoAberto(Exception):
+    pass
+
+
+class PrazoEsgotado(Exception):
+    pass
+
+
+class BaldeFichas:
+    # Limite de taxa: cada requisição consome uma ficha; as fichas voltam a 'taxa' por segundo
+    # até o máximo de 'capacidade' (a rajada permitida)
+    def __init__(self, taxa=TAXA, capacidade=RAJADA):
+        self.taxa = taxa
+        self.capacidade = max(capacidade, 1)
+        self._fichas = float(self.capacidade)
+        self._ultimo = time.monotonic()
+        self._trava = threading.Lock()
+
+    def retirar(self, prazo=None):
+        # Espera uma ficha; devolve False se ela só viria depois do prazo
+        while True:
+            with self._trava:
+                agora = time.monotonic()
+                self._fichas = min(self.capacidade, self._fichas + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return True
+                espera = (1 - self._fichas) / self.taxa
+            if prazo is not None and agora + espera > prazo:
+                return False
+            time.sleep(espera)
+
+
+class Disjuntor:
+    # Fechado: as chamadas passam. Depois de 'limite' falhas seguidas abre e recusa tudo por
+    # 'tempo_aberto' segundos; então fica meio aberto e deixa passar uma chamada de teste,
+    # que fecha o circuito se der certo ou o reabre se falhar
+    def __init__(self, nome, limite=DISJUNTOR_FALHAS, tempo_aberto=DISJUNTOR_ABERTO_SEGUNDOS):
+        self.nome = nome
+        self.limite = limite
+        self.tempo_aberto = tempo_aberto
+        self.estado = FECHADO
+        self._falhas = 0
+        self._aberto_em = 0.0
+        self._testando = False
+        self._trava = threading.Lock()
+
+    def _mudar(self, estado):
+        if estado != self.estado:
+            logging.warning(f"Disjuntor do provedor {self.nome}: {self.estado} -> {estado}.")
+            metricas.DISJUNTOR_TOTAL.incrementar(provedor=self.nome, estado=estado)
+            self.estado = estado
+
+    def permite(self):
+        with self._trava:
+            if self.estado == ABERTO and time.monotonic() - self._aberto_em >= self.tempo_aberto:
+                self._mudar(MEIO_ABERTO)
+            if self.estado == FECHADO:
+                return True
+            if self.estado == MEIO_ABERTO and not self._testando:
+                self._testando = True
+                return True
+            return False
+
+    def sucesso(self):
+        with self._trava:
+            self._falhas = 0
+            self._testando = False
+            self._mudar(FECHADO)
+
+    def falha(self):
+        with self._trava:
+            self._falhas += 1
+            self._testando = False
+            if self.estado == MEIO_ABERTO or self._falhas >= self.limite:
+                self._aberto_em = time.monotonic()
+                self._mudar(ABERTO)
+
+
+class ExecutorBusca:
+    # Executa uma função para cada item (um ticker ou um lote deles) no pool, com as proteções acima.
+    # A função recebe o item e o tempo limite da requisição; deve levantar ErroTransitorio para o que
+    # vale repetir, e qualquer outra exceção é definitiva para aquele item
+    def __init__(self, nome, trabalhadores=TRABALHADORES, taxa=TAXA, rajada=RAJADA, tentativas=TENTATIVAS,
+                 tempo_requisicao=TEMPO_REQUISICAO):
+        self.nome = nome
+        self.tentativas = max(tentativas, 1)
+        self.tempo_requisicao = tempo_requisicao
+        self.balde = BaldeFichas(taxa, rajada)
+        self.disjuntor = Disjuntor(nome)
+        self._pool = ThreadPoolExecutor(max_workers=trabalhadores, thread_name_prefix=f'busca-{nome}')
+
+    def _tentar(self, funcao, item, prazo):
+        for tentativa in range(self.tentativas):
+            while not self.disjuntor.permite():
+                if self.disjuntor.estado != MEIO_ABERTO or (prazo is not None and time.monotonic() >= prazo):
+                    metricas.BUSCA_TENTATIVAS_TOTAL.incrementar(provedor=self.nome, resultado='circuito_aberto')
+                    raise CircuitoAberto(f"Provedor {self.nome} indisponível (disjuntor aberto).")
+                # Outra requisição está testando o provedor: espera o resultado dela em vez de desistir
+                time.sleep(0.05)
+            if not self.balde.retirar(prazo):
+                metricas.BUSCA_TENTATIVAS_TOTAL.incrementar(provedor=self.nome, resultado='prazo')
+                raise PrazoEsgotado(f"Prazo esgotado esperando a vez de consultar {item}.")
+            tempo_limite = self.tempo_requisicao
+            if prazo is not None:
+                tempo_limite = min(tempo_limite, prazo - time.monotonic())
+                if tempo_limite <= 0:
+                    metricas.BUSCA_TENTATIVAS_TOTAL.incrementar(provedor=self.nome, resultado='prazo')
+                    raise PrazoEsgotado(f"Prazo esgotado antes de consultar {item}.")
+            try:
+                resultado = funcao(item, tempo_limite)
+            except ErroTransitorio as e:
+                self.disjuntor.falha()
+                metricas.BUSCA_TENTATIVAS_TOTAL.incrementar(provedor=self.nome, resultado='erro')
+                erro = e
+            except Exception:
+                # Erro definitivo (ex.: resposta inválida): o serviço respondeu, então não conta como falha
+                self.disjuntor.sucesso()
+                raise
+            else:
+                self.disjuntor.sucesso()
+                metricas.BUSCA_TENTATIVAS_TOTAL.incrementar(provedor=self.nome, resultado='ok')
+                return resultado
+
+            if tentativa + 1 == self.tentativas:
+                break
+            # Espera exponencial com jitter completo, para as retentativas não chegarem todas juntas
+            espera = random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** tentativa))
+            if prazo is not None and time.monotonic() + espera >= prazo:
+                raise PrazoEsgotado(f"Prazo esgotado antes de tentar {item} de novo ({erro}).")
+            logging.info(f"Provedor {self.nome}: nova tentativa para {item} em {espera:.2f}s ({erro}).")
+            time.sleep(espera)
+        raise erro
+
+    def mapear(self, funcao, itens, prazo=None):
+        # {item: resultado ou a exceção que encerrou as tentativas}. 'prazo' (time.monotonic) vale
+        # para todos os itens: o que não terminar até lá volta como PrazoEsgotado
+        futuros = {item: self._pool.submit(self._tentar, funcao, item, prazo) for item in itens}
+        resultados = {}
+        for item, futuro in futuros.items():
+            try:
+                espera = None if prazo is None else max(prazo - time.monotonic(), 0) + 0.5
+                resultados[item] = futuro.result(timeout=espera)
+            except TempoEsgotadoFuturo:
+                futuro.cancel()
+                resultados[item] = PrazoEsgotado(f"Prazo esgotado buscando {item}.")
+            except Exception as e:
+                resultados[item] = e
+        return resultados
+
+
+_executores = {}
+_trava = threading.Lock()
+
+
+def executor(nome, **configuracao):
+    # Um executor (pool, balde e disjuntor) por provedor, compartilhado por todos os pedidos do processo
+    with _trava:
+        if nome not in _executores:
+            _executores[nome] = ExecutorBusca(nome, **configuracao)
+        return _executores[nome]
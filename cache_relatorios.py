@@ -0,0 +1,199 @@
+# cache_relatorios.py
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import metricas
+
+# Por quanto tempo (em segundos) um relatório recém-gerado é devolvido sem nem consultar os dados
+TTL_SEGUNDOS = int(os.environ.get('CACHE_TTL_SEGUNDOS', '600'))
+
+# Arquivos de cache mais antigos que isso são apagados quando uma nova versão é gerada
+RETENCAO_SEGUNDOS = int(os.environ.get('CACHE_RETENCAO_SEGUNDOS', str(24 * 3600)))
+
+_recentes = {}
+_hashes = {}
+_desatualizados = {}  # caminho do relatório -> {ticker: última barra} dos dados desatualizados que ele usou
+_trava = threading.Lock()
+
+
+def chave_pedido(tipo, parametros=None):
+    # Identifica o pedido (tipo de relatório + parâmetros), independente dos dados
+    return json.dumps({'tipo': tipo, 'parametros': parametros or {}}, sort_keys=True, default=str)
+
+
+def chave_cache(tipo, parametros, marca):
+    conteudo = json.dumps({'tipo': tipo, 'parametros': parametros or {}, 'marca': marca},
+                          sort_keys=True, default=str)
+    return hashlib.sha256(conteudo.encode()).hexdigest()
+
+
+def _referencia_recente(pasta, tipo, parametros):
+    # Registro em disco do último arquivo gerado para o pedido (a idade é o mtime): vale para todos os
+    # processos que enxergam a pasta, inclusive o web quando quem gera são os workers da fila durável
+    chave = hashlib.sha256(chave_pedido(tipo, parametros).encode()).hexdigest()
+    return os.path.join(pasta, f'.recente_{tipo}_{chave[:16]}.ref')
+
+
+def recente(tipo, parametros=None, pasta=None):
+    # Devolve o arquivo gerado para o mesmo pedido dentro do TTL, se ainda existir. Com 'pasta',
+    # consulta também o registro em disco gravado por outros processos
+    with _trava:
+        entrada = _recentes.get(chave_pedido(tipo, parametros))
+    caminho = None
+    if entrada is not None and time.time() - entrada[1] <= TTL_SEGUNDOS and os.path.exists(entrada[0]):
+        caminho = entrada[0]
+    elif pasta is not None:
+        referencia = _referencia_recente(pasta, tipo, parametros)
+        try:
+            if time.time() - os.path.getmtime(referencia) <= TTL_SEGUNDOS:
+                caminho = _resolver(referencia)
+        except OSError:
+            pass
+    if caminho is None:
+        return None
+    metricas.CACHE_TOTAL.incrementar(tipo=tipo, resultado='ttl')
+    return caminho
+
+
+def _registrar(tipo, parametros, caminho, atrasados=None):
+    with _trava:
+        if atrasados:
+            _desatualizados[caminho] = atrasados
+            return
+        _recentes[chave_pedido(tipo, parametros)] = (caminho, time.time())
+    _gravar_referencia(_referencia_recente(os.path.dirname(caminho), tipo, parametros), caminho)
+
+
+def texto_desatualizados(atrasados, limite=6):
+    # Aviso impresso no relatório quando parte dos dados saiu do armazém por falha no provedor
+    itens = [f"{ticker} ({ultima:%d/%m/%Y})" if ultima is not None else f"{ticker} (sem dados)"
+             for ticker, ultima in list(atrasados.items())[:limite]]
+    resto = f" e mais {len(atrasados) - limite}" if len(atrasados) > limite else ""
+    return f"Dados desatualizados (falha no provedor): {', '.join(itens)}{resto}"
+
+
+def desatualizados(caminhos):
+    # {ticker: última barra em ISO} dos dados desatualizados usados nos relatórios indicados
+    atrasados = {}
+    with _trava:
+        for caminho in caminhos:
+            for ticker, ultima in _desatualizados.get(caminho, {}).items():
+                atrasados[ticker] = ultima.date().isoformat() if ultima is not None else None
+    return atrasados
+
+
+def hash_arquivo(caminho):
+    # sha256 do conteúdo, lembrado enquanto o arquivo não muda (mesmo mtime e tamanho)
+    informacoes = os.stat(caminho)
+    marca = (caminho, informacoes.st_mtime_ns, informacoes.st_size)
+    with _trava:
+        if marca in _hashes:
+            return _hashes[marca]
+    resumo = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(1 << 20), b''):
+            resumo.update(bloco)
+    digest = resumo.hexdigest()
+    with _trava:
+        if len(_hashes) >= 1024:
+            _hashes.clear()
+        _hashes[marca] = digest
+    return digest
+
+
+def publicar(temporario, pasta, nome, extensao):
+    # Move o arquivo gerado para um nome com o hash do conteúdo: um nome nunca muda de conteúdo,
+    # então clientes e proxies podem guardá-lo em cache para sempre
+    caminho = os.path.join(pasta, f'{nome}_{hash_arquivo(temporario)[:16]}{extensao}')
+    os.replace(temporario, caminho)
+    return caminho
+
+
+def _referencia(pasta, nome, chave, extensao):
+    # Índice da chave do pedido + dados para o arquivo publicado (nome com o hash do conteúdo)
+    return os.path.join(pasta, f'.{nome}_{chave[:16]}{extensao}.ref')
+
+
+def _resolver(referencia):
+    try:
+        with open(referencia) as arquivo:
+            caminho = os.path.join(os.path.dirname(referencia), arquivo.read().strip())
+    except FileNotFoundError:
+        return None
+    return caminho if os.path.exists(caminho) else None
+
+
+def _gravar_referencia(referencia, caminho):
+    temporario = f'{referencia}.{uuid.uuid4().hex}.tmp'
+    with open(temporario, 'w') as arquivo:
+        arquivo.write(os.path.basename(caminho))
+    os.replace(temporario, referencia)
+
+
+def limpar_antigos(pasta, prefixo, manter):
+    # Arquivos e referências de versões anteriores que passaram da retenção
+    limite = time.time() - RETENCAO_SEGUNDOS
+    for nome in os.listdir(pasta):
+        caminho = os.path.join(pasta, nome)
+        referencia = nome.startswith(f'.{prefixo}') and nome.endswith('.ref')
+        if (nome.startswith(prefixo) or referencia) and caminho != manter and os.path.getmtime(caminho) < limite:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+            with _trava:
+                _desatualizados.pop(caminho, None)
+
+
+def gerar_com_cache(tipo, gerar, universo_dados, pasta, nome_base, parametros=None, progresso=None, forcar=False):
+    # Atualiza os dados do universo do relatório, calcula a chave e só gera o PDF se ela for nova
+    # (ou se 'forcar', ex.: num pedido perfilado, que precisa medir a geração inteira)
+    import armazem_precos  # importado só aqui para o app subir sem carregar pandas e pyarrow
+    import renderizacao
+    if progresso:
+        progresso('fetch')
+    tickers, inicio = universo_dados()
+    # Só os metadados do Parquet entram na marca: nenhum histórico completo é carregado
+    armazem_precos.atualizar(tickers, inicio, carregar=False)
+    marca = armazem_precos.marca_dados(tickers)
+    # Com dados desatualizados o relatório sai com aviso, então é outro arquivo, e não entra no TTL:
+    # o próximo pedido volta a tentar o provedor
+    atrasados = armazem_precos.desatualizados(tickers)
+    if atrasados:
+        marca = f"{marca}|desatualizados:{','.join(sorted(atrasados))}"
+        logging.warning(f"Relatório {tipo} com {len(atrasados)} ticker(s) desatualizado(s): {', '.join(atrasados)}")
+    chave = chave_cache(tipo, parametros, marca)
+
+    nome, extensao = os.path.splitext(nome_base)
+    referencia = _referencia(pasta, nome, chave, extensao)
+    caminho = _resolver(referencia)
+    if caminho and not forcar:
+        logging.info(f"Relatório {tipo} reaproveitado do cache: {caminho}")
+        metricas.CACHE_TOTAL.incrementar(tipo=tipo, resultado='dados')
+        _registrar(tipo, parametros, caminho, atrasados)
+        return caminho
+
+    metricas.CACHE_TOTAL.incrementar(tipo=tipo, resultado='falta')
+    # Gera em um arquivo temporário e troca atomicamente, para nunca servir um PDF pela metade
+    os.makedirs(pasta, exist_ok=True)
+    temporario = os.path.join(pasta, f'.{nome}_{uuid.uuid4().hex}.tmp{extensao}')
+    try:
+        with renderizacao.aviso(texto_desatualizados(atrasados) if atrasados else None):
+            gerar(temporario, progresso=progresso)
+        if not os.path.exists(temporario):
+            return None
+        caminho = publicar(temporario, pasta, nome, extensao)
+        _gravar_referencia(referencia, caminho)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+    _registrar(tipo, parametros, caminho, atrasados)
+    limpar_antigos(pasta, f'{nome}_', caminho)
+    limpar_antigos(pasta, f'recente_{tipo}_', None)
+    return caminho
@@ -0,0 +1,147 @@
+# dados_relatorios.py
+#
+# Resultados calculados dos relatórios servidos sem gerar PDF: a mesma coleta e o mesmo cálculo dos
+# geradores (calcular), em JSON (para_json) ou como um gráfico avulso em PNG/SVG (paginas).
+# Os resultados ficam em memória com a mesma chave dos PDFs (pedido + marca dos dados), e um pedido
+# repetido dentro do TTL nem consulta o armazém de preços.
+
+import io
+import os
+import math
+import time
+import datetime
+import threading
+from collections import OrderedDict
+import relatorios
+import cache_relatorios
+import metricas
+
+# Quantos resultados calculados e quantas imagens ficam em memória (os menos usados saem primeiro)
+MAX_RESULTADOS = int(os.environ.get('DADOS_MAX_RESULTADOS', '32'))
+MAX_IMAGENS = int(os.environ.get('DADOS_MAX_IMAGENS', '128'))
+
+FORMATOS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+_resultados = OrderedDict()   # chave de cache -> (resultado do gerador, páginas, tickers desatualizados)
+_imagens = OrderedDict()      # (chave de cache, página, formato) -> bytes
+_recentes = {}                # chave do pedido -> (chave de cache, quando foi calculada)
+_travas = {}                  # chave do pedido -> trava, para pedidos iguais calcularem uma vez só
+_trava = threading.Lock()
+
+
+def _guardar(cache, chave, valor, maximo):
+    with _trava:
+        cache[chave] = valor
+        cache.move_to_end(chave)
+        while len(cache) > maximo:
+            cache.popitem(last=False)
+
+
+def _consultar(cache, chave):
+    with _trava:
+        valor = cache.get(chave)
+        if valor is not None:
+            cache.move_to_end(chave)
+        return valor
+
+
+def _trava_pedido(pedido):
+    with _trava:
+        return _travas.setdefault(pedido, threading.Lock())
+
+
+def _recente(tipo, pedido):
+    with _trava:
+        entrada = _recentes.get(pedido)
+    if entrada and time.time() - entrada[1] <= cache_relatorios.TTL_SEGUNDOS:
+        resultado = _consultar(_resultados, entrada[0])
+        if resultado is not None:
+            metricas.DADOS_CACHE_TOTAL.incrementar(tipo=tipo, resultado='ttl')
+            return entrada[0], resultado
+    return None
+
+
+def obter(tipo, parametros=None):
+    # (chave de cache, (resultado, páginas)) do relatório para os parâmetros já normalizados
+    import armazem_precos  # importado só aqui para o app subir sem carregar pandas e pyarrow
+    parametros = parametros or {}
+    pedido = cache_relatorios.chave_pedido(tipo, parametros)
+    encontrado = _recente(tipo, pedido)
+    if encontrado:
+        return encontrado
+
+    trava = _trava_pedido(pedido)
+    try:
+        with trava:
+            # Outro pedido igual pode ter acabado de calcular enquanto este esperava
+            encontrado = _recente(tipo, pedido)
+            if encontrado:
+                return encontrado
+
+            modulo, _ = relatorios.gerador(tipo)
+            tickers, inicio = modulo.universo_dados(**parametros)
+            armazem_precos.atualizar(tickers, inicio, carregar=False)
+            marca = armazem_precos.marca_dados(tickers)
+            # Como nos PDFs: dados desatualizados mudam a chave e não entram no TTL
+            atrasados = armazem_precos.desatualizados(tickers)
+            if atrasados:
+                marca = f"{marca}|desatualizados:{','.join(sorted(atrasados))}"
+            chave = cache_relatorios.chave_cache(tipo, parametros, marca)
+
+            resultado = _consultar(_resultados, chave)
+            if resultado is None:
+                metricas.DADOS_CACHE_TOTAL.incrementar(tipo=tipo, resultado='falta')
+                calculado = modulo.calcular(**parametros)
+                resultado = (calculado, modulo.paginas(calculado), atrasados)
+                _guardar(_resultados, chave, resultado, MAX_RESULTADOS)
+            else:
+                metricas.DADOS_CACHE_TOTAL.incrementar(tipo=tipo, resultado='dados')
+            if not atrasados:
+                with _trava:
+                    _recentes[pedido] = (chave, time.time())
+            return chave, resultado
+    finally:
+        with _trava:
+            if _travas.get(pedido) is trava and not trava.locked():
+                del _travas[pedido]
+
+
+def _para_json(valor):
+    # NaN vira null e tipos do numpy/pandas viram tipos nativos, para o JSON ser válido
+    if isinstance(valor, dict):
+        return {str(chave): _para_json(item) for chave, item in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_para_json(item) for item in valor]
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return valor.isoformat()
+    if hasattr(valor, 'item'):  # escalares do numpy
+        valor = valor.item()
+    if isinstance(valor, float) and not math.isfinite(valor):
+        return None
+    return valor
+
+
+def dados(tipo, parametros=None):
+    chave, (resultado, paginas, atrasados) = obter(tipo, parametros)
+    modulo, _ = relatorios.gerador(tipo)
+    return {'relatorio': tipo, 'chave': chave[:16], 'graficos': len(paginas),
+            'desatualizados': _para_json(atrasados), **_para_json(modulo.para_json(resultado))}
+
+
+def grafico(tipo, pagina, formato, parametros=None):
+    # Uma página do relatório desenhada sozinha, no formato pedido; None se a página não existir
+    chave, (_, paginas, _) = obter(tipo, parametros)
+    imagem = _consultar(_imagens, (chave, pagina, formato))
+    if imagem is not None:
+        return imagem
+
+    if not 0 <= pagina < len(paginas):
+        return None
+    import renderizacao
+    desenhar, argumentos = paginas[pagina]
+    with metricas.PAGINA_SEGUNDOS.cronometrar(relatorio=tipo), renderizacao.desenhando():
+        buffer = io.BytesIO()
+        desenhar(**argumentos).savefig(buffer, format=formato)
+    imagem = buffer.getvalue()
+    _guardar(_imagens, (chave, pagina, formato), imagem, MAX_IMAGENS)
+    return imagem
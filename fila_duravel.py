@@ -0,0 +1,255 @@
+# fila_duravel.py
+#
+# Fila de relatórios persistida em SQLite, para a geração rodar em processos separados do web
+# (worker_relatorios.py), em uma ou mais máquinas que enxerguem o mesmo banco e a mesma pasta de saída.
+# O app só enfileira e consulta; cada worker reivindica um job com um prazo de posse (lease) que
+# renova enquanto trabalha. Se o worker morrer, o prazo vence e outro worker pega o job de novo,
+# até o limite de tentativas. Falhas voltam para a fila com espera exponencial.
+#
+# O modo durável é opcional (FILA_MODO=duravel; o padrão continua sendo a fila no próprio processo web)
+# e só funciona se o web e os workers enxergarem o mesmo banco e a mesma pasta de saída: um volume
+# compartilhado. Em plataformas em que cada processo tem o próprio disco efêmero (ex.: dynos web e
+# worker do Heroku), os jobs do web nunca seriam reivindicados e os PDFs dos workers não poderiam ser
+# baixados; lá, use o modo local.
+#
+# O banco usa o journal tradicional (não WAL): o WAL depende de memória compartilhada e só funciona
+# com todos os processos na mesma máquina. Em várias máquinas, o arquivo precisa estar num sistema de
+# arquivos com travas POSIX funcionando.
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+import metricas
+
+# 'duravel' manda os pedidos do app para esta fila (os workers geram); 'local' gera no próprio processo web
+MODO = os.environ.get('FILA_MODO', 'local')
+
+CAMINHO_BANCO = os.environ.get('FILA_BANCO', os.path.join('dados', 'fila.sqlite3'))
+
+# Prazo de posse de um job e de quanto em quanto tempo o worker o renova
+LEASE_SEGUNDOS = int(os.environ.get('FILA_LEASE_SEGUNDOS', '60'))
+BATIMENTO_SEGUNDOS = int(os.environ.get('FILA_BATIMENTO_SEGUNDOS', '15'))
+
+# Tentativas por job e espera base (dobrando a cada falha) antes de tentar de novo
+MAX_TENTATIVAS = int(os.environ.get('FILA_MAX_TENTATIVAS', '3'))
+ESPERA_RETENTATIVA_SEGUNDOS = int(os.environ.get('FILA_ESPERA_RETENTATIVA_SEGUNDOS', '10'))
+
+# Tempo (em segundos) que um job finalizado continua disponível para consulta
+RETENCAO_SEGUNDOS = int(os.environ.get('FILA_RETENCAO_SEGUNDOS', '3600'))
+
+ETAPAS = ['fetch', 'compute', 'render']
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    chave TEXT NOT NULL,
+    parametros TEXT NOT NULL,
+    mensagem_erro TEXT NOT NULL,
+    status TEXT NOT NULL,
+    etapa TEXT,
+    etapas TEXT NOT NULL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    max_tentativas INTEGER NOT NULL,
+    trabalhador TEXT,
+    lease_ate REAL,
+    batimento_em REAL,
+    disponivel_em REAL NOT NULL,
+    file_path TEXT,
+    files TEXT NOT NULL DEFAULT '[]',
+    desatualizados TEXT NOT NULL DEFAULT '{}',
+    perfilar INTEGER NOT NULL DEFAULT 0,
+    perfil TEXT,
+    message TEXT,
+    criado_em REAL NOT NULL,
+    iniciado_em REAL,
+    finalizado_em REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_pendentes ON jobs (status, disponivel_em);
+CREATE INDEX IF NOT EXISTS jobs_chave ON jobs (chave, status);
+"""
+
+# Colunas acrescentadas depois da primeira versão da tabela: bancos antigos as ganham ao conectar
+_COLUNAS_NOVAS = {'perfilar': 'INTEGER NOT NULL DEFAULT 0', 'perfil': 'TEXT'}
+
+_local = threading.local()
+
+
+def _conexao():
+    # Uma conexão por thread; o esquema é criado na primeira
+    if getattr(_local, 'conexao', None) is None:
+        pasta = os.path.dirname(CAMINHO_BANCO)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        conexao = sqlite3.connect(CAMINHO_BANCO, timeout=30, isolation_level=None)
+        conexao.row_factory = sqlite3.Row
+        conexao.executescript(_ESQUEMA)
+        existentes = {coluna['name'] for coluna in conexao.execute('PRAGMA table_info(jobs)')}
+        for nome, definicao in _COLUNAS_NOVAS.items():
+            if nome not in existentes:
+                try:
+                    conexao.execute(f'ALTER TABLE jobs ADD COLUMN {nome} {definicao}')
+                except sqlite3.OperationalError:
+                    pass  # outro processo acrescentou ao mesmo tempo
+        _local.conexao = conexao
+    return _local.conexao
+
+
+@contextmanager
+def _transacao():
+    # BEGIN IMMEDIATE trava o banco para escrita já no início: duas reivindicações não pegam o mesmo job
+    conexao = _conexao()
+    conexao.execute('BEGIN IMMEDIATE')
+    try:
+        yield conexao
+        conexao.execute('COMMIT')
+    except BaseException:
+        conexao.execute('ROLLBACK')
+        raise
+
+
+def _para_dict(linha):
+    job = dict(linha)
+    job['etapas'] = json.loads(job['etapas'])
+    job['files'] = json.loads(job['files'])
+    job['desatualizados'] = json.loads(job['desatualizados'])
+    job['parametros'] = json.loads(job['parametros'])
+    job['perfilar'] = bool(job['perfilar'])
+    job['perfil'] = json.loads(job['perfil']) if job['perfil'] else None
+    return job
+
+
+def enfileirar(tipo, parametros=None, chave=None, mensagem_erro='Erro ao gerar o PDF.', perfilar=False):
+    # Mesmo contrato da fila local: pedidos com a mesma 'chave' enquanto um job equivalente está
+    # na fila ou rodando compartilham esse job. Com 'perfilar' o worker gera sob o perfilador
+    chave = chave or tipo
+    agora = time.time()
+    with _transacao() as conexao:
+        conexao.execute("DELETE FROM jobs WHERE finalizado_em IS NOT NULL AND finalizado_em < ?",
+                        (agora - RETENCAO_SEGUNDOS,))
+        existente = conexao.execute("SELECT job_id FROM jobs WHERE chave = ? AND status IN ('queued', 'running')",
+                                    (chave,)).fetchone()
+        if existente:
+            logging.info(f"Pedido {tipo} agregado ao job {existente['job_id']} em andamento.")
+            return existente['job_id']
+        job_id = uuid.uuid4().hex
+        etapas = {etapa: {'status': 'pendente', 'inicio': None, 'fim': None} for etapa in ETAPAS}
+        conexao.execute(
+            "INSERT INTO jobs (job_id, tipo, chave, parametros, mensagem_erro, status, etapas, max_tentativas, "
+            "perfilar, disponivel_em, criado_em) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, tipo, chave, json.dumps(parametros or {}), mensagem_erro, json.dumps(etapas),
+             MAX_TENTATIVAS, int(perfilar), agora, agora))
+    logging.info(f"Job {job_id} ({tipo}) gravado na fila durável.")
+    return job_id
+
+
+def obter_status(job_id):
+    linha = _conexao().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if linha is None:
+        return None
+    job = _para_dict(linha)
+    del job['parametros'], job['mensagem_erro']
+    return job
+
+
+def reivindicar(trabalhador):
+    # Pega o job pendente mais antigo (ou um cujo worker deixou o prazo de posse vencer) e o marca
+    # como deste trabalhador. Jobs abandonados sem tentativas restantes são encerrados com erro
+    agora = time.time()
+    with _transacao() as conexao:
+        vencidos = conexao.execute(
+            "SELECT job_id, trabalhador FROM jobs WHERE status = 'running' AND lease_ate < ? "
+            "AND tentativas >= max_tentativas", (agora,)).fetchall()
+        for vencido in vencidos:
+            logging.error(f"Job {vencido['job_id']} abandonado por {vencido['trabalhador']} sem tentativas restantes.")
+            conexao.execute("UPDATE jobs SET status = 'error', message = mensagem_erro, finalizado_em = ? "
+                            "WHERE job_id = ?", (agora, vencido['job_id']))
+            metricas.JOBS_TOTAL.incrementar(tipo='abandonado', status='error')
+
+        linha = conexao.execute(
+            "SELECT * FROM jobs WHERE (status = 'queued' AND disponivel_em <= ?) "
+            "OR (status = 'running' AND lease_ate < ?) ORDER BY criado_em LIMIT 1", (agora, agora)).fetchone()
+        if linha is None:
+            return None
+        if linha['status'] == 'running':
+            logging.warning(f"Job {linha['job_id']}: prazo de posse de {linha['trabalhador']} venceu; "
+                            f"reivindicado por {trabalhador}.")
+        conexao.execute(
+            "UPDATE jobs SET status = 'running', trabalhador = ?, lease_ate = ?, batimento_em = ?, "
+            "tentativas = tentativas + 1, iniciado_em = COALESCE(iniciado_em, ?) WHERE job_id = ?",
+            (trabalhador, agora + LEASE_SEGUNDOS, agora, agora, linha['job_id']))
+    job = _para_dict(linha)
+    job['tentativas'] += 1
+    return job
+
+
+def renovar(job_id, trabalhador):
+    # Batimento: estende o prazo de posse. False se o job não é mais deste trabalhador
+    agora = time.time()
+    cursor = _conexao().execute(
+        "UPDATE jobs SET lease_ate = ?, batimento_em = ? WHERE job_id = ? AND trabalhador = ? AND status = 'running'",
+        (agora + LEASE_SEGUNDOS, agora, job_id, trabalhador))
+    return cursor.rowcount == 1
+
+
+def marcar_etapa(job_id, trabalhador, etapa):
+    agora = time.time()
+    with _transacao() as conexao:
+        linha = conexao.execute("SELECT etapa, etapas FROM jobs WHERE job_id = ? AND trabalhador = ?",
+                                (job_id, trabalhador)).fetchone()
+        if linha is None:
+            return
+        etapas = json.loads(linha['etapas'])
+        if linha['etapa'] is not None:
+            etapas[linha['etapa']].update(status='concluida', fim=agora)
+        etapas[etapa].update(status='executando', inicio=agora)
+        conexao.execute("UPDATE jobs SET etapa = ?, etapas = ? WHERE job_id = ?",
+                        (etapa, json.dumps(etapas), job_id))
+
+
+def concluir(job_id, trabalhador, arquivos, desatualizados=None, perfil=None):
+    # Só o dono atual grava o resultado: um worker que perdeu a posse não sobrescreve quem o substituiu
+    agora = time.time()
+    with _transacao() as conexao:
+        linha = conexao.execute("SELECT tipo, etapa, etapas FROM jobs WHERE job_id = ? AND trabalhador = ? "
+                                "AND status = 'running'", (job_id, trabalhador)).fetchone()
+        if linha is None:
+            logging.warning(f"Job {job_id} não pertence mais a {trabalhador}; resultado descartado.")
+            return False
+        etapas = json.loads(linha['etapas'])
+        if linha['etapa'] is not None:
+            etapas[linha['etapa']].update(status='concluida', fim=agora)
+        conexao.execute(
+            "UPDATE jobs SET status = 'success', etapa = NULL, etapas = ?, file_path = ?, files = ?, "
+            "desatualizados = ?, perfil = ?, lease_ate = NULL, finalizado_em = ? WHERE job_id = ?",
+            (json.dumps(etapas), arquivos[0], json.dumps(arquivos), json.dumps(desatualizados or {}),
+             json.dumps(perfil) if perfil else None, agora, job_id))
+    metricas.JOBS_TOTAL.incrementar(tipo=linha['tipo'], status='success')
+    return True
+
+
+def falhar(job_id, trabalhador, erro, permanente=False):
+    # Volta para a fila com espera exponencial enquanto houver tentativas; depois encerra com erro.
+    # Falhas 'permanente's (que se repetiriam igual em outra tentativa) encerram o job na hora
+    agora = time.time()
+    with _transacao() as conexao:
+        linha = conexao.execute("SELECT tipo, tentativas, max_tentativas FROM jobs WHERE job_id = ? "
+                                "AND trabalhador = ? AND status = 'running'", (job_id, trabalhador)).fetchone()
+        if linha is None:
+            return
+        if not permanente and linha['tentativas'] < linha['max_tentativas']:
+            espera = ESPERA_RETENTATIVA_SEGUNDOS * 2 ** (linha['tentativas'] - 1)
+            logging.warning(f"Job {job_id} falhou na tentativa {linha['tentativas']} ({erro}); "
+                            f"nova tentativa em {espera}s.")
+            conexao.execute("UPDATE jobs SET status = 'queued', trabalhador = NULL, lease_ate = NULL, etapa = NULL, "
+                            "disponivel_em = ? WHERE job_id = ?", (agora + espera, job_id))
+            return
+        logging.error(f"Job {job_id} falhou na tentativa {linha['tentativas']}, sem nova tentativa: {erro}")
+        conexao.execute("UPDATE jobs SET status = 'error', message = mensagem_erro, lease_ate = NULL, "
+                        "finalizado_em = ? WHERE job_id = ?", (agora, job_id))
+    metricas.JOBS_TOTAL.incrementar(tipo=linha['tipo'], status='error')
@@ -0,0 +1,118 @@
+# fila_relatorios.py
+
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metricas
+
+# Número máximo de relatórios gerados ao mesmo tempo
+MAX_TRABALHADORES = int(os.environ.get('FILA_TRABALHADORES', '2'))
+
+# Tempo (em segundos) que um job finalizado continua disponível para consulta
+RETENCAO_SEGUNDOS = int(os.environ.get('FILA_RETENCAO_SEGUNDOS', '3600'))
+
+ETAPAS = ['fetch', 'compute', 'render']
+
+_executor = ThreadPoolExecutor(max_workers=MAX_TRABALHADORES, thread_name_prefix='relatorio')
+_jobs = {}
+_em_andamento = {}
+_trava = threading.Lock()
+
+
+def _limpar_antigos():
+    limite = time.time() - RETENCAO_SEGUNDOS
+    for job_id in [j for j, job in _jobs.items() if job['finalizado_em'] and job['finalizado_em'] < limite]:
+        del _jobs[job_id]
+
+
+def _atualizar(job_id, **campos):
+    with _trava:
+        _jobs[job_id].update(campos)
+
+
+def _marcar_etapa(job_id, etapa):
+    agora = time.time()
+    with _trava:
+        job = _jobs[job_id]
+        if job['etapa'] is not None:
+            job['etapas'][job['etapa']].update(status='concluida', fim=agora)
+        job['etapa'] = etapa
+        job['etapas'][etapa].update(status='executando', inicio=agora)
+
+
+def _executar(job_id, tarefa, mensagem_erro):
+    _atualizar(job_id, status='running', iniciado_em=time.time())
+
+    def progresso(etapa):
+        _marcar_etapa(job_id, etapa)
+
+    try:
+        resultado = tarefa(progresso)
+        extras = {}
+        if isinstance(resultado, dict):
+            extras = dict(resultado)
+            resultado = extras.pop('arquivos')
+        arquivos = list(resultado) if isinstance(resultado, (list, tuple)) else [resultado]
+        if not arquivos or not all(arquivo and os.path.exists(arquivo) for arquivo in arquivos):
+            logging.error(f"O arquivo do job {job_id} não foi gerado.")
+            _atualizar(job_id, status='error', message=mensagem_erro)
+            return
+        with _trava:
+            job = _jobs[job_id]
+            if job['etapa'] is not None:
+                job['etapas'][job['etapa']].update(status='concluida', fim=time.time())
+            job.update(status='success', etapa=None, file_path=arquivos[0], files=arquivos, **extras)
+    except Exception as e:
+        logging.error(f"Erro no job {job_id}: {e}")
+        _atualizar(job_id, status='error', message=mensagem_erro)
+    finally:
+        with _trava:
+            _jobs[job_id]['finalizado_em'] = time.time()
+            chave = _jobs[job_id]['chave']
+            tipo, status = _jobs[job_id]['tipo'], _jobs[job_id]['status']
+            if _em_andamento.get(chave) == job_id:
+                del _em_andamento[chave]
+        metricas.JOBS_TOTAL.incrementar(tipo=tipo, status=status)
+
+
+def enfileirar(tipo, tarefa, chave=None, mensagem_erro='Erro ao gerar o PDF.'):
+    # 'tarefa' recebe o callback de progresso e devolve o caminho do arquivo gerado (ou uma lista deles),
+    # ou um dict com esses caminhos em 'arquivos' e campos extras para o job (ex.: 'perfil').
+    # Pedidos com a mesma 'chave' enquanto um job equivalente ainda roda compartilham esse job
+    chave = chave or tipo
+    with _trava:
+        _limpar_antigos()
+        if chave in _em_andamento:
+            job_id = _em_andamento[chave]
+            logging.info(f"Pedido {tipo} agregado ao job {job_id} em andamento.")
+            return job_id
+        job_id = uuid.uuid4().hex
+        _em_andamento[chave] = job_id
+        _jobs[job_id] = {
+            'job_id': job_id,
+            'tipo': tipo,
+            'chave': chave,
+            'status': 'queued',
+            'etapa': None,
+            'etapas': {etapa: {'status': 'pendente', 'inicio': None, 'fim': None} for etapa in ETAPAS},
+            'file_path': None,
+            'files': [],
+            'message': None,
+            'criado_em': time.time(),
+            'iniciado_em': None,
+            'finalizado_em': None,
+        }
+    _executor.submit(_executar, job_id, tarefa, mensagem_erro)
+    logging.info(f"Job {job_id} ({tipo}) enfileirado.")
+    return job_id
+
+
+def obter_status(job_id):
+    with _trava:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return {**job, 'etapas': {etapa: dict(info) for etapa, info in job['etapas'].items()}}
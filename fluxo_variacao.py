@@ -0,0 +1,312 @@
+# fluxo_variacao.py
+#
+# Variação diária ao vivo: o fechamento anterior de cada ativo fica em memória e as cotações chegam de
+# uma fonte plugável (replay local para testes, ou o provedor de dados consultado periodicamente).
+# Cada cotação nova vira um evento com a variação percentual, enviado ao painel por Server-Sent Events,
+# e o PDF da variação diária sai direto desse estado, sem baixar nada.
+
+import os
+import json
+import time
+import random
+import logging
+import datetime
+import threading
+from itertools import accumulate
+from collections import deque
+import metricas
+
+# Fonte das cotações ('replay' ou 'provedor') e intervalo entre rodadas de cotações, em segundos
+FONTE = os.environ.get('FLUXO_FONTE', 'replay')
+INTERVALO = float(os.environ.get('FLUXO_INTERVALO', '2'))
+
+# Replay: em quantos passos a sessão vai do fechamento anterior até o último fechamento guardado
+PASSOS_REPLAY = int(os.environ.get('FLUXO_PASSOS_REPLAY', '120'))
+
+# Conexões SSE simultâneas (cada uma ocupa uma thread do gunicorn) e intervalo do comentário de manutenção
+MAX_ASSINANTES = int(os.environ.get('FLUXO_MAX_ASSINANTES', '4'))
+BATIMENTO_SEGUNDOS = float(os.environ.get('FLUXO_BATIMENTO_SEGUNDOS', '15'))
+
+# Eventos guardados para quem reconecta (Last-Event-ID); quem ficou mais atrás recebe o estado inteiro
+HISTORICO_EVENTOS = int(os.environ.get('FLUXO_HISTORICO_EVENTOS', '2000'))
+
+
+class EstadoVariacao:
+    # Último preço e fechamento anterior de cada ativo, com a sequência de eventos de variação
+    def __init__(self, carteiras):
+        self.carteiras = carteiras
+        self.categorias = {ticker: categoria for categoria, carteira in carteiras.items() for ticker in carteira}
+        self.nomes = {ticker: nome for carteira in carteiras.values() for ticker, nome in carteira.items()}
+        self.sessao = None
+        self.epoca = time.time_ns()   # identifica esta carga do estado nos ids dos eventos
+        self._referencias = {}
+        self._precos = {}
+        self._horarios = {}
+        self._eventos = deque(maxlen=HISTORICO_EVENTOS)
+        self._seq = 0
+        self._condicao = threading.Condition()
+
+    def carregar(self, fechamentos, sessao):
+        # Fechamento anterior: o último antes da sessão; preço inicial: o da sessão, se já houver
+        import pandas as pd
+        with self._condicao:
+            self.sessao = pd.Timestamp(sessao).normalize()
+            for ticker in self.categorias:
+                if ticker not in fechamentos.columns:
+                    continue
+                serie = fechamentos[ticker].dropna()
+                anteriores = serie[serie.index < self.sessao]
+                if anteriores.empty:
+                    continue
+                self._referencias[ticker] = float(anteriores.iloc[-1])
+                na_sessao = serie[serie.index == self.sessao]
+                self._precos[ticker] = float(na_sessao.iloc[-1]) if not na_sessao.empty else self._referencias[ticker]
+                self._horarios[ticker] = self.sessao.to_pydatetime()
+            self.epoca = time.time_ns()
+            self._seq += 1
+            self._eventos.clear()
+            self._condicao.notify_all()
+
+    def referencias(self):
+        with self._condicao:
+            return dict(self._referencias)
+
+    def _ativo(self, ticker):
+        referencia, preco = self._referencias[ticker], self._precos[ticker]
+        return {'ticker': ticker, 'nome': self.nomes[ticker], 'categoria': self.categorias[ticker],
+                'preco': preco, 'referencia': referencia, 'variacao': (preco - referencia) / referencia * 100,
+                'horario': self._horarios[ticker].isoformat(timespec='seconds')}
+
+    def ingerir(self, ticker, preco, horario=None):
+        # Cotação nova de um ativo; só preços que mudam geram evento
+        with self._condicao:
+            if ticker not in self._referencias or preco is None or preco != preco or preco == self._precos[ticker]:
+                return False
+            self._precos[ticker] = float(preco)
+            self._horarios[ticker] = horario or datetime.datetime.now()
+            self._seq += 1
+            self._eventos.append((self._seq, self._ativo(ticker)))
+            self._condicao.notify_all()
+        metricas.FLUXO_COTACOES_TOTAL.incrementar(fonte=FONTE)
+        return True
+
+    def instantaneo(self):
+        with self._condicao:
+            sessao = self.sessao.date().isoformat() if self.sessao is not None else None
+            return {'seq': self._seq, 'epoca': self.epoca, 'sessao': sessao,
+                    'ativos': [self._ativo(ticker) for ticker in self.categorias if ticker in self._referencias]}
+
+    def aguardar(self, seq, tempo_limite):
+        # Eventos posteriores a 'seq' (esperando até tempo_limite por algum). None se 'seq' já saiu do
+        # histórico (ou é de outra carga do estado) e o assinante precisa do estado inteiro
+        with self._condicao:
+            self._condicao.wait_for(lambda: self._seq > seq, timeout=tempo_limite)
+            if self._seq <= seq:
+                return []
+            if not self._eventos or self._eventos[0][0] > seq + 1:
+                return None
+            return [(numero, evento) for numero, evento in self._eventos if numero > seq]
+
+    def resultados(self):
+        # Mesmo formato de pdf_gerador3.calcular: {categoria: (variação por nome do ativo, data)}
+        import pandas as pd
+        with self._condicao:
+            ultimo = max(self._horarios.values(), default=None)
+            data = ultimo.strftime('%d/%m/%Y %H:%M:%S') if ultimo else None
+            resultados = {}
+            for categoria, carteira in self.carteiras.items():
+                variacoes = {self.nomes[t]: (self._precos[t] - self._referencias[t]) / self._referencias[t] * 100
+                             for t in carteira if t in self._referencias}
+                resultados[categoria] = (pd.Series(variacoes, dtype=float), data if variacoes else None)
+            return self._seq, resultados
+
+
+class FonteCotacoes:
+    # Interface das fontes: 'sessao' diz qual pregão está sendo acompanhado e 'executar' publica
+    # cotações com estado.ingerir até 'parar' ser sinalizado
+    nome = 'base'
+
+    def sessao(self, fechamentos):
+        return datetime.date.today()
+
+    def executar(self, estado, parar):
+        raise NotImplementedError
+
+
+class FonteReplay(FonteCotacoes):
+    # Reencena o último pregão guardado: cada ativo vai do fechamento anterior ao último fechamento
+    # por uma ponte browniana, em PASSOS_REPLAY rodadas. Sem rede, para testes e demonstrações
+    nome = 'replay'
+
+    def __init__(self):
+        self._alvos = {}
+
+    def sessao(self, fechamentos):
+        self._alvos = {ticker: float(serie.dropna().iloc[-1]) for ticker, serie in fechamentos.items()
+                       if not serie.dropna().empty}
+        return fechamentos.index[-1]
+
+    def executar(self, estado, parar):
+        referencias = estado.referencias()
+        # O estado começa no fechamento anterior, e não no fechamento da sessão já gravado
+        for ticker, referencia in referencias.items():
+            estado.ingerir(ticker, referencia, estado.sessao.to_pydatetime())
+        caminhos = {}
+        for ticker, referencia in referencias.items():
+            alvo = self._alvos.get(ticker, referencia)
+            acumulado = list(accumulate(random.gauss(0, 0.002) for _ in range(PASSOS_REPLAY)))
+            # Ponte: ruído que volta a zero no fim, somado à interpolação do retorno até o alvo
+            caminhos[ticker] = [referencia * (alvo / referencia) ** ((i + 1) / PASSOS_REPLAY)
+                                * (1 + acumulado[i] - acumulado[-1] * (i + 1) / PASSOS_REPLAY)
+                                for i in range(PASSOS_REPLAY)]
+        inicio = datetime.datetime.combine(estado.sessao.date(), datetime.time(10, 0))
+        for passo in range(PASSOS_REPLAY):
+            if parar.wait(INTERVALO):
+                return
+            horario = inicio + datetime.timedelta(minutes=passo * 420 / PASSOS_REPLAY)
+            for ticker, caminho in caminhos.items():
+                estado.ingerir(ticker, round(caminho[passo], 6), horario)
+
+
+class FonteProvedor(FonteCotacoes):
+    # Consulta o provedor de dados configurado (PROVEDOR_DADOS) a cada INTERVALO segundos e publica a
+    # barra do dia, que no Yahoo traz o último preço durante o pregão. Passa pelo executor resiliente
+    nome = 'provedor'
+
+    def executar(self, estado, parar):
+        import pandas as pd
+        import provedor_dados
+        provedor = provedor_dados.obter_provedor()
+        tickers = list(estado.referencias())
+        while not parar.wait(INTERVALO):
+            try:
+                fechamentos = provedor.baixar_fechamentos(tickers, estado.sessao - pd.Timedelta(days=7))
+            except Exception as e:
+                logging.error(f"Erro ao consultar cotações para o fluxo ao vivo: {e}")
+                continue
+            if fechamentos.empty or fechamentos.index[-1] < estado.sessao:
+                continue
+            agora = datetime.datetime.now()
+            for ticker, preco in fechamentos.iloc[-1].items():
+                estado.ingerir(ticker, preco, agora)
+
+
+FONTES = {
+    FonteReplay.nome: FonteReplay,
+    FonteProvedor.nome: FonteProvedor,
+}
+
+
+def registrar_fonte(classe):
+    FONTES[classe.nome] = classe
+    return classe
+
+
+_estado = None
+_parar = None  # Event da fonte em execução; cada iniciar() cria o seu, para parar() só valer para aquela
+_assinantes = threading.BoundedSemaphore(MAX_ASSINANTES)
+_ultimo_pdf = (None, None)   # (seq do estado, caminho)
+_trava = threading.Lock()
+
+
+def _executar_fonte(fonte, estado, parar):
+    try:
+        fonte.executar(estado, parar)
+    except Exception as e:
+        logging.error(f"Fonte de cotações '{fonte.nome}' interrompida: {e}")
+
+
+def iniciar(nome_fonte=None):
+    # Carrega os fechamentos anteriores do universo do relatório de variação diária e inicia a fonte
+    # numa thread; chamadas seguintes devolvem o mesmo estado
+    global _estado, _parar
+    with _trava:
+        if _estado is not None:
+            return _estado
+        import pandas as pd
+        import armazem_precos
+        import pdf_gerador3
+        nome_fonte = nome_fonte or FONTE
+        if nome_fonte not in FONTES:
+            raise ValueError(f"Fonte de cotações desconhecida: {nome_fonte}")
+        fonte = FONTES[nome_fonte]()
+        estado = EstadoVariacao(pdf_gerador3.CARTEIRAS)
+        tickers, inicio = pdf_gerador3.universo_dados(carteiras=pdf_gerador3.CARTEIRAS)
+        fechamentos = armazem_precos.obter_fechamentos(tickers, inicio - pd.offsets.BDay(5))
+        estado.carregar(fechamentos, fonte.sessao(fechamentos))
+        _parar = threading.Event()
+        threading.Thread(target=_executar_fonte, args=(fonte, estado, _parar), name='fluxo-variacao',
+                         daemon=True).start()
+        logging.info(f"Fluxo de variação ao vivo iniciado: fonte '{fonte.nome}', sessão {estado.sessao.date()}, "
+                     f"{len(estado.referencias())} ativos.")
+        _estado = estado
+        return estado
+
+
+def parar():
+    global _estado, _parar
+    with _trava:
+        if _parar is not None:
+            _parar.set()
+        _estado, _parar = None, None
+
+
+def _evento(nome, dados, epoca, seq):
+    return f"id: {epoca}:{seq}\nevent: {nome}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+def reservar_assinatura():
+    # False se já há MAX_ASSINANTES conexões abertas; quem reservou chama liberar_assinatura ao fechar
+    return _assinantes.acquire(blocking=False)
+
+
+def liberar_assinatura():
+    _assinantes.release()
+
+
+def eventos_sse(ultimo_id=None):
+    # Gerador do corpo text/event-stream: o estado inteiro na conexão (ou só o que faltou, para quem
+    # reconecta com Last-Event-ID da mesma carga do estado), depois um evento por cotação e um
+    # comentário de manutenção quando não há cotações
+    estado = iniciar()
+    epoca, _, seq = str(ultimo_id or '').partition(':')
+    pendentes = None
+    if epoca == str(estado.epoca) and seq.isdigit():
+        seq = int(seq)
+        pendentes = estado.aguardar(seq, 0)
+    while True:
+        if pendentes is None:
+            instantaneo = estado.instantaneo()
+            seq = instantaneo['seq']
+            yield _evento('estado', instantaneo, estado.epoca, seq)
+        elif pendentes:
+            for seq, evento in pendentes:
+                yield _evento('variacao', evento, estado.epoca, seq)
+        else:
+            yield ': batimento\n\n'
+        pendentes = estado.aguardar(seq, BATIMENTO_SEGUNDOS)
+
+
+def gerar_pdf(pasta):
+    # PDF da variação diária a partir do estado em memória; o mesmo estado (seq) reaproveita o arquivo
+    global _ultimo_pdf
+    import renderizacao
+    import pdf_gerador3
+    import cache_relatorios
+    estado = iniciar()
+    seq, resultados = estado.resultados()
+    with _trava:
+        if _ultimo_pdf[0] == seq and os.path.exists(_ultimo_pdf[1]):
+            return _ultimo_pdf[1]
+    os.makedirs(pasta, exist_ok=True)
+    nome = f'Variação_Diária_ao_vivo_{estado.sessao:%Y-%m-%d}'
+    temporario = os.path.join(pasta, f'.{nome}_{seq}_{threading.get_ident()}.tmp.pdf')
+    with metricas.etapa('variacao_ao_vivo', 'render'):
+        renderizacao.renderizar_pdf(pdf_gerador3.paginas(resultados), temporario, processos=1,
+                                    relatorio='variacao_ao_vivo')
+    # Cada estado vira um arquivo com o hash do conteúdo (cacheável para sempre); os antigos saem com a retenção
+    caminho = cache_relatorios.publicar(temporario, pasta, nome, '.pdf')
+    cache_relatorios.limpar_antigos(pasta, f'{nome}_', caminho)
+    with _trava:
+        _ultimo_pdf = (seq, caminho)
+    return caminho
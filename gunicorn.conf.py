@@ -0,0 +1,23 @@
+# gunicorn.conf.py
+
+import os
+
+# Por padrão os workers sobem sem importar os geradores (pandas, matplotlib e seaborn só são
+# carregados no primeiro relatório). Com PRE_AQUECER=1 o app é carregado e aquecido uma vez no
+# processo mestre, antes do fork: os workers já nascem com tudo importado e o cache de fontes pronto
+preload_app = os.environ.get('PRE_AQUECER', '0') == '1'
+
+
+def on_starting(server):
+    if preload_app:
+        import aquecimento
+        aquecimento.aquecer()
+
+
+def post_worker_init(worker):
+    # Com AGENDADOR=1 cada worker disputa a liderança do agendador (só o líder pré-gera os relatórios).
+    # No modo durável quem gera são os processos do worker_relatorios.py, que iniciam o agendador
+    import agendador
+    import fila_duravel
+    if fila_duravel.MODO == 'local':
+        agendador.iniciar()
@@ -0,0 +1,197 @@
+# matriz_precos.py
+#
+# Matriz de fechamentos (data x ticker) em float32 num arquivo mapeado em memória, montada a partir do
+# armazém de preços. Cada processo (workers do gunicorn, backfill, pool de renderização) mapeia o mesmo
+# arquivo sem copiá-lo: as páginas ficam no cache do sistema operacional, compartilhadas, e um pedido só
+# copia a fatia de datas e tickers que usa. A matriz é guardada por coluna (ordem Fortran), então os
+# fechamentos de um ticker são contíguos.
+#
+# Cada reconstrução grava uma versão nova numa pasta própria e troca o ponteiro 'atual' atomicamente;
+# quem já mapeou a versão anterior continua lendo-a até a próxima consulta.
+
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import armazem_precos
+
+try:
+    import fcntl
+except ImportError:  # sem fcntl (Windows) a reconstrução só é coordenada entre as threads do processo
+    fcntl = None
+
+# Pasta das versões da matriz (padrão: dentro da pasta do armazém)
+PASTA_MATRIZ = os.environ.get('PASTA_MATRIZ', os.path.join(armazem_precos.PASTA_PRECOS, '_matriz'))
+
+TIPO = np.float32
+
+_matriz = None
+_trava = threading.Lock()
+
+
+class Matriz:
+    def __init__(self, pasta):
+        with open(os.path.join(pasta, 'indice.json')) as arquivo:
+            indice = json.load(arquivo)
+        self.pasta = pasta
+        self.versao = os.path.basename(pasta)
+        self.tickers = indice['tickers']
+        self.mtimes = indice['mtimes']
+        self.posicao = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.datas = pd.DatetimeIndex(np.load(os.path.join(pasta, 'datas.npy')), name='Date')
+        forma = (len(self.datas), len(self.tickers))
+        caminho = os.path.join(pasta, 'fechamentos.f32')
+        # Matriz vazia não pode ser mapeada
+        self.valores = (np.memmap(caminho, dtype=TIPO, mode='r', shape=forma, order='F')
+                        if all(forma) else np.empty(forma, dtype=TIPO))
+
+    def desatualizados(self, tickers):
+        # Tickers com arquivo no armazém mais novo que o usado na matriz (ou que ainda não estão nela)
+        pendentes = []
+        for ticker in tickers:
+            try:
+                mtime = os.stat(armazem_precos._caminho(ticker)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if self.mtimes.get(ticker) != mtime:
+                pendentes.append(ticker)
+        return pendentes
+
+
+def _ponteiro():
+    return os.path.join(PASTA_MATRIZ, 'atual')
+
+
+def _versao_atual():
+    try:
+        with open(_ponteiro()) as arquivo:
+            return arquivo.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _abrir():
+    # Matriz da versão apontada, reaproveitando o mapeamento do processo se ela não mudou
+    global _matriz
+    for _ in range(3):
+        versao = _versao_atual()
+        if versao is None:
+            return None
+        if _matriz is not None and _matriz.versao == versao:
+            return _matriz
+        try:
+            _matriz = Matriz(os.path.join(PASTA_MATRIZ, versao))
+            return _matriz
+        except FileNotFoundError:
+            # Outro processo trocou de versão e apagou esta entre a leitura do ponteiro e a abertura
+            continue
+    raise RuntimeError(f"Não foi possível abrir a matriz de preços em '{PASTA_MATRIZ}'.")
+
+
+class _TravaArquivo:
+    # Uma reconstrução por vez entre os processos que compartilham a pasta
+    def __enter__(self):
+        os.makedirs(PASTA_MATRIZ, exist_ok=True)
+        self.arquivo = open(os.path.join(PASTA_MATRIZ, '.trava'), 'w')
+        if fcntl is not None:
+            fcntl.flock(self.arquivo, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *excecao):
+        if fcntl is not None:
+            fcntl.flock(self.arquivo, fcntl.LOCK_UN)
+        self.arquivo.close()
+
+
+def _reconstruir(anterior, pendentes):
+    # Nova versão: colunas dos tickers pendentes relidas do armazém, as demais copiadas da versão anterior
+    inicio = time.perf_counter()
+    novos = {}
+    mtimes = dict(anterior.mtimes) if anterior else {}
+    for ticker in pendentes:
+        caminho = armazem_precos._caminho(ticker)
+        mtime = os.stat(caminho).st_mtime_ns
+        historico, _ = armazem_precos._ler(ticker)
+        novos[ticker] = historico['Close'].dropna().astype(TIPO)
+        mtimes[ticker] = mtime
+
+    tickers = list(anterior.tickers) if anterior else []
+    tickers += [ticker for ticker in pendentes if ticker not in (anterior.posicao if anterior else {})]
+    datas = anterior.datas if anterior else pd.DatetimeIndex([], name='Date')
+    for serie in novos.values():
+        datas = datas.union(serie.index)
+
+    versao = f'v{time.time_ns()}'
+    pasta = os.path.join(PASTA_MATRIZ, versao)
+    os.makedirs(pasta)
+    forma = (len(datas), len(tickers))
+    if all(forma):
+        valores = np.memmap(os.path.join(pasta, 'fechamentos.f32'), dtype=TIPO, mode='w+', shape=forma, order='F')
+        valores[:] = np.nan
+        if anterior is not None and anterior.valores.size:
+            # As datas da versão anterior estão todas na nova: cada coluna antiga vai para as mesmas linhas
+            linhas = datas.get_indexer(anterior.datas)
+            mantidas = [i for i, ticker in enumerate(anterior.tickers) if ticker not in novos]
+            if linhas[-1] - linhas[0] == len(linhas) - 1:
+                # Caso comum (só pregões novos no fim): as linhas antigas formam um bloco contínuo
+                linhas = slice(linhas[0], linhas[-1] + 1)
+            for i in mantidas:
+                valores[linhas, i] = anterior.valores[:, i]
+        posicao = {ticker: i for i, ticker in enumerate(tickers)}
+        for ticker, serie in novos.items():
+            valores[datas.get_indexer(serie.index), posicao[ticker]] = serie.to_numpy()
+        valores.flush()
+        del valores
+    else:
+        open(os.path.join(pasta, 'fechamentos.f32'), 'wb').close()
+    np.save(os.path.join(pasta, 'datas.npy'), datas.to_numpy(dtype='datetime64[ns]'))
+    with open(os.path.join(pasta, 'indice.json'), 'w') as arquivo:
+        json.dump({'tickers': tickers, 'mtimes': mtimes}, arquivo)
+
+    # Troca atômica do ponteiro; as versões antigas saem (quem as mapeou continua lendo até desmapear)
+    temporario = f'{_ponteiro()}.{os.getpid()}.tmp'
+    with open(temporario, 'w') as arquivo:
+        arquivo.write(versao)
+    os.replace(temporario, _ponteiro())
+    for nome in os.listdir(PASTA_MATRIZ):
+        if nome.startswith('v') and nome != versao:
+            shutil.rmtree(os.path.join(PASTA_MATRIZ, nome), ignore_errors=True)
+    logging.info(f"Matriz de preços {versao}: {forma[0]} datas x {forma[1]} tickers "
+                 f"({len(novos)} relidos do armazém) em {time.perf_counter() - inicio:.2f}s.")
+
+
+def sincronizar(tickers):
+    # Garante que a matriz tenha a versão mais recente do armazém para esses tickers e a devolve
+    with _trava:
+        matriz = _abrir()
+        if matriz is not None and not matriz.desatualizados(tickers):
+            return matriz
+        with _TravaArquivo():
+            # Outro processo pode ter acabado de reconstruir enquanto este esperava a trava
+            matriz = _abrir()
+            pendentes = matriz.desatualizados(tickers) if matriz else [
+                t for t in dict.fromkeys(tickers) if os.path.exists(armazem_precos._caminho(t))]
+            if pendentes:
+                _reconstruir(matriz, pendentes)
+                matriz = _abrir()
+        return matriz
+
+
+def fechamentos(tickers, inicio=None, fim=None):
+    # DataFrame (data x ticker) em float32 só com a fatia pedida; datas sem nenhum fechamento ficam de fora
+    tickers = list(dict.fromkeys(tickers))
+    matriz = sincronizar(tickers)
+    presentes = [ticker for ticker in tickers if matriz is not None and ticker in matriz.posicao]
+    if not presentes:
+        return pd.DataFrame()
+    primeira = matriz.datas.searchsorted(pd.Timestamp(inicio)) if inicio is not None else 0
+    ultima = matriz.datas.searchsorted(pd.Timestamp(fim), side='right') if fim is not None else len(matriz.datas)
+    colunas = [matriz.posicao[ticker] for ticker in presentes]
+    bloco = np.asarray(matriz.valores[primeira:ultima, colunas])
+    vazios = np.isnan(bloco)
+    tabela = pd.DataFrame(bloco, index=matriz.datas[primeira:ultima], columns=presentes)
+    return tabela.loc[~vazios.all(axis=1), ~vazios.all(axis=0)]
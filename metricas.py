@@ -0,0 +1,133 @@
+# metricas.py
+
+import time
+import threading
+from contextlib import contextmanager
+
+# Limites (em segundos) dos baldes dos histogramas de latência
+BALDES_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_metricas = []
+_trava = threading.Lock()
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatar_rotulos(rotulos, extra=None):
+    pares = list(rotulos) + (list(extra.items()) if extra else [])
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + '}'
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nome, ajuda):
+        self.nome = nome
+        self.ajuda = ajuda
+        self._valores = {}
+        _metricas.append(self)
+
+    def incrementar(self, valor=1, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with _trava:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def valor(self, **rotulos):
+        with _trava:
+            return self._valores.get(tuple(sorted(rotulos.items())), 0)
+
+    def _linhas(self):
+        for chave, valor in sorted(self._valores.items()):
+            yield f'{self.nome}{_formatar_rotulos(chave)} {valor}'
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, baldes=BALDES_PADRAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.baldes = tuple(sorted(baldes))
+        self._series = {}
+        _metricas.append(self)
+
+    def observar(self, valor, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with _trava:
+            serie = self._series.setdefault(chave, {'baldes': [0] * len(self.baldes), 'soma': 0.0, 'contagem': 0})
+            for i, limite in enumerate(self.baldes):
+                if valor <= limite:
+                    serie['baldes'][i] += 1
+            serie['soma'] += valor
+            serie['contagem'] += 1
+
+    def resumo(self, **rotulos):
+        # (soma, contagem) de uma série, usado por quem quer comparar antes e depois de uma execução
+        with _trava:
+            serie = self._series.get(tuple(sorted(rotulos.items())))
+            return (serie['soma'], serie['contagem']) if serie else (0.0, 0)
+
+    @contextmanager
+    def cronometrar(self, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **rotulos)
+
+    def _linhas(self):
+        for chave, serie in sorted(self._series.items()):
+            for limite, acumulado in zip(self.baldes, serie['baldes']):
+                yield f'{self.nome}_bucket{_formatar_rotulos(chave, {"le": repr(float(limite))})} {acumulado}'
+            yield f'{self.nome}_bucket{_formatar_rotulos(chave, {"le": "+Inf"})} {serie["contagem"]}'
+            yield f'{self.nome}_sum{_formatar_rotulos(chave)} {serie["soma"]}'
+            yield f'{self.nome}_count{_formatar_rotulos(chave)} {serie["contagem"]}'
+
+
+def exportar():
+    # Texto no formato de exposição do Prometheus (versão 0.0.4)
+    linhas = []
+    with _trava:
+        for metrica in _metricas:
+            linhas.append(f'# HELP {metrica.nome} {metrica.ajuda}')
+            linhas.append(f'# TYPE {metrica.nome} {metrica.tipo}')
+            linhas.extend(metrica._linhas())
+    return '\n'.join(linhas) + '\n'
+
+
+ETAPA_SEGUNDOS = Histograma('relatorio_etapa_segundos', 'Duração de cada etapa (fetch, compute, render) por relatório.')
+BUSCA_SEGUNDOS = Histograma('provedor_busca_segundos', 'Latência de cada chamada em lote ao provedor de dados.')
+BUSCA_TICKER_SEGUNDOS = Histograma('provedor_busca_ticker_segundos',
+                                   'Latência de busca atribuída a cada ticker (tempo do lote dividido pelos tickers).')
+PAGINA_SEGUNDOS = Histograma('render_pagina_segundos', 'Tempo para desenhar e gravar uma página.')
+ESCRITA_SEGUNDOS = Histograma('pdf_escrita_segundos', 'Tempo para montar e gravar o PDF final.')
+TICKERS_TOTAL = Contador('provedor_tickers_total', 'Tickers pedidos ao provedor, por resultado (ok ou falha).')
+ARMAZEM_TOTAL = Contador('armazem_consultas_total',
+                         'Consultas ao armazém de preços por resultado (acerto, complemento, frio ou desatualizado).')
+BUSCA_TENTATIVAS_TOTAL = Contador('provedor_tentativas_total',
+                                  'Requisições ao provedor por resultado (ok, erro, prazo ou circuito_aberto).')
+DISJUNTOR_TOTAL = Contador('provedor_disjuntor_transicoes_total',
+                           'Mudanças de estado do disjuntor de cada provedor (aberto, meio_aberto, fechado).')
+CACHE_TOTAL = Contador('relatorio_cache_total',
+                       'Pedidos de relatório por resultado do cache (agendado, ttl, dados ou falta).')
+BYTES_ESCRITOS = Contador('pdf_bytes_escritos_total', 'Bytes de PDF gravados em disco.')
+BYTES_ECONOMIZADOS = Contador('pdf_bytes_economizados_total',
+                              'Bytes a menos que o perfil compacto gravou em relação ao perfil padrão.')
+DADOS_CACHE_TOTAL = Contador('dados_cache_total',
+                             'Pedidos de dados/gráficos por resultado do cache em memória (ttl, dados ou falta).')
+JOBS_TOTAL = Contador('fila_jobs_total', 'Jobs finalizados por tipo e status.')
+AGENDA_TOTAL = Contador('agendador_execucoes_total', 'Execuções das regras do agendador por resultado.')
+FLUXO_COTACOES_TOTAL = Contador('fluxo_cotacoes_total', 'Cotações que mudaram o preço no fluxo de variação ao vivo.')
+
+
+@contextmanager
+def etapa(relatorio, nome, progresso=None):
+    # Marca o início de uma etapa para quem acompanha o job e mede sua duração
+    if progresso:
+        progresso(nome)
+    with ETAPA_SEGUNDOS.cronometrar(relatorio=relatorio, etapa=nome):
+        yield
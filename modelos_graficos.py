@@ -0,0 +1,75 @@
+# modelos_graficos.py
+
+import threading
+
+# Um conjunto de modelos por thread: nos processos de renderização isso é um cache por processo, e no
+# modo serial cada thread da fila tem as suas Figures. O estilo (rcParams) não é por thread: as
+# páginas de um processo são desenhadas e gravadas uma por vez (renderizacao.desenhando)
+_local = threading.local()
+
+
+class ModeloGrafico:
+    # Monta uma vez a figura, os eixos e os artistas fixos de um tipo de gráfico (construir()).
+    # Cada página só atualiza posições, alturas, cores e textos (atualizar()) e devolve a mesma Figure,
+    # que precisa ser gravada antes da próxima atualização
+    def __init__(self):
+        self.usos = 0
+        self.construir()
+
+    def construir(self):
+        raise NotImplementedError
+
+    def atualizar(self, **argumentos):
+        raise NotImplementedError
+
+    def desenhar(self, **argumentos):
+        self.usos += 1
+        return self.atualizar(**argumentos)
+
+
+def ajustar_textos(textos, quantidade, criar):
+    # Garante 'quantidade' artistas de texto visíveis, reaproveitando os já criados
+    # e escondendo as sobras (só cria os que faltarem)
+    while len(textos) < quantidade:
+        textos.append(criar())
+    for i, texto in enumerate(textos):
+        texto.set_visible(i < quantidade)
+    return textos[:quantidade]
+
+
+def obter(classe):
+    # Modelo da thread atual para a classe pedida, criado na primeira vez
+    modelos = getattr(_local, 'modelos', None)
+    if modelos is None:
+        modelos = _local.modelos = {}
+    if classe not in modelos:
+        modelos[classe] = classe()
+    return modelos[classe]
+
+
+def posicionar_rotulos(ancoras, tamanhos, deslocamentos, area, celula=40.0):
+    # Posiciona rótulos sem sobreposição, na ordem de prioridade de 'ancoras' (pontos em pontos tipográficos).
+    # Para cada rótulo tenta os 'deslocamentos' (dx, dy do centro) em ordem e fica com o primeiro que cabe
+    # na 'area' (x0, y0, x1, y1) sem encostar nos já colocados; quem não cabe fica sem rótulo (None).
+    # Os retângulos colocados vão para uma grade de células, então cada teste só olha os vizinhos
+    grade = {}
+    x0_area, y0_area, x1_area, y1_area = area
+    escolhidos = []
+    for (x, y), (largura, altura) in zip(ancoras, tamanhos):
+        escolha = None
+        for dx, dy in deslocamentos(largura, altura):
+            caixa = (x + dx - largura / 2, y + dy - altura / 2, x + dx + largura / 2, y + dy + altura / 2)
+            if caixa[0] < x0_area or caixa[1] < y0_area or caixa[2] > x1_area or caixa[3] > y1_area:
+                continue
+            celulas = [(i, j)
+                       for i in range(int(caixa[0] // celula), int(caixa[2] // celula) + 1)
+                       for j in range(int(caixa[1] // celula), int(caixa[3] // celula) + 1)]
+            if any(c[0] < caixa[2] and caixa[0] < c[2] and c[1] < caixa[3] and caixa[1] < c[3]
+                   for chave in celulas for c in grade.get(chave, ())):
+                continue
+            for chave in celulas:
+                grade.setdefault(chave, []).append(caixa)
+            escolha = (dx, dy)
+            break
+        escolhidos.append(escolha)
+    return escolhidos
@@ -0,0 +1,94 @@
+# motor_variacoes.py
+
+import numpy as np
+import pandas as pd
+
+
+def limpar_precos(precos):
+    # Zeros e valores ausentes viram lacunas (NaN) em toda a matriz de uma vez
+    precos = precos.sort_index()
+    return precos.where(precos != 0)
+
+
+def precos_em(precos, datas, lado='asof'):
+    # Preço de cada ativo em cada data pedida, sem laço por ativo:
+    #   lado='asof' -> último fechamento válido até a data (inclusive)
+    #   lado='desde' -> primeiro fechamento válido a partir da data (inclusive)
+    datas = pd.DatetimeIndex(pd.to_datetime(datas))
+    if precos.empty:
+        return pd.DataFrame(np.nan, index=datas, columns=precos.columns)
+
+    if lado == 'asof':
+        preenchidos = precos.ffill().to_numpy()
+        posicoes = precos.index.searchsorted(datas, side='right') - 1
+        validas = posicoes >= 0
+    elif lado == 'desde':
+        preenchidos = precos.bfill().to_numpy()
+        posicoes = precos.index.searchsorted(datas, side='left')
+        validas = posicoes < len(precos.index)
+    else:
+        raise ValueError(f"Lado desconhecido: {lado}")
+
+    valores = np.full((len(datas), precos.shape[1]), np.nan)
+    valores[validas] = preenchidos[posicoes[validas]]
+    return pd.DataFrame(valores, index=datas, columns=precos.columns)
+
+
+def datas_horizontes(horizontes, data_atual):
+    # Um horizonte inteiro é uma quantidade de dias úteis antes da data atual (comparado por 'asof');
+    # uma data é um marco fixo, como o início do ano (comparado pelo primeiro pregão a partir dele)
+    datas = {}
+    for nome, horizonte in horizontes.items():
+        if isinstance(horizonte, (int, np.integer)):
+            datas[nome] = (pd.Timestamp(data_atual) - pd.offsets.BDay(int(horizonte)), 'asof')
+        else:
+            datas[nome] = (pd.Timestamp(horizonte), 'desde')
+    return datas
+
+
+def calcular_variacoes(precos, horizontes, data_atual=None):
+    # Variação percentual de todos os ativos em todos os horizontes, a partir de uma matriz data x ativo
+    if precos.empty:
+        return pd.DataFrame(columns=list(horizontes), dtype=float)
+    precos = limpar_precos(precos)
+    data_atual = pd.Timestamp(data_atual) if data_atual is not None else pd.Timestamp.today()
+    precos = precos[precos.index <= data_atual]
+
+    # Uma busca vetorizada por tipo de comparação cobre todos os horizontes de uma vez
+    marcos = datas_horizontes(horizontes, data_atual)
+    nomes_asof = [nome for nome, (_, lado) in marcos.items() if lado == 'asof']
+    nomes_desde = [nome for nome, (_, lado) in marcos.items() if lado == 'desde']
+
+    valores_asof = precos_em(precos, [data_atual] + [marcos[nome][0] for nome in nomes_asof]).to_numpy()
+    valores_desde = precos_em(precos, [marcos[nome][0] for nome in nomes_desde], lado='desde').to_numpy()
+    preco_atual = valores_asof[0]
+    bases = {**dict(zip(nomes_asof, valores_asof[1:])), **dict(zip(nomes_desde, valores_desde))}
+
+    variacoes = {nome: (preco_atual - bases[nome]) / bases[nome] * 100 for nome in horizontes}
+    return pd.DataFrame(variacoes, index=precos.columns).dropna(how='all')
+
+
+def calcular_variacoes_historicas(precos, horizontes, datas):
+    # As mesmas variações de calcular_variacoes para várias datas de referência de uma vez
+    # (uma busca vetorizada por horizonte cobre todas as datas). Além de inteiros e datas fixas,
+    # um horizonte pode ser uma sequência de marcos, um por data (ex.: o início do ano de cada data).
+    # Devolve {horizonte: DataFrame data x ativo}
+    datas = pd.DatetimeIndex(pd.to_datetime(datas))
+    precos = limpar_precos(precos)
+    atuais = precos_em(precos, datas).to_numpy()
+
+    variacoes = {}
+    for nome, horizonte in horizontes.items():
+        if isinstance(horizonte, (int, np.integer)):
+            bases = precos_em(precos, datas - pd.offsets.BDay(int(horizonte))).to_numpy()
+        else:
+            if np.ndim(horizonte) == 0:
+                marcos = pd.DatetimeIndex([pd.Timestamp(horizonte)] * len(datas))
+            else:
+                marcos = pd.DatetimeIndex(pd.to_datetime(horizonte))
+            bases = precos_em(precos, marcos, lado='desde').to_numpy()
+            # Um marco posterior à data de referência ainda não existia naquela data
+            bases[np.asarray(marcos > datas)] = np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variacoes[nome] = pd.DataFrame((atuais - bases) / bases * 100, index=datas, columns=precos.columns)
+    return variacoes
@@ -1,234 +1,337 @@
+import os
+import logging
 import pandas as pd
-import matplotlib.pyplot as plt
-import yfinance as yf
 import datetime
 import matplotlib
 matplotlib.use('Agg')
-from matplotlib.backends.backend_pdf import PdfPages
+import matplotlib.style
+from matplotlib.figure import Figure
 import warnings
+import numpy as np
+import armazem_precos
+import motor_variacoes
+import renderizacao
+import modelos_graficos
+import metricas
 
 warnings.filterwarnings('ignore')
 
-def gerar_pdf_analise_dispersao(output_file="Variação_Dispersão.pdf"):
-    # Carteira de Moedas, Bolsas e Commodities
-    moedas = ['USDBRL=X', 'THB=X', 'USDAUD=X', 'USDMXN=X', 'USDGBP=X',
-              'USDEUR=X', 'JPY=X', 'CHF=X', 'CAD=X', 'CNY=X', 'INR=X',
-              'CZK=X', 'TRY=X', 'NOK=X', 'SEK=X']
-
-    nomes_amigaveis_moedas = {
-        'USDBRL=X': 'Real',
-        'THB=X': 'Baht Tailandês',
-        'USDAUD=X': 'Dólar Australiano',
-        'USDMXN=X': 'Peso Mexicano',
-        'USDGBP=X': 'Dólar X Libra',
-        'USDEUR=X': 'Dólar X Euro',
-        'JPY=X': 'Iene Japonês',
-        'CHF=X': 'Franco Suíço',
-        'CAD=X': 'Dólar Canadense',
-        'CNY=X': 'Yuan Chinês',
-        'INR=X': 'Rupia Indiana',
-        'CZK=X': 'Coroa Tcheca',
-        'TRY=X': 'Lira Turca',
-        'NOK=X': 'Coroa Norueguesa',
-        'SEK=X': 'Coroa Sueca'
+# Carteira de Moedas, Bolsas e Commodities
+MOEDAS = ['USDBRL=X', 'THB=X', 'USDAUD=X', 'USDMXN=X', 'USDGBP=X',
+          'USDEUR=X', 'JPY=X', 'CHF=X', 'CAD=X', 'CNY=X', 'INR=X',
+          'CZK=X', 'TRY=X', 'NOK=X', 'SEK=X']
+
+NOMES_AMIGAVEIS_MOEDAS = {
+    'USDBRL=X': 'Real',
+    'THB=X': 'Baht Tailandês',
+    'USDAUD=X': 'Dólar Australiano',
+    'USDMXN=X': 'Peso Mexicano',
+    'USDGBP=X': 'Dólar X Libra',
+    'USDEUR=X': 'Dólar X Euro',
+    'JPY=X': 'Iene Japonês',
+    'CHF=X': 'Franco Suíço',
+    'CAD=X': 'Dólar Canadense',
+    'CNY=X': 'Yuan Chinês',
+    'INR=X': 'Rupia Indiana',
+    'CZK=X': 'Coroa Tcheca',
+    'TRY=X': 'Lira Turca',
+    'NOK=X': 'Coroa Norueguesa',
+    'SEK=X': 'Coroa Sueca'
+}
+
+BOLSAS = ['^GSPC', '^DJI', '^IXIC', '^FTSE', '^N225', '^GDAXI', '^HSI', '^BSESN', '^BVSP', 
+          '^MERV', '^FCHI', '^BFX', '^TWII', '^STOXX50E', '^TA125.TA','000001.SS']
+
+NOMES_AMIGAVEIS_BOLSAS = {
+    '^GSPC': 'S&P 500',
+    '^DJI': 'Dow Jones',
+    '^IXIC': 'Nasdaq',
+    '^FTSE': 'FTSE 100',
+    '^N225': 'Nikkei 225',
+    '^GDAXI': 'DAX',
+    '^HSI': 'Hang Seng',
+    '^BSESN': 'Sensex (Índia)',
+    '^BVSP': 'Bovespa',
+    '^MERV': 'Merval (Argentina)',
+    '^FCHI': 'CAC 40 (França)',
+    '^BFX': 'BEL 20 (Bélgica)',
+    '^TWII': 'TSEC (Taiwan)',
+    '^STOXX50E': 'Euro Stoxx 50',
+    '^TA125.TA': 'TA-125 (Israel)',
+    '000001.SS': 'Xangai (China)'
+}
+
+COMMODITIES = ['CL=F', 'GC=F', 'SI=F', 'HG=F', 'NG=F', 'ZC=F', 'ZW=F', 'KC=F', 'CT=F', 'SB=F',
+              'PA=F', 'PL=F', 'HO=F', 'RB=F', 'OJ=F', 'CC=F', 'ZS=F', 'ZM=F', 'LE=F', 'HE=F', 'BZ=F', 'TIO=F']
+
+NOMES_AMIGAVEIS_COMMODITIES = {
+    'CL=F': 'Petróleo WTI',
+    'GC=F': 'Ouro',
+    'SI=F': 'Prata',
+    'HG=F': 'Cobre',
+    'NG=F': 'Gás Natural',
+    'ZC=F': 'Milho',
+    'ZW=F': 'Trigo',
+    'KC=F': 'Café',
+    'CT=F': 'Algodão',
+    'SB=F': 'Açúcar',
+    'PA=F': 'Paládio',
+    'PL=F': 'Platina',
+    'HO=F': 'Óleo de Aquecimento',
+    'RB=F': 'Gasolina',
+    'OJ=F': 'Suco de Laranja',
+    'CC=F': 'Cacau',
+    'ZS=F': 'Soja (CBOT)',
+    'ZM=F': 'Farelo de Soja',
+    'LE=F': 'Boi Gordo',
+    'HE=F': 'Suínos Magros',
+    'BZ=F': 'Petróleo Brent',
+    'TIO=F': 'Minério de Ferro'
+}
+
+ATIVOS = MOEDAS + BOLSAS + COMMODITIES
+
+# Carteiras do relatório: classe -> {ticker: nome amigável}
+CARTEIRAS = {
+    'Moeda': {ticker: NOMES_AMIGAVEIS_MOEDAS.get(ticker, ticker) for ticker in MOEDAS},
+    'Bolsa': {ticker: NOMES_AMIGAVEIS_BOLSAS.get(ticker, ticker) for ticker in BOLSAS},
+    'Commodity': {ticker: NOMES_AMIGAVEIS_COMMODITIES.get(ticker, ticker) for ticker in COMMODITIES},
+}
+
+# Os dados são coletados desde 2024
+INICIO_DADOS = datetime.datetime(2024, 1, 1)
+
+# Horizontes padrão (em dias úteis) e início da variação anual
+HORIZONTES = (7, 45, 90)
+INICIO_ANUAL = datetime.datetime(2025, 1, 1)
+
+# Universos grandes: classes com mais de LIMITE_ROTULOS ativos só rotulam os extremos e os outliers,
+# sem sobreposição, e acima de LIMITE_PONTOS a camada de pontos é reduzida (o tamanho da página
+# fica estável; rasterizar a camada saiu maior que os pontos reduzidos em vetor)
+LIMITE_ROTULOS = int(os.environ.get('DISPERSAO_LIMITE_ROTULOS', '60'))
+ROTULOS_EXTREMOS = int(os.environ.get('DISPERSAO_ROTULOS_EXTREMOS', '10'))
+LIMITE_PONTOS = int(os.environ.get('DISPERSAO_LIMITE_PONTOS', '2000'))
+
+
+def universo_dados(carteiras=None, horizontes=HORIZONTES, inicio_anual=INICIO_ANUAL, data_referencia=None):
+    ativos = [ticker for carteira in (carteiras or CARTEIRAS).values() for ticker in carteira]
+    # A coleta precisa cobrir o marco anual e o horizonte mais longo antes da data de referência
+    referencia = pd.Timestamp(data_referencia) if data_referencia else pd.Timestamp.today().normalize()
+    inicio = min(pd.Timestamp(INICIO_DADOS), pd.Timestamp(inicio_anual),
+                 referencia - pd.offsets.BDay(max(horizontes, default=0) + 10))
+    return list(dict.fromkeys(ativos)), inicio
+
+
+def selecionar_rotulos(valores, extremos=ROTULOS_EXTREMOS):
+    # Índices a rotular, por prioridade: os extremos dos dois lados, de fora para dentro,
+    # e depois até 2 x 'extremos' outliers (mais de 3,5 desvios robustos da mediana), do maior para o menor
+    ordem = np.argsort(valores)
+    indices = [i for par in zip(ordem[::-1][:extremos], ordem[:extremos]) for i in par]
+    mediana = np.median(valores)
+    desvio = 1.4826 * np.median(np.abs(valores - mediana))
+    if desvio > 0:
+        distancia = np.abs(valores - mediana) / desvio
+        outliers = np.flatnonzero(distancia > 3.5)
+        indices.extend(outliers[np.argsort(-distancia[outliers])][:2 * extremos])
+    return list(dict.fromkeys(int(i) for i in indices))
+
+
+def reduzir_pontos(valores, limite=LIMITE_PONTOS, manter=()):
+    # Índices dos pontos desenhados: o eixo x (ordem do retorno anual) é dividido em faixas e de cada uma
+    # ficam só o menor e o maior valor, o que preserva o contorno da nuvem. Os rotulados sempre ficam
+    total = len(valores)
+    if total <= limite:
+        return np.arange(total)
+    faixas = np.arange(total) * (limite // 2) // total
+    ordem = np.lexsort((valores, faixas))
+    primeiros = np.r_[True, faixas[ordem][1:] != faixas[ordem][:-1]]
+    ultimos = np.r_[primeiros[1:], True]
+    return np.union1d(ordem[primeiros | ultimos], np.asarray(manter, dtype=int))
+
+
+def _deslocamentos_rotulo(largura, altura):
+    # Posições candidatas do centro do rótulo em relação ao ponto: acima, abaixo, à direita, à esquerda
+    return [(0, 10), (0, -10), (largura / 2 + 6, 0), (-largura / 2 - 6, 0), (0, 10 + altura), (0, -10 - altura)]
+
+
+class ModeloDispersao(modelos_graficos.ModeloGrafico):
+    # Figura, eixos, dispersão, linha do zero e barra de cores são criados uma vez;
+    # cada página só troca pontos, cores, limites e textos
+    def construir(self):
+        with matplotlib.style.context('default'):
+            self.fig = Figure(figsize=(11, 8))
+            self.axs = self.fig.subplots()
+            self.titulo = self.fig.suptitle('', fontsize=16)
+            self.scatter = self.axs.scatter([], [], c=[], cmap='RdYlGn', s=150)
+            self.axs.axhline(y=0, color='black', linestyle='--', linewidth=0.5)
+            self.fig.colorbar(self.scatter, ax=self.axs, label='Variação (%)')
+            self.axs.set_xticks([])  # Remover rótulos do eixo X
+            self.rotulos = []
+
+    def atualizar(self, nomes, valores, classe, titulo):
+        valores = np.asarray(valores, dtype=float)
+        posicoes = np.column_stack([np.arange(len(valores)), valores])
+        grande = len(valores) > LIMITE_ROTULOS
+        desenhados = reduzir_pontos(valores, manter=selecionar_rotulos(valores)) if grande else slice(None)
+        with matplotlib.style.context('default'):
+            self.titulo.set_text(f'{classe} - Variação ({titulo}) - Ordenado pelo Retorno Anual')
+            self.axs.set_xlabel(f'{classe} - Ordenado pelo Retorno Anual', fontsize=12)
+            self.axs.set_ylabel(f'Variação (%) - {titulo}', fontsize=12)
+
+            self.scatter.set_offsets(posicoes[desenhados])
+            self.scatter.set_array(valores[desenhados])
+            self.scatter.set_clim(valores.min(), valores.max())
+            # Marcadores menores quando há muitos ativos
+            self.scatter.set_sizes([max(150 * LIMITE_ROTULOS / len(valores), 10) if grande else 150])
+
+            # Limites recalculados só a partir dos pontos novos (e da linha do zero)
+            self.axs.ignore_existing_data_limits = True
+            self.axs.update_datalim(np.vstack([posicoes, [[0, 0]]]))
+            self.axs.autoscale_view()
+
+            if grande:
+                self._rotular_extremos(nomes, valores, posicoes)
+                return self.fig
+
+            # Anotação para cada ativo com o nome amigável
+            rotulos = modelos_graficos.ajustar_textos(self.rotulos, len(nomes), self._criar_rotulo)
+            for rotulo, txt, posicao in zip(rotulos, nomes, posicoes):
+                rotulo.set_text(txt)
+                rotulo.xy = tuple(posicao)
+                rotulo.xyann = (0, 10)
+                rotulo.set_verticalalignment('baseline')
+
+            self.fig.tight_layout(rect=[0, 0.03, 1, 0.95])
+        return self.fig
+
+    def _criar_rotulo(self):
+        return self.axs.annotate('', (0, 0), textcoords="offset points", xytext=(0, 10), ha='center', fontsize=8)
+
+    def _rotular_extremos(self, nomes, valores, posicoes):
+        # Layout feito antes, sem rótulos, para as posições na tela já serem as finais
+        modelos_graficos.ajustar_textos(self.rotulos, 0, self._criar_rotulo)
+        self.fig.tight_layout(rect=[0, 0.03, 1, 0.95])
+
+        # Tudo em pontos tipográficos, a mesma unidade dos deslocamentos das anotações
+        escala = 72 / self.fig.dpi
+        indices = selecionar_rotulos(valores)
+        ancoras = self.axs.transData.transform(posicoes[indices]) * escala
+        tamanhos = [(0.6 * 8 * len(nomes[i]), 8 * 1.3) for i in indices]
+        area = tuple(self.axs.get_window_extent().extents * escala)
+        escolhas = modelos_graficos.posicionar_rotulos(ancoras, tamanhos, _deslocamentos_rotulo, area)
+        colocados = [(i, escolha) for i, escolha in zip(indices, escolhas) if escolha is not None]
+
+        rotulos = modelos_graficos.ajustar_textos(self.rotulos, len(colocados), self._criar_rotulo)
+        for rotulo, (i, deslocamento) in zip(rotulos, colocados):
+            rotulo.set_text(nomes[i])
+            rotulo.xy = tuple(posicoes[i])
+            rotulo.xyann = deslocamento
+            rotulo.set_verticalalignment('center')
+
+
+def desenhar_dispersao(nomes, valores, classe, titulo):
+    # Uma página do relatório: dispersão da variação de uma classe num período
+    return modelos_graficos.obter(ModeloDispersao).desenhar(nomes=nomes, valores=valores, classe=classe,
+                                                            titulo=titulo)
+
+
+def montar_tabela(df_variacoes, carteiras):
+    # Tabela do relatório: ativos com variação anual, com ticker, nome amigável e classe
+    nomes_amigaveis = {ticker: nome for carteira in carteiras.values() for ticker, nome in carteira.items()}
+    classes = {ticker: classe for classe, carteira in carteiras.items() for ticker in carteira}
+    df_variacoes = df_variacoes.dropna(subset=['Variação_Anual'])
+    df_variacoes.insert(0, 'Ativo', df_variacoes.index)
+    df_variacoes.insert(1, 'Nome_Amigavel', [nomes_amigaveis.get(ativo, ativo) for ativo in df_variacoes.index])
+    df_variacoes.insert(2, 'Classe', [classes[ativo] for ativo in df_variacoes.index])
+    return df_variacoes.reset_index(drop=True)
+
+
+def paginas_dispersao(df_variacoes, carteiras, horizontes, sufixo=''):
+    # Uma página por classe e período, na ordem das carteiras; 'sufixo' é acrescentado ao título
+    # (ex.: a data, quando várias datas vão para o mesmo documento)
+    periodos_graficos = {
+        **{f'{dias} Dias': f'Variação_{dias}_Dias' for dias in horizontes},
+        'Anual': 'Variação_Anual'
     }
 
-    bolsas = ['^GSPC', '^DJI', '^IXIC', '^FTSE', '^N225', '^GDAXI', '^HSI', '^BSESN', '^BVSP', 
-              '^MERV', '^FCHI', '^BFX', '^TWII', '^STOXX50E', '^TA125.TA','000001.SS']
-
-    nomes_amigaveis_bolsas = {
-        '^GSPC': 'S&P 500',
-        '^DJI': 'Dow Jones',
-        '^IXIC': 'Nasdaq',
-        '^FTSE': 'FTSE 100',
-        '^N225': 'Nikkei 225',
-        '^GDAXI': 'DAX',
-        '^HSI': 'Hang Seng',
-        '^BSESN': 'Sensex (Índia)',
-        '^BVSP': 'Bovespa',
-        '^MERV': 'Merval (Argentina)',
-        '^FCHI': 'CAC 40 (França)',
-        '^BFX': 'BEL 20 (Bélgica)',
-        '^TWII': 'TSEC (Taiwan)',
-        '^STOXX50E': 'Euro Stoxx 50',
-        '^TA125.TA': 'TA-125 (Israel)',
-        '000001.SS': 'Xangai (China)'
-    }
+    paginas = []
+    for classe in carteiras:
+        df_classe = df_variacoes[df_variacoes['Classe'] == classe].sort_values(by='Variação_Anual', ascending=True)
 
-    commodities = ['CL=F', 'GC=F', 'SI=F', 'HG=F', 'NG=F', 'ZC=F', 'ZW=F', 'KC=F', 'CT=F', 'SB=F',
-                  'PA=F', 'PL=F', 'HO=F', 'RB=F', 'OJ=F', 'CC=F', 'ZS=F', 'ZM=F', 'LE=F', 'HE=F', 'BZ=F', 'TIO=F']
-
-    nomes_amigaveis_commodities = {
-        'CL=F': 'Petróleo WTI',
-        'GC=F': 'Ouro',
-        'SI=F': 'Prata',
-        'HG=F': 'Cobre',
-        'NG=F': 'Gás Natural',
-        'ZC=F': 'Milho',
-        'ZW=F': 'Trigo',
-        'KC=F': 'Café',
-        'CT=F': 'Algodão',
-        'SB=F': 'Açúcar',
-        'PA=F': 'Paládio',
-        'PL=F': 'Platina',
-        'HO=F': 'Óleo de Aquecimento',
-        'RB=F': 'Gasolina',
-        'OJ=F': 'Suco de Laranja',
-        'CC=F': 'Cacau',
-        'ZS=F': 'Soja (CBOT)',
-        'ZM=F': 'Farelo de Soja',
-        'LE=F': 'Boi Gordo',
-        'HE=F': 'Suínos Magros',
-        'BZ=F': 'Petróleo Brent',
-        'TIO=F': 'Minério de Ferro'
-    }
+        if df_classe.empty:
+            logging.warning(f"Sem dados para a classe {classe}.")
+            continue
+
+        for titulo, coluna in periodos_graficos.items():
+            paginas.append((desenhar_dispersao, {
+                'nomes': df_classe['Nome_Amigavel'].tolist(),
+                'valores': df_classe[coluna].to_numpy(),
+                'classe': classe,
+                'titulo': titulo + sufixo,
+            }))
+    return paginas
+
+
+def calcular(progresso=None, precos=None, carteiras=None, horizontes=HORIZONTES, inicio_anual=INICIO_ANUAL,
+             data_referencia=None):
+    # Coleta e cálculo do relatório, sem desenhar: a tabela de variações, com o contexto das páginas
+    carteiras = carteiras or CARTEIRAS
+    ativos, inicio_dados = universo_dados(carteiras, horizontes, inicio_anual, data_referencia)
+    nomes_amigaveis = {ticker: nome for carteira in carteiras.values() for ticker, nome in carteira.items()}
 
-    # Função para ajustar timezone e resolver problemas de data
-    def ajustar_timezone(index):
-        if hasattr(index, 'tz'):
-            return index.tz_convert(None)
-        return index
-
-    # Função para verificar e limpar dados inconsistentes
-    def verificar_dados_inconsistentes(dados):
-        if dados.isnull().any().any():
-            dados = dados.dropna()
-        if (dados == 0).any().any():
-            dados = dados[dados != 0]
-        return dados
-
-    # Função para pegar o fechamento exato para os dias desejados
-    def obter_fechamento_exato(historico, datas):
-        preços = {}
-        for nome_periodo, data in datas.items():
-            if data in historico.index:
-                preços[nome_periodo] = historico['Close'].loc[data]
-            else:
-                preços[nome_periodo] = historico['Close'].asof(data)
-        return preços
-
-    # Unindo todas as carteiras
-    ativos = moedas + bolsas + commodities
-    nomes_amigaveis = {**nomes_amigaveis_moedas, **nomes_amigaveis_bolsas, **nomes_amigaveis_commodities}
-
-    # Definir datas de início e fim
-    hoje = datetime.datetime.now().replace(tzinfo=None)
-    inicio_ano = datetime.datetime(2025, 1, 1).replace(tzinfo=None)
+    # Definir datas de início e fim (a data de referência permite refazer o relatório de um dia passado)
+    hoje = pd.Timestamp(data_referencia) if data_referencia else datetime.datetime.now().replace(tzinfo=None)
+    inicio_ano = pd.Timestamp(inicio_anual)  # Variação anual começa em 2025, salvo outro marco pedido
+
+    # Horizontes: dias úteis antes de hoje, ou uma data fixa (primeiro pregão a partir dela)
     periodos = {
-        '7d': (hoje - pd.offsets.BDay(7)).replace(tzinfo=None),
-        '45d': (hoje - pd.offsets.BDay(45)).replace(tzinfo=None),
-        '90d': (hoje - pd.offsets.BDay(90)).replace(tzinfo=None),
-        '1y': inicio_ano
+        'Variação_Anual': inicio_ano,
+        **{f'Variação_{dias}_Dias': int(dias) for dias in horizontes},
     }
 
-    # Dicionário para armazenar as variações dos ativos
-    variacoes = {
-        'Ativo': [],
-        'Nome_Amigavel': [],
-        'Classe': [],
-        'Variação_Anual': [],
-        'Variação_7_Dias': [],
-        'Variação_45_Dias': [],
-        'Variação_90_Dias': []
-    }
+    # Coleta de dados de todo o universo de uma vez (armazém local + provedor em lote)
+    with metricas.etapa('dispersao', 'fetch', progresso):
+        # Quem já tem a matriz de fechamentos (ex.: geração combinada) pode passá-la em 'precos'
+        if precos is None:
+            precos = armazem_precos.obter_fechamentos(ativos, inicio_dados, hoje)  # Coleta desde 2024
+        precos = precos.reindex(columns=[a for a in ativos if a in precos.columns])
+
+    # Calcular todas as variações de todos os ativos sobre a matriz de preços
+    with metricas.etapa('dispersao', 'compute', progresso):
+        df_variacoes = motor_variacoes.calcular_variacoes(precos, periodos, hoje)
+
+        # Sem fechamento desde o início do ano não há variação anual: o ativo fica de fora
+        for ativo in df_variacoes.index[df_variacoes['Variação_Anual'].isna()]:
+            logging.warning(f"Sem dados para {nomes_amigaveis.get(ativo, ativo)} desde {inicio_ano}.")
+        df_variacoes = montar_tabela(df_variacoes, carteiras)
 
-    # Alteração na Data Inicial
-    inicio_dados = datetime.datetime(2024, 1, 1).replace(tzinfo=None)  # Coletar desde 2024
-    inicio_ano = datetime.datetime(2025, 1, 1).replace(tzinfo=None)  # Variação anual começa em 2025
-
-    # Coleta de dados
-    for ativo in ativos:
-        classe = 'Moeda' if ativo in moedas else 'Bolsa' if ativo in bolsas else 'Commodity'
-        nome_amigavel = nomes_amigaveis.get(ativo, ativo)
-        ticker = yf.Ticker(ativo)
-        historico = ticker.history(start=inicio_dados, end=hoje)  # Coleta desde 2024
-
-        # Ajustar o index para remover timezone
-        historico.index = ajustar_timezone(historico.index)
-
-        if not historico.empty:
-            # Limpar dados inconsistentes
-            historico = verificar_dados_inconsistentes(historico)
-
-            try:
-                # Filtrar apenas os dados desde 2025 para calcular variação anual
-                historico_2025 = historico[historico.index >= inicio_ano]
-
-                if historico_2025.empty:
-                    print(f"Sem dados para {nome_amigavel} desde {inicio_ano}.")
-                    continue
-
-                # Preço atual e preço de início de 2025
-                preco_atual = historico_2025['Close'][-1]
-                preco_inicio_2025 = historico_2025['Close'].iloc[0]
-
-                # Calcular a variação anual
-                variacao_anual = ((preco_atual - preco_inicio_2025) / preco_inicio_2025) * 100
-
-                # Obter fechamentos exatos para os períodos desejados
-                precos = obter_fechamento_exato(historico, periodos)
-                variacao_7_dias = ((preco_atual - precos['7d']) / precos['7d']) * 100
-                variacao_45_dias = ((preco_atual - precos['45d']) / precos['45d']) * 100
-                variacao_90_dias = ((preco_atual - precos['90d']) / precos['90d']) * 100
-
-                # Armazenar no dicionário
-                variacoes['Ativo'].append(ativo)
-                variacoes['Nome_Amigavel'].append(nome_amigavel)
-                variacoes['Classe'].append(classe)
-                variacoes['Variação_Anual'].append(variacao_anual)
-                variacoes['Variação_7_Dias'].append(variacao_7_dias)
-                variacoes['Variação_45_Dias'].append(variacao_45_dias)
-                variacoes['Variação_90_Dias'].append(variacao_90_dias)
-            except Exception as e:
-                print(f"Erro ao processar {nome_amigavel}: {e}")
-
-    # Convertendo o dicionário para DataFrame e ordenando por Variação Anual
-    df_variacoes = pd.DataFrame(variacoes)
+    return {'tabela': df_variacoes, 'carteiras': carteiras, 'horizontes': horizontes, 'periodos': list(periodos)}
+
+
+def paginas(resultado):
+    return paginas_dispersao(resultado['tabela'], resultado['carteiras'], resultado['horizontes'])
+
+
+def para_json(resultado):
+    return {'periodos': resultado['periodos'], 'ativos': resultado['tabela'].to_dict(orient='records')}
+
+
+def gerar_pdf_analise_dispersao(output_file="Variação_Dispersão.pdf", progresso=None, precos=None, carteiras=None,
+                                horizontes=HORIZONTES, inicio_anual=INICIO_ANUAL, data_referencia=None):
+    resultado = calcular(progresso, precos, carteiras, horizontes, inicio_anual, data_referencia)
+    df_variacoes = resultado['tabela']
 
     if df_variacoes.empty:
-        print("Nenhuma variação calculada. PDF não será gerado.")
+        logging.error("Nenhuma variação calculada. PDF não será gerado.")
         return output_file
 
-    # Exibir o DataFrame no terminal
-    print("Variações dos Ativos:")
-    print(df_variacoes[['Nome_Amigavel', 'Variação_Anual', 'Variação_7_Dias', 'Variação_45_Dias']])
-
-    # Gerar gráficos de dispersão e salvar em PDF, organizados por setor e período
-    with PdfPages(output_file) as pdf:
-        classes_ativos = ['Moeda', 'Bolsa', 'Commodity']
-        periodos_graficos = {
-            '7 Dias': 'Variação_7_Dias',
-            '45 Dias': 'Variação_45_Dias',
-            '90 Dias': 'Variação_90_Dias',
-            'Anual': 'Variação_Anual'
-        }
-
-        for classe in classes_ativos:
-            df_classe = df_variacoes[df_variacoes['Classe'] == classe].sort_values(by='Variação_Anual', ascending=True)
-            
-            if df_classe.empty:
-                print(f"Sem dados para a classe {classe}.")
-                continue
-
-            for titulo, coluna in periodos_graficos.items():
-                fig, axs = plt.subplots(figsize=(11, 8))
-                fig.suptitle(f'{classe} - Variação ({titulo}) - Ordenado pelo Retorno Anual', fontsize=16)
-
-                scatter = axs.scatter(range(len(df_classe)), df_classe[coluna], c=df_classe[coluna], cmap='RdYlGn', s=150)
-                axs.set_xlabel(f'{classe} - Ordenado pelo Retorno Anual', fontsize=12)
-                axs.set_ylabel(f'Variação (%) - {titulo}', fontsize=12)
-                axs.axhline(y=0, color='black', linestyle='--', linewidth=0.5)
-
-                # Anotação para cada ativo com o nome amigável
-                for i, txt in enumerate(df_classe['Nome_Amigavel']):
-                    y = df_classe[coluna].iloc[i]
-                    axs.annotate(txt, (i, y), textcoords="offset points", xytext=(0, 10), ha='center', fontsize=8)
-
-                fig.colorbar(scatter, ax=axs, label='Variação (%)')
-                plt.xticks([])  # Remover rótulos do eixo X
-                plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-                pdf.savefig(fig)
-                plt.close(fig)
-
-    print(f"Gráficos ajustados e salvos no arquivo '{output_file}'.")
+    # A tabela inteira só no log de depuração (formatá-la custa, então só quando ele está ligado)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Variações dos Ativos:\n{df_variacoes[['Nome_Amigavel', *resultado['periodos']]]}")
+
+    # As páginas (dispersão por setor e período) são desenhadas em paralelo e juntadas na ordem
+    with metricas.etapa('dispersao', 'render', progresso):
+        renderizacao.renderizar_pdf(paginas(resultado), output_file, relatorio='dispersao')
+
+    logging.info(f"Gráficos ajustados e salvos no arquivo '{output_file}'.")
     return output_file
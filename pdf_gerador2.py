@@ -1,184 +1,284 @@
 # pdf_gerador2.py
 
-import yfinance as yf
+import numpy as np
 import pandas as pd
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
+import matplotlib.style
+from matplotlib.figure import Figure
 import matplotlib.colors as mcolors
-from matplotlib.backends.backend_pdf import PdfPages
 import logging
+import colorsys
 from datetime import datetime
 import warnings
+import armazem_precos
+from zscore_rolante import ZScoreRolante
+import renderizacao
+import modelos_graficos
+import metricas
 
 warnings.filterwarnings('ignore')
 
-def gerar_pdf(output_file="Análise_Z-Score_Carteiras.pdf"):
-    # Configurar o logging
-    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+# Definir as carteiras com nomes amigáveis em português
+CARTEIRA_BOLSAS = {
+    '^GSPC': 'S&P 500 (EUA)',
+    '^DJI': 'Dow Jones (EUA)',
+    '^IXIC': 'Nasdaq (EUA)',
+    '^FTSE': 'FTSE 100 (Reino Unido)',
+    '^N225': 'Nikkei 225 (Japão)',
+    '^HSI': 'Hang Seng (Hong Kong)',
+    '^BVSP': 'Ibovespa (Brasil)',
+    '^STOXX50E': 'Euro Stoxx 50 (Zona do Euro)',
+    '^GDAXI': 'DAX (Alemanha)',
+    '^RUT': 'Russell 2000 (EUA)',
+    '^AORD': 'S&P/ASX 200 (Austrália)',
+    '^FCHI': 'CAC 40 (França)',
+    '^KS11': 'KOSPI (Coreia do Sul)',
+    '^BSESN': 'BSE Sensex (Índia)',
+    '^BFX': 'BEL 20 (Bélgica)',
+    '^MERV': 'Merval (Argentina)',
+    '^TWII': 'TSEC (Taiwan)',
+    '^TA125.TA': 'TA-125 (Israel)',
+    '^MXX': 'IPC (México)',
+    '000001.SS': 'Xangai (China)',
+}
+
+CARTEIRA_COMMODITIES = {
+    'CL=F': 'Petróleo WTI',
+    'GC=F': 'Ouro',
+    'SI=F': 'Prata',
+    'HG=F': 'Cobre',
+    'NG=F': 'Gás Natural',
+    'ZC=F': 'Milho',
+    'ZW=F': 'Trigo',
+    'KC=F': 'Café',
+    'CT=F': 'Algodão',
+    'SB=F': 'Açúcar',
+    'PA=F': 'Paládio',
+    'PL=F': 'Platina',
+    'HO=F': 'Óleo de Aquecimento',
+    'RB=F': 'Gasolina',
+    'OJ=F': 'Suco de Laranja',
+    'CC=F': 'Cacau',
+    'ZS=F': 'Soja (CBOT)',
+    'ZM=F': 'Farelo de Soja',
+    'LE=F': 'Boi Gordo',
+    'HE=F': 'Suínos Magros',
+    'BZ=F': 'Petróleo Brent',
+    'TIO=F': 'Minério de Ferro'
+}
+
+CARTEIRA_MOEDAS = {
+    'USDJPY=X': 'Iene Japonês',
+    'USDEUR=X': 'USD/Euro',
+    'USDGBP=X': 'USD/Libra',
+    'USDAUD=X': 'Dólar Australiano',
+    'USDCAD=X': 'Dólar Canadense',
+    'USDCHF=X': 'Franco Suíço',
+    'USDCNY=X': 'Yuan Chinês',
+    'USDBRL=X': 'Real Brasileiro',
+    'USDINR=X': 'Rupia Indiana',
+    'USDRUB=X': 'Rublo Russo',
+    'USDMXN=X': 'Peso Mexicano',
+    'USDZAR=X': 'Rand Sul-Africano',
+    'USDTRY=X': 'Lira Turca',
+    'USDKRW=X': 'Won Sul-Coreano',
+    'USDIDR=X': 'Rupia Indonésia',
+    'USDTHB=X': 'Baht Tailandês',
+    'USDSGD=X': 'Dólar de Singapura',
+    'USDPLN=X': 'Zloty Polonês',
+    'USDNOK=X': 'Coroa Norueguesa'
+}
+
+ATIVOS = list(CARTEIRA_MOEDAS) + list(CARTEIRA_BOLSAS) + list(CARTEIRA_COMMODITIES)
+
+# Carteiras do relatório, na ordem das páginas: nome -> {ticker: nome amigável}
+CARTEIRAS = {
+    'Pares de Moedas': CARTEIRA_MOEDAS,
+    'Bolsas de Valores': CARTEIRA_BOLSAS,
+    'Commodities': CARTEIRA_COMMODITIES,
+}
+
+
+def universo_dados(carteiras=None, janelas=(20,), data_referencia=None):
+    # Um ano de fechamentos antes da data de referência (ou mais, se a maior janela pedir)
+    ativos = [ticker for carteira in (carteiras or CARTEIRAS).values() for ticker in carteira]
+    referencia = pd.Timestamp(data_referencia) if data_referencia else pd.Timestamp.today().normalize()
+    inicio = min(referencia - pd.DateOffset(years=1), referencia - pd.offsets.BDay(max(janelas) + 10))
+    return list(dict.fromkeys(ativos)), inicio
 
-    # Definir as carteiras com nomes amigáveis em português
-    carteira_bolsas = {
-        '^GSPC': 'S&P 500 (EUA)',
-        '^DJI': 'Dow Jones (EUA)',
-        '^IXIC': 'Nasdaq (EUA)',
-        '^FTSE': 'FTSE 100 (Reino Unido)',
-        '^N225': 'Nikkei 225 (Japão)',
-        '^HSI': 'Hang Seng (Hong Kong)',
-        '^BVSP': 'Ibovespa (Brasil)',
-        '^STOXX50E': 'Euro Stoxx 50 (Zona do Euro)',
-        '^GDAXI': 'DAX (Alemanha)',
-        '^RUT': 'Russell 2000 (EUA)',
-        '^AORD': 'S&P/ASX 200 (Austrália)',
-        '^FCHI': 'CAC 40 (França)',
-        '^KS11': 'KOSPI (Coreia do Sul)',
-        '^BSESN': 'BSE Sensex (Índia)',
-        '^BFX': 'BEL 20 (Bélgica)',
-        '^MERV': 'Merval (Argentina)',
-        '^TWII': 'TSEC (Taiwan)',
-        '^TA125.TA': 'TA-125 (Israel)',
-        '^MXX': 'IPC (México)',
-        '000001.SS': 'Xangai (China)',
-    }
-
-    carteira_commodities = {
-        'CL=F': 'Petróleo WTI',
-        'GC=F': 'Ouro',
-        'SI=F': 'Prata',
-        'HG=F': 'Cobre',
-        'NG=F': 'Gás Natural',
-        'ZC=F': 'Milho',
-        'ZW=F': 'Trigo',
-        'KC=F': 'Café',
-        'CT=F': 'Algodão',
-        'SB=F': 'Açúcar',
-        'PA=F': 'Paládio',
-        'PL=F': 'Platina',
-        'HO=F': 'Óleo de Aquecimento',
-        'RB=F': 'Gasolina',
-        'OJ=F': 'Suco de Laranja',
-        'CC=F': 'Cacau',
-        'ZS=F': 'Soja (CBOT)',
-        'ZM=F': 'Farelo de Soja',
-        'LE=F': 'Boi Gordo',
-        'HE=F': 'Suínos Magros',
-        'BZ=F': 'Petróleo Brent',
-        'TIO=F': 'Minério de Ferro'
-    }
-
-    carteira_moedas = {
-        'USDJPY=X': 'Iene Japonês',
-        'USDEUR=X': 'USD/Euro',
-        'USDGBP=X': 'USD/Libra',
-        'USDAUD=X': 'Dólar Australiano',
-        'USDCAD=X': 'Dólar Canadense',
-        'USDCHF=X': 'Franco Suíço',
-        'USDCNY=X': 'Yuan Chinês',
-        'USDBRL=X': 'Real Brasileiro',
-        'USDINR=X': 'Rupia Indiana',
-        'USDRUB=X': 'Rublo Russo',
-        'USDMXN=X': 'Peso Mexicano',
-        'USDZAR=X': 'Rand Sul-Africano',
-        'USDTRY=X': 'Lira Turca',
-        'USDKRW=X': 'Won Sul-Coreano',
-        'USDIDR=X': 'Rupia Indonésia',
-        'USDTHB=X': 'Baht Tailandês',
-        'USDSGD=X': 'Dólar de Singapura',
-        'USDPLN=X': 'Zloty Polonês',
-        'USDNOK=X': 'Coroa Norueguesa'
-    }
-
-    # Configurar o estilo dos gráficos
-    sns.set_style('whitegrid')
-    plt.style.use('default')
-
-    def obter_dados_historicos(ativos, dias_media):
-        dados = pd.DataFrame()
-        for ativo in ativos:
-            try:
-                dado_ativo = yf.download(ativo, period='1y', interval='1d')['Close']
-                if not dado_ativo.empty:
-                    dados[ativo] = dado_ativo
-                else:
-                    logging.warning(f"Sem dados para o ativo {ativo}.")
-            except Exception as e:
-                logging.error(f"Erro ao baixar dados para {ativo}: {e}")
-        return dados.tail(dias_media).fillna(method='ffill').fillna(method='bfill')
-
-    def calcular_z_score(ativos, dados_recente):
-        taxas_atuais = dados_recente.iloc[-1]
-        media = dados_recente.mean()
-        desvio_padrao = dados_recente.std()
-        z_scores = (taxas_atuais - media) / desvio_padrao
-        z_scores = z_scores.reindex(ativos, fill_value=0)  # Preencher com zero caso o Z-score não possa ser calculado
-        return z_scores
 
-    def plotar_z_scores(z_scores, nome_carteira, dias_media):
+def dessaturar(cores, proporcao=0.75):
+    # Mesma dessaturação que o seaborn aplica às cores das barras (saturation=0.75)
+    saida = []
+    for r, g, b, a in cores:
+        h, l, s = colorsys.rgb_to_hls(r, g, b)
+        saida.append((*colorsys.hls_to_rgb(h, l, s * proporcao), a))
+    return saida
+
+
+class ModeloZScore(modelos_graficos.ModeloGrafico):
+    # Figura, eixos e grade criados uma vez; as barras são reaproveitadas enquanto a carteira tiver
+    # o mesmo número de ativos, e os rótulos de valor vêm de um conjunto de textos reutilizados
+    def construir(self):
+        with matplotlib.style.context('default'):
+            self.fig = Figure(figsize=(14, 8))
+            self.ax = self.fig.subplots()
+            self.ax.set_xlabel('Ativos', fontsize=14)
+            self.ax.tick_params(axis='y', labelsize=12)
+            self.ax.grid(True, which='both', axis='y', linestyle='--', linewidth=0.7, alpha=0.7)
+            self.ax.set_axisbelow(True)
+            self.barras = None
+            self.rotulos = []
+
+    def atualizar(self, z_scores, nome_carteira, dias_media, hoje):
         z_scores_ordenados = z_scores.sort_values(ascending=True)  # Ordenar de forma ascendente
-        vmin = z_scores_ordenados.min()
-        vmax = z_scores_ordenados.max()
+        valores = z_scores_ordenados.to_numpy(dtype=float)
+        # Z-score ausente (ex.: preço constante na janela, desvio zero) não entra na escala de cores
+        algum = not np.isnan(valores).all()
+        vmin = np.nanmin(valores) if algum else 0.0
+        vmax = np.nanmax(valores) if algum else 0.0
+        if vmin == vmax:
+            # Com um só valor a escala precisa de largura para o TwoSlopeNorm
+            vmin, vmax = vmin - 1, vmax + 1
         vcenter = 0 if vmin < 0 and vmax > 0 else (vmin + vmax) / 2
 
         norm = mcolors.TwoSlopeNorm(vmin=vmin, vcenter=vcenter, vmax=vmax)
-        cmap = plt.get_cmap('RdYlGn')
-        colors = cmap(norm(z_scores_ordenados.values))
+        cmap = matplotlib.colormaps['RdYlGn']
+        colors = dessaturar(cmap(norm(valores)))
 
-        num_assets = len(z_scores_ordenados)
-        plt.figure(figsize=(max(14, num_assets * 0.7), 8))
+        num_assets = len(valores)
 
-        ax = sns.barplot(x=z_scores_ordenados.index, y=z_scores_ordenados.values, palette=colors)
+        # Estilo padrão do matplotlib enquanto a página é montada; o rcParams é global, então quem
+        # desenha e grava a página segura renderizacao.desenhando()
+        with matplotlib.style.context('default'):
+            self.fig.set_size_inches(max(14, num_assets * 0.7), 8)
+            ax = self.ax
 
-        hoje = datetime.today().strftime('%d/%m/%Y')
-        plt.xlabel('Ativos', fontsize=14)
+            if self.barras is not None and len(self.barras) == num_assets:
+                for barra, altura, cor in zip(self.barras, valores, colors):
+                    barra.set_height(altura)
+                    barra.set_facecolor(cor)
+            else:
+                if self.barras is not None:
+                    self.barras.remove()
+                self.barras = ax.bar(range(num_assets), valores, width=0.8, color=colors)
+            ax.set_xticks(range(num_assets))
+            ax.set_xticklabels(z_scores_ordenados.index, rotation=45, ha='right', fontsize=12)
+            ax.set_xlim(-0.5, num_assets - 0.5)
+            ax.relim()
+            ax.autoscale_view(scalex=False)
 
-        if nome_carteira == 'Pares de Moedas':
-            plt.ylabel('Z-score // > 0 = Desvalorização da Moeda & < 0 = Valorização da Moeda', fontsize=10)
-        else:
-            plt.ylabel('Z-score', fontsize=14)
+            if nome_carteira == 'Pares de Moedas':
+                ax.set_ylabel('Z-score // > 0 = Desvalorização da Moeda & < 0 = Valorização da Moeda', fontsize=10)
+            else:
+                ax.set_ylabel('Z-score', fontsize=14)
 
-        plt.title(f'Z-score - {nome_carteira} em {hoje}\n(Últimos {dias_media} dias)', fontsize=18)
-        plt.xticks(rotation=45, ha='right', fontsize=12)
-        plt.yticks(fontsize=12)
+            ax.set_title(f'Z-score - {nome_carteira} em {hoje}\n(Últimos {dias_media} dias)', fontsize=18)
 
-        max_z_score = max(abs(z_scores_ordenados.min()), abs(z_scores_ordenados.max()))
-        offset = 0.01 * max_z_score
+            max_z_score = max(abs(vmin), abs(vmax))
+            offset = 0.01 * max_z_score
+
+            rotulos = modelos_graficos.ajustar_textos(self.rotulos, num_assets, lambda: ax.text(
+                0, 0, '', ha='center', fontsize=12, bbox=dict(facecolor='white', edgecolor='none', pad=1)))
+            for i, (rotulo, valor) in enumerate(zip(rotulos, valores)):
+                if np.isnan(valor):
+                    rotulo.set_text('')
+                    continue
+                rotulo.set_text(f'{valor:.2f}')
+                if valor >= 0:
+                    rotulo.set_position((i, valor + offset))
+                    rotulo.set_verticalalignment('bottom')
+                else:
+                    rotulo.set_position((i, valor - offset))
+                    rotulo.set_verticalalignment('top')
+
+            self.fig.tight_layout()
+        return self.fig
 
-        for i, valor in enumerate(z_scores_ordenados.values):
-            if valor >= 0:
-                ax.text(i, valor + offset, f'{valor:.2f}', ha='center', va='bottom', fontsize=12, bbox=dict(facecolor='white', edgecolor='none', pad=1))
-            else:
-                ax.text(i, valor - offset, f'{valor:.2f}', ha='center', va='top', fontsize=12, bbox=dict(facecolor='white', edgecolor='none', pad=1))
 
-        ax.grid(True, which='both', axis='y', linestyle='--', linewidth=0.7, alpha=0.7)
-        ax.set_axisbelow(True)
-        plt.tight_layout()
+def plotar_z_scores(z_scores, nome_carteira, dias_media, hoje):
+    return modelos_graficos.obter(ModeloZScore).desenhar(z_scores=z_scores, nome_carteira=nome_carteira,
+                                                         dias_media=dias_media, hoje=hoje)
 
-    def gerar_analises(carteira, dias_media, nome_carteira, pdf):
+
+def paginas_zscore(analises, hoje):
+    # 'analises' é uma lista de (Z-scores janela x ativo, nome da carteira): uma página por carteira e janela
+    return [(plotar_z_scores, {'z_scores': z_scores_janela, 'nome_carteira': nome_carteira,
+                               'dias_media': dias_media, 'hoje': hoje})
+            for z_scores, nome_carteira in analises
+            for dias_media, z_scores_janela in z_scores.iterrows()]
+
+
+def calcular(progresso=None, janelas=(20,), precos=None, carteiras=None, data_referencia=None):
+    # Coleta e cálculo do relatório, sem desenhar: os Z-scores (janela x ativo) de cada carteira
+    # Fechamentos do universo inteiro (as três carteiras) obtidos numa única chamada
+    with metricas.etapa('zscore', 'fetch', progresso):
+        carteiras = carteiras or CARTEIRAS
+        ativos, inicio = universo_dados(carteiras, janelas, data_referencia)
+        fechamentos = armazem_precos.obter_fechamentos(ativos, inicio, data_referencia) if precos is None else precos
+        if data_referencia and not fechamentos.empty:
+            fechamentos = fechamentos[fechamentos.index <= pd.Timestamp(data_referencia)]
+
+    def obter_dados_historicos(ativos):
+        dados = fechamentos.reindex(columns=[a for a in ativos if a in fechamentos.columns]).dropna(how='all')
+        return dados.fillna(method='ffill')
+
+    def calcular_z_score(ativos, dados, janelas):
+        # Todas as janelas de todos os ativos da carteira numa única passada (janela x ativo)
+        z_scores = ZScoreRolante(janelas, dados.columns).carregar(dados).z_scores()
+        z_scores = z_scores.reindex(columns=ativos, fill_value=0)  # Preencher com zero caso o Z-score não possa ser calculado
+        return z_scores
+
+    def gerar_analises(carteira, janelas, nome_carteira):
         ativos = list(carteira.keys())
-        dados_recente = obter_dados_historicos(ativos, dias_media)
+        dados = obter_dados_historicos(ativos)
 
-        if dados_recente.empty:
+        if dados.empty:
             logging.error(f"Nenhum dado disponível para {nome_carteira}.")
             return
 
-        z_scores = calcular_z_score(ativos, dados_recente)
+        z_scores = calcular_z_score(ativos, dados, janelas)
 
         if z_scores.empty:
             logging.warning(f"Não há Z-scores calculados para {nome_carteira}.")
             return
 
-        z_scores.index = [carteira[ativo] for ativo in z_scores.index]
-        plotar_z_scores(z_scores, nome_carteira, dias_media)
-        pdf.savefig()
-        plt.close()
-
-    # Função principal para gerar o PDF
-    with PdfPages(output_file) as pdf:
-        dias_media = 20
-        gerar_analises(carteira_moedas, dias_media, 'Pares de Moedas', pdf)
-        gerar_analises(carteira_bolsas, dias_media, 'Bolsas de Valores', pdf)
-        gerar_analises(carteira_commodities, dias_media, 'Commodities', pdf)
+        z_scores.columns = [carteira[ativo] for ativo in z_scores.columns]
+        return z_scores
+
+    # Calcular os Z-scores de todas as carteiras e janelas antes de desenhar
+    with metricas.etapa('zscore', 'compute', progresso):
+        analises = []
+        for nome_carteira, carteira in carteiras.items():
+            z_scores = gerar_analises(carteira, janelas, nome_carteira)
+            if z_scores is not None:
+                analises.append((z_scores, nome_carteira))
+
+    hoje = (pd.Timestamp(data_referencia) if data_referencia else datetime.today()).strftime('%d/%m/%Y')
+    return {'analises': analises, 'hoje': hoje}
+
+
+def paginas(resultado):
+    return paginas_zscore(resultado['analises'], resultado['hoje'])
+
+
+def para_json(resultado):
+    # {carteira: {janela: {ativo: Z-score}}}
+    return {'data': resultado['hoje'],
+            'carteiras': {nome_carteira: {str(janela): linha.to_dict() for janela, linha in z_scores.iterrows()}
+                          for z_scores, nome_carteira in resultado['analises']}}
+
+
+def gerar_pdf(output_file="Análise_Z-Score_Carteiras.pdf", progresso=None, janelas=(20,), precos=None,
+              carteiras=None, data_referencia=None):
+    # Configurar o logging
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    resultado = calcular(progresso, janelas, precos, carteiras, data_referencia)
+
+    # Função principal para gerar o PDF: uma página por carteira e janela
+    with metricas.etapa('zscore', 'render', progresso):
+        renderizacao.renderizar_pdf(paginas(resultado), output_file, relatorio='zscore')
 
     logging.info(f"Análises exportadas para '{output_file}'.")
     return output_file
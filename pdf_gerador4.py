@@ -0,0 +1,205 @@
+# pdf_gerador4.py
+
+import pandas as pd
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.style
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+import logging
+from datetime import datetime
+import warnings
+import armazem_precos
+import regressao_pares
+import renderizacao
+import modelos_graficos
+import metricas
+import pdf_gerador1
+import pdf_gerador2
+
+warnings.filterwarnings('ignore')
+
+# Universo combinado dos relatórios de dispersão e de Z-score, por classe: {ticker: nome amigável}
+CARTEIRAS = {
+    'Moedas': {**pdf_gerador1.CARTEIRAS['Moeda'], **pdf_gerador2.CARTEIRA_MOEDAS},
+    'Bolsas': {**pdf_gerador1.CARTEIRAS['Bolsa'], **pdf_gerador2.CARTEIRA_BOLSAS},
+    'Commodities': {**pdf_gerador1.CARTEIRAS['Commodity'], **pdf_gerador2.CARTEIRA_COMMODITIES},
+}
+
+# Janelas (em pregões) das correlações; a regressão usa a maior delas
+JANELAS = (20, 60, 250)
+
+# Pares exibidos: os N maiores e os N menores resíduos padronizados do último pregão
+QUANTIDADE_PARES = 15
+
+# Faixa destacada nos gráficos de resíduo, em desvios padrão
+FAIXA_DESVIOS = 1.5
+
+RODAPE = 'FIM J&F Disciplina / Mesa Quant - Eduardo Zeidan'
+
+
+def universo_dados(carteiras=None, janelas=JANELAS, data_referencia=None):
+    # A maior janela mais o aquecimento da correlação rolante antes da data de referência
+    ativos = [ticker for carteira in (carteiras or CARTEIRAS).values() for ticker in carteira]
+    referencia = pd.Timestamp(data_referencia) if data_referencia else pd.Timestamp.today().normalize()
+    inicio = referencia - pd.offsets.BDay(max(janelas) + min(janelas) + 10)
+    return list(dict.fromkeys(ativos)), inicio
+
+
+def desenhar_destaques(rotulos, valores, quantidade):
+    # Primeira página: barras horizontais com os resíduos padronizados extremos do último pregão
+    valores = np.asarray(valores, dtype=float)
+    with matplotlib.style.context('default'):
+        fig = Figure(figsize=(12, 8))
+        ax = fig.subplots()
+        cores = np.where(valores >= 0, '#2ca02c', '#d62728')
+        ax.barh(range(len(valores)), valores, color=cores)
+        ax.set_yticks(range(len(valores)))
+        ax.set_yticklabels(rotulos, fontsize=8)
+        ax.axvline(0, color='black', linewidth=0.8)
+        for i, valor in enumerate(valores):
+            ax.text(valor, i, f' {valor:.2f} ', va='center', ha='left' if valor >= 0 else 'right', fontsize=8)
+        limite = np.abs(valores).max() * 1.2
+        ax.set_xlim(-limite, limite)
+        ax.set_xlabel('Resíduo Padronizado (desvios padrão)')
+        ax.grid(True, axis='x', linestyle='--', alpha=0.5)
+        ax.set_title(f'Destaques diários | {quantidade} maiores & {quantidade} menores resíduos', fontsize=14)
+        fig.text(0.5, 0.01, RODAPE, ha='center', fontsize=8, color='gray')
+        fig.tight_layout(rect=[0, 0.03, 1, 1])
+    return fig
+
+
+class ModeloResiduo(modelos_graficos.ModeloGrafico):
+    # Eixos, faixa de desvios, linhas do zero e textos fixos criados uma vez;
+    # cada par só troca as séries, os limites e os textos
+    def construir(self):
+        with matplotlib.style.context('default'):
+            self.fig = Figure(figsize=(12, 6))
+            self.ax, self.ax_corr = self.fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [3, 1]})
+            self.titulo = self.fig.suptitle('', fontsize=14)
+            self.subtitulo = self.fig.text(0.5, 0.905, '', ha='center', fontsize=10)
+            self.fig.text(0.5, 0.01, RODAPE, ha='center', fontsize=8, color='gray')
+
+            self.ax.axhspan(-FAIXA_DESVIOS, FAIXA_DESVIOS, color='gray', alpha=0.15,
+                            label=f'Intervalo de {FAIXA_DESVIOS}dp')
+            self.ax.axhline(0, color='black', linewidth=0.6)
+            self.linha, = self.ax.plot([], [], color='#1f77b4', linewidth=1, label='Resíduo Padronizado')
+            self.ponto, = self.ax.plot([], [], 'o', color='#d62728')
+            self.ax.set_ylabel('Resíduo Padronizado (dp)')
+            self.ax.legend(loc='upper left', fontsize=8)
+            self.ax.grid(True, linestyle='--', alpha=0.5)
+            self.estatisticas = self.ax.text(0.99, 0.97, '', transform=self.ax.transAxes, ha='right', va='top',
+                                             fontsize=9, bbox=dict(facecolor='white', edgecolor='gray', alpha=0.8))
+
+            self.ax_corr.axhline(0, color='black', linewidth=0.6)
+            self.linha_corr, = self.ax_corr.plot([], [], color='#ff7f0e', linewidth=1)
+            self.ax_corr.set_ylim(-1.05, 1.05)
+            self.ax_corr.set_xlabel('Data')
+            self.ax_corr.grid(True, linestyle='--', alpha=0.5)
+            self.ax_corr.xaxis_date()
+            self.ax_corr.xaxis.set_major_formatter(mdates.DateFormatter('%m/%Y'))
+
+    def atualizar(self, nome_y, nome_x, residuos, correlacao, janela_correlacao, texto):
+        datas = mdates.date2num(residuos.index.to_pydatetime())
+        with matplotlib.style.context('default'):
+            self.titulo.set_text(f'{nome_y} vs {nome_x}')
+            self.subtitulo.set_text(f'Resíduo da Regressão de {nome_y} sendo explicado por {nome_x}')
+            self.estatisticas.set_text(texto)
+
+            self.linha.set_data(datas, residuos.to_numpy(dtype=float))
+            self.ponto.set_data(datas[-1:], residuos.to_numpy(dtype=float)[-1:])
+            self.linha_corr.set_data(mdates.date2num(correlacao.index.to_pydatetime()),
+                                     correlacao.to_numpy(dtype=float))
+            self.ax_corr.set_ylabel(f'Correlação\n{janela_correlacao}d', fontsize=9)
+
+            self.ax.relim()
+            self.ax.autoscale_view()
+            self.fig.tight_layout(rect=[0, 0.03, 1, 0.9])
+        return self.fig
+
+
+def desenhar_residuo(nome_y, nome_x, residuos, correlacao, janela_correlacao, texto):
+    return modelos_graficos.obter(ModeloResiduo).desenhar(nome_y=nome_y, nome_x=nome_x, residuos=residuos,
+                                                          correlacao=correlacao,
+                                                          janela_correlacao=janela_correlacao, texto=texto)
+
+
+def paginas_regressao(retornos, tabela, nomes, janelas, quantidade):
+    # Destaques e uma página por par selecionado, do maior resíduo positivo ao mais negativo
+    tabela = tabela.sort_values('z_residuo', ascending=False)
+    rotulos = [f'{nomes.get(y, y)} vs {nomes.get(x, x)}' for y, x in zip(tabela['y'], tabela['x'])]
+    paginas = [(desenhar_destaques, {'rotulos': rotulos[::-1], 'valores': tabela['z_residuo'].to_numpy()[::-1],
+                                     'quantidade': quantidade})]
+
+    janela_regressao, janela_correlacao = max(janelas), min(janelas)
+    recentes = retornos.iloc[-janela_regressao:]
+    for par in tabela.itertuples(index=False):
+        residuos = regressao_pares.serie_residuo(recentes, par.y, par.x, par.alfa, par.beta, par.desvio_residuo)
+        comuns = retornos[[par.y, par.x]].dropna()
+        correlacao = comuns[par.y].rolling(janela_correlacao).corr(comuns[par.x])
+        correlacao = correlacao[correlacao.index >= residuos.index[0]]
+        correlacoes = ' | '.join(f"{janela}d {getattr(par, f'correlacao_{janela}'):.2f}" for janela in janelas)
+        texto = (f'β = {par.beta:.4f}, R² = {par.r2:.4f}, Amostra = {par.amostra} dias, '
+                 f'Última Data = {par.data:%Y-%m-%d}\nCorrelação: {correlacoes}')
+        paginas.append((desenhar_residuo, {
+            'nome_y': nomes.get(par.y, par.y), 'nome_x': nomes.get(par.x, par.x),
+            'residuos': residuos, 'correlacao': correlacao,
+            'janela_correlacao': janela_correlacao, 'texto': texto,
+        }))
+    return paginas
+
+
+def calcular(progresso=None, precos=None, carteiras=None, janelas=JANELAS, quantidade=QUANTIDADE_PARES,
+             data_referencia=None):
+    # Coleta e cálculo do relatório, sem desenhar: a tabela dos pares selecionados e os retornos
+    carteiras = carteiras or CARTEIRAS
+    nomes = {ticker: nome for carteira in carteiras.values() for ticker, nome in carteira.items()}
+
+    with metricas.etapa('regressao_pares', 'fetch', progresso):
+        ativos, inicio = universo_dados(carteiras, janelas, data_referencia)
+        if precos is None:
+            precos = armazem_precos.obter_fechamentos(ativos, inicio, data_referencia)
+        precos = precos.reindex(columns=[a for a in ativos if a in precos.columns])
+        if data_referencia and not precos.empty:
+            precos = precos[precos.index <= pd.Timestamp(data_referencia)]
+
+    # Regressão de todos os pares de uma vez sobre a matriz de retornos; só os extremos viram páginas
+    with metricas.etapa('regressao_pares', 'compute', progresso):
+        retornos = regressao_pares.retornos_log(precos.dropna(how='all'))
+        tabela = regressao_pares.maiores_residuos(retornos, janelas, quantidade) if len(retornos) else pd.DataFrame()
+
+    return {'retornos': retornos, 'tabela': tabela, 'nomes': nomes, 'janelas': janelas, 'quantidade': quantidade}
+
+
+def paginas(resultado):
+    if resultado['tabela'].empty:
+        return []
+    return paginas_regressao(resultado['retornos'], resultado['tabela'], resultado['nomes'],
+                             resultado['janelas'], resultado['quantidade'])
+
+
+def para_json(resultado):
+    tabela = resultado['tabela'].copy()
+    if not tabela.empty:
+        tabela.insert(0, 'nome_y', tabela['y'].map(lambda ticker: resultado['nomes'].get(ticker, ticker)))
+        tabela.insert(1, 'nome_x', tabela['x'].map(lambda ticker: resultado['nomes'].get(ticker, ticker)))
+    return {'janelas': list(resultado['janelas']), 'pares': tabela.to_dict(orient='records')}
+
+
+def gerar_pdf_regressao_pares(output_file="regressao_pares_ativos.pdf", progresso=None, precos=None, carteiras=None,
+                              janelas=JANELAS, quantidade=QUANTIDADE_PARES, data_referencia=None):
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    resultado = calcular(progresso, precos, carteiras, janelas, quantidade, data_referencia)
+
+    if resultado['tabela'].empty:
+        logging.error("Nenhum par com dados suficientes. PDF não será gerado.")
+        return output_file
+    logging.info(f"Regressão de pares: {len(resultado['retornos'].columns)} ativos, "
+                 f"{len(resultado['tabela'])} pares selecionados.")
+
+    with metricas.etapa('regressao_pares', 'render', progresso):
+        renderizacao.renderizar_pdf(paginas(resultado), output_file, relatorio='regressao_pares')
+
+    logging.info(f"Regressão de pares exportada para '{output_file}' em {datetime.now():%H:%M:%S}.")
+    return output_file
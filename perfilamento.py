@@ -0,0 +1,125 @@
+# perfilamento.py
+#
+# Perfilamento sob demanda de uma geração de relatório, para ver onde foi o tempo de um pedido lento
+# em produção. Liga por pedido (cabeçalho X-Perfil ou ?perfil= com o token de administrador em
+# PERFIL_TOKEN) ou em todos os pedidos (PERFIL_RELATORIOS=1). A geração roda sob o cProfile e, ao
+# mesmo tempo, um amostrador guarda a pilha da thread do job a cada PERFIL_INTERVALO_MS. Ao lado do
+# PDF ficam o .pstats (pstats, snakeviz) e as pilhas colapsadas em .folded (flamegraph.pl, speedscope);
+# as funções mais pesadas voltam no status do job.
+
+import os
+import sys
+import hmac
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+
+# Token de administrador exigido nos pedidos perfilados (sem ele, só PERFIL_RELATORIOS liga o perfilamento)
+TOKEN = os.environ.get('PERFIL_TOKEN')
+
+# Perfila todos os pedidos de relatório (cada um regera o PDF, sem cache)
+PERFILAR_TODOS = os.environ.get('PERFIL_RELATORIOS', '0') == '1'
+
+INTERVALO_MS = float(os.environ.get('PERFIL_INTERVALO_MS', '5'))
+
+# Quantas funções entram no resumo devolvido no JSON
+MAX_FUNCOES = int(os.environ.get('PERFIL_MAX_FUNCOES', '20'))
+
+# Um perfilamento por vez no processo: perfis simultâneos se atrapalham e distorcem as medidas. Quem
+# chega com outro em andamento é recusado na hora, em vez de esperar a geração inteira do primeiro
+_trava = threading.Lock()
+
+
+class PerfilOcupado(Exception):
+    pass
+
+
+def ocupado():
+    return _trava.locked()
+
+
+def autorizar(token):
+    # True se o pedido deve ser perfilado; PermissionError se pediu perfil sem o token certo. Com
+    # PERFIL_RELATORIOS, um pedido que chega durante outro perfilamento só é gerado, sem perfil
+    if token is None:
+        return PERFILAR_TODOS and not ocupado()
+    if not TOKEN or not hmac.compare_digest(token.encode(), TOKEN.encode()):
+        raise PermissionError('Token de perfilamento inválido.')
+    return True
+
+
+class _Amostrador(threading.Thread):
+    # Pilhas da thread 'alvo' contadas a cada intervalo, no formato colapsado (raiz;...;folha)
+    def __init__(self, alvo, intervalo):
+        super().__init__(name='perfil-amostrador', daemon=True)
+        self.alvo = alvo
+        self.intervalo = intervalo
+        self.pilhas = Counter()
+        self.fim = threading.Event()
+
+    def run(self):
+        while not self.fim.wait(self.intervalo):
+            quadro = sys._current_frames().get(self.alvo)
+            pilha = []
+            while quadro is not None:
+                codigo = quadro.f_code
+                pilha.append(f'{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})')
+                quadro = quadro.f_back
+            if pilha:
+                self.pilhas[';'.join(reversed(pilha))] += 1
+
+
+def _funcoes(estatisticas, ordem):
+    funcoes = [{'funcao': f'{nome} ({arquivo}:{linha})' if linha else nome,
+                'chamadas': chamadas, 'proprio_s': round(proprio, 4), 'acumulado_s': round(acumulado, 4)}
+               for (arquivo, linha, nome), (_, chamadas, proprio, acumulado, _) in estatisticas.stats.items()]
+    return sorted(funcoes, key=lambda funcao: funcao[ordem], reverse=True)[:MAX_FUNCOES]
+
+
+def perfilar(executar):
+    # Roda executar() sob o perfilador e devolve (resultado, resumo). As páginas são desenhadas nesta
+    # thread, não no pool de renderização, para o tempo do matplotlib aparecer no perfil
+    import renderizacao
+    if not _trava.acquire(blocking=False):
+        raise PerfilOcupado('Já há um perfilamento em andamento neste processo.')
+    try:
+        perfilador = cProfile.Profile()
+        amostrador = _Amostrador(threading.get_ident(), INTERVALO_MS / 1000)
+        inicio = time.perf_counter()
+        amostrador.start()
+        perfilador.enable()
+        try:
+            with renderizacao.serial():
+                resultado = executar()
+        finally:
+            perfilador.disable()
+            amostrador.fim.set()
+            amostrador.join()
+        duracao = time.perf_counter() - inicio
+    finally:
+        _trava.release()
+
+    arquivos = list(resultado) if isinstance(resultado, (list, tuple)) else [resultado]
+    if not arquivos or not arquivos[0]:
+        return resultado, None
+    base = os.path.splitext(arquivos[0])[0]
+    caminho_pstats, caminho_pilhas = f'{base}.perfil.pstats', f'{base}.perfil.folded'
+    perfilador.dump_stats(caminho_pstats)
+    with open(caminho_pilhas, 'w') as arquivo:
+        for pilha, amostras in amostrador.pilhas.most_common():
+            arquivo.write(f'{pilha} {amostras}\n')
+
+    estatisticas = pstats.Stats(perfilador).strip_dirs()
+    resumo = {
+        'segundos': round(duracao, 3),
+        'amostras': sum(amostrador.pilhas.values()),
+        'pstats': caminho_pstats,
+        'pilhas': caminho_pilhas,
+        'funcoes': _funcoes(estatisticas, 'proprio_s'),
+        'acumuladas': _funcoes(estatisticas, 'acumulado_s'),
+    }
+    logging.info(f"Perfil de '{arquivos[0]}' em {duracao:.2f}s gravado em '{caminho_pstats}' e '{caminho_pilhas}'.")
+    return resultado, resumo
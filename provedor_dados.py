@@ -0,0 +1,218 @@
+# provedor_dados.py
+
+import io
+import os
+import logging
+import threading
+import http.client
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote, urlencode
+from urllib.request import urlopen
+import pandas as pd
+import busca_resiliente
+from busca_resiliente import ErroTransitorio
+
+CAMPOS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Quantos tickers vão em cada chamada ao Yahoo e quantas requisições o yfinance faz em paralelo por lote
+TAMANHO_LOTE = int(os.environ.get('PROVEDOR_TAMANHO_LOTE', '25'))
+CONCORRENCIA = int(os.environ.get('PROVEDOR_CONCORRENCIA', '4'))
+
+# Endereço do provedor HTTP (um ticker por requisição, em CSV), ex.: o stub_provedor.py local
+URL_HTTP = os.environ.get('PROVEDOR_HTTP_URL', 'http://127.0.0.1:8765')
+
+_trava_yahoo = threading.Lock()
+
+
+def _alinhar(dados, tickers):
+    # Garante o formato largo (campo, ticker) com índice de datas sem fuso horário
+    if dados is None or dados.empty:
+        return pd.DataFrame(columns=pd.MultiIndex.from_product([CAMPOS, []]))
+    if getattr(dados.index, 'tz', None) is not None:
+        dados.index = dados.index.tz_localize(None)
+    dados.index = pd.DatetimeIndex(dados.index).normalize()
+    dados.index.name = 'Date'
+    dados = dados[~dados.index.duplicated(keep='last')].sort_index()
+    campos = [c for c in CAMPOS if c in dados.columns.get_level_values(0)]
+    dados = dados[campos]
+    presentes = [t for t in tickers if t in dados.columns.get_level_values(1)]
+    return dados.reindex(columns=pd.MultiIndex.from_product([campos, presentes]))
+
+
+def _marcar_falhas(dados, falhas):
+    # Tickers cuja busca falhou (erro, prazo ou disjuntor aberto), para o armazém não os tratar como
+    # atualizados; os ausentes que não estão aqui simplesmente não têm dados no provedor
+    dados.attrs['falhas'] = list(falhas)
+    return dados
+
+
+class ProvedorDados:
+    # Interface comum: recebe o universo inteiro e devolve um DataFrame largo
+    # com colunas (campo, ticker) alinhadas pela data. 'prazo' (time.monotonic) é o limite
+    # para a busca inteira; o que não vier até lá fica em dados.attrs['falhas']
+    nome = 'base'
+
+    def baixar(self, tickers, inicio, fim=None, prazo=None):
+        raise NotImplementedError
+
+    def baixar_fechamentos(self, tickers, inicio, fim=None):
+        dados = self.baixar(tickers, inicio, fim)
+        if dados.empty:
+            return pd.DataFrame()
+        return dados['Close'].dropna(how='all')
+
+
+class ProvedorYahoo(ProvedorDados):
+    nome = 'yahoo'
+
+    def __init__(self, tamanho_lote=TAMANHO_LOTE, concorrencia=CONCORRENCIA):
+        self.tamanho_lote = tamanho_lote
+        self.concorrencia = concorrencia
+
+    def _baixar_lote(self, lote, tempo_limite, inicio, fim):
+        import yfinance as yf
+        try:
+            # yf.download guarda estado global entre chamadas, então os lotes são serializados
+            # e a concorrência fica a cargo das threads do próprio yfinance
+            with _trava_yahoo:
+                dados = yf.download(list(lote), start=inicio, end=fim, interval='1d', group_by='column',
+                                    auto_adjust=True, progress=False, timeout=tempo_limite,
+                                    threads=max(1, min(self.concorrencia, len(lote))))
+        except Exception as e:
+            raise ErroTransitorio(f"Erro ao baixar dados para os tickers {list(lote)}: {e}") from e
+        # O lote sempre pede a última barra já guardada: resposta vazia é falha do Yahoo (ex.: limite de taxa)
+        if dados.empty:
+            raise ErroTransitorio(f"Resposta vazia do Yahoo para os tickers {list(lote)}.")
+        if not isinstance(dados.columns, pd.MultiIndex):
+            dados.columns = pd.MultiIndex.from_product([dados.columns, lote])
+        return dados
+
+    def baixar(self, tickers, inicio, fim=None, prazo=None):
+        tickers = list(dict.fromkeys(tickers))
+        lotes = [tuple(tickers[i:i + self.tamanho_lote]) for i in range(0, len(tickers), self.tamanho_lote)]
+        # Os lotes já são serializados pela trava do yfinance: um trabalhador basta
+        executor = busca_resiliente.executor(self.nome, trabalhadores=1)
+        resultados = executor.mapear(lambda lote, tempo_limite: self._baixar_lote(lote, tempo_limite, inicio, fim),
+                                     lotes, prazo)
+        partes, falhas = [], []
+        for lote, resultado in resultados.items():
+            if isinstance(resultado, Exception):
+                logging.error(f"Lote não baixado ({len(lote)} tickers): {resultado}")
+                falhas.extend(lote)
+            else:
+                partes.append(resultado)
+        dados = _alinhar(pd.concat(partes, axis=1) if partes else None, tickers)
+        # O Yahoo às vezes falha um ticker do lote em silêncio: a coluna vem, mas sem nenhum valor
+        vazios = [ticker for ticker in dados.columns.get_level_values(1).unique()
+                  if dados.xs(ticker, axis=1, level=1).isna().all().all()]
+        if vazios:
+            logging.error(f"Tickers sem nenhum valor na resposta do Yahoo: {', '.join(vazios)}")
+            falhas.extend(vazios)
+        return _marcar_falhas(dados, falhas)
+
+
+class ProvedorReplay(ProvedorDados):
+    # Lê fixtures gravadas em disco (um Parquet ou CSV por ticker), sem acesso à rede
+    nome = 'replay'
+
+    def __init__(self, pasta=None):
+        self.pasta = pasta or os.environ.get('PASTA_FIXTURES', os.path.join('dados', 'fixtures'))
+
+    def _ler(self, ticker):
+        base = os.path.join(self.pasta, quote(ticker, safe=''))
+        if os.path.exists(base + '.parquet'):
+            return pd.read_parquet(base + '.parquet')
+        if os.path.exists(base + '.csv'):
+            return pd.read_csv(base + '.csv', index_col=0, parse_dates=True)
+        return None
+
+    def baixar(self, tickers, inicio, fim=None, prazo=None):
+        series = {}
+        for ticker in dict.fromkeys(tickers):
+            historico = self._ler(ticker)
+            if historico is None:
+                logging.warning(f"Sem fixture para o ativo {ticker} em {self.pasta}.")
+                continue
+            historico = historico[historico.index >= pd.Timestamp(inicio)]
+            if fim is not None:
+                historico = historico[historico.index < pd.Timestamp(fim)]
+            series[ticker] = historico
+        if not series:
+            return _alinhar(None, tickers)
+        dados = pd.concat(series, axis=1).swaplevel(0, 1, axis=1)
+        return _alinhar(dados, tickers)
+
+
+class ProvedorHTTP(ProvedorDados):
+    # Um ticker por requisição (GET {url}/historico/{ticker}?inicio=&fim=, resposta em CSV com
+    # Date,Open,High,Low,Close,Volume). 404 é ticker sem dados; 429, 5xx e falhas de rede são repetidos
+    nome = 'http'
+
+    def __init__(self, url=None):
+        self.url = (url or URL_HTTP).rstrip('/')
+
+    def _buscar(self, ticker, tempo_limite, inicio, fim):
+        consulta = {'inicio': pd.Timestamp(inicio).date().isoformat()}
+        if fim is not None:
+            consulta['fim'] = pd.Timestamp(fim).date().isoformat()
+        endereco = f"{self.url}/historico/{quote(ticker, safe='')}?{urlencode(consulta)}"
+        try:
+            with urlopen(endereco, timeout=tempo_limite) as resposta:
+                conteudo = resposta.read()
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            if e.code == 429 or e.code >= 500:
+                raise ErroTransitorio(f"HTTP {e.code} para {ticker}") from e
+            raise
+        except (URLError, OSError, http.client.HTTPException) as e:
+            raise ErroTransitorio(f"Falha de rede para {ticker}: {e}") from e
+        return pd.read_csv(io.BytesIO(conteudo), index_col=0, parse_dates=True)
+
+    def baixar(self, tickers, inicio, fim=None, prazo=None):
+        tickers = list(dict.fromkeys(tickers))
+        resultados = busca_resiliente.executor(self.nome).mapear(
+            lambda ticker, tempo_limite: self._buscar(ticker, tempo_limite, inicio, fim), tickers, prazo)
+        series, falhas = {}, []
+        for ticker, resultado in resultados.items():
+            if isinstance(resultado, Exception):
+                logging.error(f"Erro ao baixar dados para o ativo {ticker}: {resultado}")
+                falhas.append(ticker)
+            elif resultado is None or resultado.empty:
+                logging.warning(f"Sem dados para o ativo {ticker} no provedor HTTP.")
+            else:
+                series[ticker] = resultado
+        dados = _alinhar(pd.concat(series, axis=1).swaplevel(0, 1, axis=1) if series else None, tickers)
+        return _marcar_falhas(dados, falhas)
+
+
+PROVEDORES = {
+    ProvedorYahoo.nome: ProvedorYahoo,
+    ProvedorReplay.nome: ProvedorReplay,
+    ProvedorHTTP.nome: ProvedorHTTP,
+}
+
+
+def registrar_provedor(classe):
+    PROVEDORES[classe.nome] = classe
+    return classe
+
+
+def obter_provedor(nome=None):
+    nome = nome or os.environ.get('PROVEDOR_DADOS', ProvedorYahoo.nome)
+    if nome not in PROVEDORES:
+        raise ValueError(f"Provedor de dados desconhecido: {nome}")
+    return PROVEDORES[nome]()
+
+
+def gravar_fixtures(tickers, inicio, fim=None, pasta=None, provedor=None):
+    # Grava o que o provedor devolver como fixtures para o ProvedorReplay
+    pasta = pasta or ProvedorReplay().pasta
+    provedor = provedor or ProvedorYahoo()
+    os.makedirs(pasta, exist_ok=True)
+    dados = provedor.baixar(tickers, inicio, fim)
+    for ticker in dados.columns.get_level_values(1).unique():
+        historico = dados.xs(ticker, axis=1, level=1).dropna(how='all')
+        historico.to_parquet(os.path.join(pasta, quote(ticker, safe='') + '.parquet'))
+    logging.info(f"Fixtures gravadas em '{pasta}'.")
+    return pasta
@@ -0,0 +1,118 @@
+# regressao_pares.py
+
+import numpy as np
+import pandas as pd
+
+# Mínimo de retornos em comum para um par entrar no relatório
+MIN_OBSERVACOES = 40
+
+# Pares quase idênticos (ex.: o mesmo câmbio com dois tickers) têm resíduo sem sentido e ficam de fora
+CORRELACAO_MAXIMA = 0.98
+
+
+def retornos_log(precos):
+    # Retorno logarítmico de cada ativo no seu próprio calendário: sem pregão no dia anterior, fica NaN
+    precos = precos.sort_index()
+    return np.log(precos.where(precos > 0)).diff().iloc[1:]
+
+
+def estatisticas_pares(retornos, minimo=MIN_OBSERVACOES):
+    # Regressão de todos os ativos (y, linha i) contra todos (x, coluna j) de uma vez, usando só as datas
+    # em que os dois têm retorno. Tudo sai de quatro produtos de matrizes em vez de um ajuste por par
+    valores = retornos.to_numpy(dtype=float)
+    validos = ~np.isnan(valores)
+    m = validos.astype(float)
+    x = np.where(validos, valores, 0.0)
+
+    n = m.T @ m                  # n[i, j]: datas em comum
+    soma = x.T @ m               # soma[i, j]: soma dos retornos de i nas datas em que j também tem retorno
+    soma_q = (x * x).T @ m
+    cruzado = x.T @ x
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = soma / n
+        variancia = (soma_q - soma * media) / (n - 1)    # variancia[i, j]: de i, nas datas em comum com j
+        covariancia = (cruzado - soma * media.T) / (n - 1)
+        correlacao = covariancia / np.sqrt(variancia * variancia.T)
+        beta = covariancia / variancia.T
+        alfa = media - beta * media.T
+        r2 = correlacao ** 2
+        # Desvio padrão do resíduo da regressão (n - 2 graus de liberdade)
+        desvio_residuo = np.sqrt(np.maximum(variancia * (1 - r2), 0) * (n - 1) / (n - 2))
+
+    insuficientes = n < minimo
+    estatisticas = {'n': n, 'beta': beta, 'alfa': alfa, 'r2': r2, 'correlacao': correlacao,
+                    'desvio_residuo': desvio_residuo}
+    for nome, matriz in estatisticas.items():
+        if nome != 'n':
+            matriz[insuficientes] = np.nan
+    return estatisticas
+
+
+def correlacoes(retornos, janelas, minimo=None):
+    # Uma matriz de correlação por janela (últimas 'janela' datas), para todos os pares
+    return {janela: estatisticas_pares(retornos.iloc[-janela:], minimo or min(MIN_OBSERVACOES, janela // 2))['correlacao']
+            for janela in janelas}
+
+
+def residuos_recentes(retornos, estatisticas, dias=5):
+    # Resíduo padronizado do último dia em que cada par teve retorno em comum (entre os últimos 'dias'),
+    # para todos os pares de uma vez. Devolve (z, data) com a data como posição na matriz de retornos
+    valores = retornos.to_numpy(dtype=float)
+    total = len(valores)
+    z = np.full(estatisticas['beta'].shape, np.nan)
+    posicao = np.full(z.shape, -1)
+    for linha in range(total - 1, max(total - dias, 0) - 1, -1):
+        r = valores[linha]
+        pendentes = np.isnan(z) & ~np.isnan(r)[:, None] & ~np.isnan(r)[None, :]
+        if not pendentes.any():
+            continue
+        with np.errstate(invalid='ignore', divide='ignore'):
+            residuo = (r[:, None] - estatisticas['alfa'] - estatisticas['beta'] * r[None, :]) / estatisticas['desvio_residuo']
+        z = np.where(pendentes, residuo, z)
+        posicao = np.where(pendentes, linha, posicao)
+    return z, posicao
+
+
+def maiores_residuos(retornos, janelas, quantidade=15):
+    # Pares (i < j) com os 'quantidade' maiores e menores resíduos padronizados recentes.
+    # A regressão usa a maior janela; as correlações de todas as janelas vão junto na tabela
+    janela_regressao = max(janelas)
+    recentes = retornos.iloc[-janela_regressao:]
+    estatisticas = estatisticas_pares(recentes)
+    corr = correlacoes(retornos, janelas)
+    z, posicao = residuos_recentes(recentes, estatisticas)
+
+    superior = np.triu(np.ones(z.shape, dtype=bool), k=1)
+    elegiveis = superior & ~np.isnan(z) & (np.abs(estatisticas['correlacao']) < CORRELACAO_MAXIMA)
+    candidatos = np.flatnonzero(elegiveis)
+    if not len(candidatos):
+        return pd.DataFrame()
+
+    # Seleção parcial: só os extremos são ordenados, não todos os pares
+    valores = z.ravel()[candidatos]
+    k = min(quantidade, len(candidatos))
+    menores = candidatos[np.argpartition(valores, k - 1)[:k]] if k < len(candidatos) else candidatos
+    maiores = candidatos[np.argpartition(-valores, k - 1)[:k]] if k < len(candidatos) else candidatos
+    escolhidos = np.unique(np.concatenate([menores, maiores]))
+    i, j = np.unravel_index(escolhidos, z.shape)
+
+    tabela = pd.DataFrame({
+        'y': retornos.columns[i],
+        'x': retornos.columns[j],
+        'beta': estatisticas['beta'][i, j],
+        'alfa': estatisticas['alfa'][i, j],
+        'r2': estatisticas['r2'][i, j],
+        'desvio_residuo': estatisticas['desvio_residuo'][i, j],
+        'amostra': estatisticas['n'][i, j].astype(int),
+        'z_residuo': z[i, j],
+        'data': recentes.index[posicao[i, j]],
+        **{f'correlacao_{janela}': corr[janela][i, j] for janela in janelas},
+    })
+    return tabela.sort_values('z_residuo').reset_index(drop=True)
+
+
+def serie_residuo(retornos, y, x, alfa, beta, desvio_residuo):
+    # Resíduo padronizado de um par em cada data em comum da janela
+    dados = retornos[[y, x]].dropna()
+    return (dados[y] - alfa - beta * dados[x]) / desvio_residuo
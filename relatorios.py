@@ -0,0 +1,149 @@
+# relatorios.py
+
+import os
+import re
+import logging
+import datetime
+import importlib
+from functools import partial
+import cache_relatorios
+
+# Relatórios disponíveis: nome amigável, arquivo de saída, módulo gerador e função geradora.
+# Os geradores (pandas, matplotlib, seaborn) só são importados quando um relatório é pedido
+RELATORIOS = {
+    'pdf1': ('Análise de Dispersão', "analise_dispersao.pdf", 'pdf_gerador1', 'gerar_pdf_analise_dispersao'),
+    'pdf2': ('Análise Z-Score', "analise_zscore.pdf", 'pdf_gerador2', 'gerar_pdf'),
+    'pdf3': ('Variação Diária', "Variação_Diária.pdf", 'pdf_gerador3', 'gerar_pdf_variacao_diaria'),
+    'pdf4': ('Regressão de Pares', "regressao_pares_ativos.pdf", 'pdf_gerador4', 'gerar_pdf_regressao_pares'),
+}
+
+
+# Parâmetros que cada relatório aceita no corpo JSON do pedido
+PARAMETROS = {
+    'pdf1': ('carteiras', 'horizontes', 'inicio_anual', 'data_referencia'),
+    'pdf2': ('carteiras', 'janelas', 'data_referencia'),
+    'pdf3': ('carteiras', 'data_referencia'),
+    'pdf4': ('carteiras', 'janelas', 'data_referencia'),
+}
+
+# Limites para universos e janelas pedidos pelos usuários
+MAX_ATIVOS = int(os.environ.get('PARAMETROS_MAX_ATIVOS', '500'))
+MAX_DIAS = int(os.environ.get('PARAMETROS_MAX_DIAS', '2520'))
+
+_TICKER = re.compile(r'^[A-Za-z0-9.^=_-]{1,20}$')
+
+
+def _data(valor, nome):
+    try:
+        return datetime.date.fromisoformat(str(valor)).isoformat()
+    except ValueError:
+        raise ValueError(f"'{nome}' deve ser uma data no formato AAAA-MM-DD.")
+
+
+def _dias(valor, nome, minimo=1):
+    valores = valor if isinstance(valor, list) else [valor]
+    if not valores or not all(isinstance(v, int) and not isinstance(v, bool) and minimo <= v <= MAX_DIAS
+                              for v in valores):
+        raise ValueError(f"'{nome}' deve ser um inteiro (ou lista de inteiros) entre {minimo} e {MAX_DIAS}.")
+    return sorted(set(valores))
+
+
+def _carteiras(valor):
+    # Aceita {carteira: [tickers]} ou {carteira: {ticker: nome amigável}}
+    if not isinstance(valor, dict) or not valor:
+        raise ValueError("'carteiras' deve ser um objeto {carteira: [tickers]} ou {carteira: {ticker: nome}}.")
+    carteiras, total = {}, 0
+    for nome, ativos in valor.items():
+        if not isinstance(nome, str) or not nome.strip() or len(nome) > 60:
+            raise ValueError("Nomes de carteira devem ter entre 1 e 60 caracteres.")
+        if isinstance(ativos, list):
+            ativos = {ticker: ticker for ticker in ativos}
+        if not isinstance(ativos, dict) or not ativos:
+            raise ValueError(f"A carteira '{nome}' deve ter ao menos um ticker.")
+        for ticker, apelido in ativos.items():
+            if not isinstance(ticker, str) or not _TICKER.match(ticker):
+                raise ValueError(f"Ticker inválido na carteira '{nome}': {ticker!r}.")
+            if not isinstance(apelido, str) or len(apelido) > 60:
+                raise ValueError(f"Nome inválido para o ticker {ticker}.")
+        carteiras[nome.strip()] = {ticker: apelido for ticker, apelido in ativos.items()}
+        total += len(ativos)
+    if total > MAX_ATIVOS:
+        raise ValueError(f"O universo pedido tem {total} ativos; o máximo é {MAX_ATIVOS}.")
+    return carteiras
+
+
+def normalizar_parametros(tipo, corpo):
+    # Valida o corpo JSON de um pedido e devolve os parâmetros numa forma canônica, para que pedidos
+    # equivalentes (ex.: horizontes em outra ordem) caiam na mesma chave de cache e no mesmo job
+    if not corpo:
+        return {}
+    if not isinstance(corpo, dict):
+        raise ValueError("O corpo do pedido deve ser um objeto JSON.")
+    desconhecidos = sorted(set(corpo) - set(PARAMETROS[tipo]))
+    if desconhecidos:
+        raise ValueError(f"Parâmetros não suportados para este relatório: {', '.join(desconhecidos)}.")
+
+    parametros = {}
+    if corpo.get('carteiras') is not None:
+        parametros['carteiras'] = _carteiras(corpo['carteiras'])
+    if corpo.get('horizontes') is not None:
+        parametros['horizontes'] = _dias(corpo['horizontes'], 'horizontes')
+    if corpo.get('janelas') is not None:
+        parametros['janelas'] = _dias(corpo['janelas'], 'janelas', minimo=2)
+    for nome in ('inicio_anual', 'data_referencia'):
+        if corpo.get(nome) is not None:
+            parametros[nome] = _data(corpo[nome], nome)
+    return parametros
+
+
+def gerador(tipo):
+    # Módulo e função geradora de um relatório, importados na primeira vez que são usados
+    _, _, nome_modulo, nome_funcao = RELATORIOS[tipo]
+    modulo = importlib.import_module(nome_modulo)
+    return modulo, getattr(modulo, nome_funcao)
+
+
+def universo_combinado(tipos=None):
+    # União dos tickers de todos os relatórios (sem repetição) e a data inicial mais antiga entre eles
+    tickers, inicios = [], []
+    for tipo in tipos or RELATORIOS:
+        ativos, inicio = gerador(tipo)[0].universo_dados()
+        tickers.extend(ativos)
+        inicios.append(inicio)
+    return list(dict.fromkeys(tickers)), min(inicios)
+
+
+def gerar_relatorio(tipo, pasta, progresso=None, precos=None, parametros=None, forcar=False):
+    # 'parametros' (já normalizados) vão para o gerador e para o universo de dados,
+    # e entram na chave do cache: cada variante tem seu próprio arquivo
+    arquivo = RELATORIOS[tipo][1]
+    modulo, gerar = gerador(tipo)
+    parametros = parametros or {}
+    gerar = partial(gerar, **parametros)
+    if precos is not None:
+        gerar = partial(gerar, precos=precos)
+    return cache_relatorios.gerar_com_cache(tipo, gerar, partial(modulo.universo_dados, **parametros), pasta,
+                                            arquivo, parametros=parametros, progresso=progresso, forcar=forcar)
+
+
+def gerar_varios(pasta, progresso=None, tipos=None):
+    # Uma única passada de coleta para a união dos universos; cada relatório calcula
+    # suas métricas a partir da mesma matriz de fechamentos. Devolve {tipo: arquivo gerado}
+    import armazem_precos
+    tipos = list(tipos or RELATORIOS)
+    if progresso:
+        progresso('fetch')
+    tickers, inicio = universo_combinado(tipos)
+    precos = armazem_precos.obter_fechamentos(tickers, inicio)
+    logging.info(f"Geração combinada: {len(tickers)} tickers únicos para {len(tipos)} relatórios.")
+
+    arquivos = {}
+    for tipo in tipos:
+        arquivo = gerar_relatorio(tipo, pasta, progresso=progresso, precos=precos)
+        if arquivo:
+            arquivos[tipo] = arquivo
+    return arquivos
+
+
+def gerar_todos(pasta, progresso=None, tipos=None):
+    return list(gerar_varios(pasta, progresso, tipos).values())
@@ -0,0 +1,283 @@
+# renderizacao.py
+
+import io
+import os
+import time
+import logging
+import threading
+import contextvars
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.collections import PathCollection
+import metricas
+
+try:
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NumberObject
+except ImportError:  # sem pypdf não há como juntar as páginas: tudo é desenhado no processo atual
+    PdfReader = PdfWriter = None
+
+# Quantos processos desenham páginas ao mesmo tempo (1 desliga o paralelismo)
+PROCESSOS = int(os.environ.get('RENDER_PROCESSOS', str(os.cpu_count() or 1)))
+
+# Módulos importados uma vez pelo servidor do forkserver, de onde cada processo de renderização
+# é bifurcado já com eles carregados (ver pre_carregar)
+MODULOS_PRE_CARREGADOS = ['matplotlib.figure', 'matplotlib.backends.backend_pdf']
+
+# Perfil de saída: 'padrao' grava as páginas como o matplotlib as produz; 'compacto' rasteriza camadas
+# densas de marcadores, usa uma única fonte (subconjunto) por família para o documento inteiro e
+# recomprime os fluxos de conteúdo, registrando quantos bytes isso economizou
+PERFIL = os.environ.get('PDF_PERFIL', 'padrao')
+
+# No perfil compacto: a partir de quantos pontos uma camada de marcadores ou linha é rasterizada,
+# e com qual resolução
+MINIMO_RASTER = int(os.environ.get('PDF_MINIMO_RASTER', '5000'))
+DPI_RASTER = int(os.environ.get('PDF_DPI_RASTER', '100'))
+
+_executor = None
+_trava = threading.Lock()
+_aviso = contextvars.ContextVar('aviso', default=None)
+_serial = contextvars.ContextVar('serial', default=False)
+
+# O estilo do matplotlib (rcParams) é um só por processo: o style.context/rc_context de um gerador vale
+# para todas as threads enquanto dura, e parte dos artistas (ex.: os ticks) só é criada na gravação.
+# Por isso cada página é desenhada e gravada inteira sob esta trava, uma por vez no processo (threads
+# da fila, pedidos do /api/grafico); o paralelismo de verdade continua nos processos de renderização
+_trava_desenho = threading.RLock()
+
+
+@contextmanager
+def aviso(texto):
+    # Faixa de aviso (ex.: dados desatualizados) no topo de cada página gravada dentro do bloco
+    token = _aviso.set(texto)
+    try:
+        yield
+    finally:
+        _aviso.reset(token)
+
+
+@contextmanager
+def serial():
+    # Desenha as páginas no processo atual mesmo com o pool ligado (ex.: para o perfilador enxergá-las)
+    token = _serial.set(True)
+    try:
+        yield
+    finally:
+        _serial.reset(token)
+
+
+@contextmanager
+def desenhando():
+    # Envolve desenhar(**argumentos) e a gravação da figura que ele devolve
+    with _trava_desenho:
+        yield
+
+
+def _carimbar(fig, texto):
+    # Devolve o artista criado, para ser removido depois: os modelos de gráfico reaproveitam a figura
+    if not texto:
+        return None
+    return fig.text(0.5, 0.995, texto, ha='center', va='top', fontsize=9, color='#b00020',
+                    bbox=dict(facecolor='#fff3cd', edgecolor='#b00020', boxstyle='round,pad=0.3'))
+
+
+def pre_carregar(modulos):
+    # Acrescenta módulos (ex.: os geradores) ao que os processos de renderização herdam prontos.
+    # Só tem efeito se chamado antes da primeira renderização em paralelo
+    for modulo in modulos:
+        if modulo not in MODULOS_PRE_CARREGADOS:
+            MODULOS_PRE_CARREGADOS.append(modulo)
+
+
+def _iniciar_processo():
+    matplotlib.use('Agg')
+
+
+def _obter_executor():
+    # O pool é criado uma vez e reaproveitado, para pagar a importação do matplotlib só na primeira vez.
+    # 'forkserver' evita herdar threads e travas do processo web
+    global _executor
+    with _trava:
+        if _executor is None:
+            metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            contexto = multiprocessing.get_context(metodo)
+            if metodo == 'forkserver':
+                contexto.set_forkserver_preload(MODULOS_PRE_CARREGADOS)
+            _executor = ProcessPoolExecutor(max_workers=PROCESSOS, initializer=_iniciar_processo,
+                                            mp_context=contexto)
+        return _executor
+
+
+class _ExecutorLocal:
+    # Mesma interface do pool, mas desenha a página na hora, no processo atual
+    def submit(self, funcao, *argumentos):
+        futuro = Future()
+        futuro.set_result(funcao(*argumentos))
+        return futuro
+
+
+def _rasterizar_densos(fig, minimo):
+    # Camadas de marcadores e linhas com muitos pontos viram imagem; as demais voltam a ser vetoriais
+    # (os modelos de gráfico reaproveitam os mesmos artistas entre páginas). Outras coleções, como
+    # o degradê da barra de cores, ficam como o matplotlib as deixou
+    for ax in fig.axes:
+        for colecao in ax.collections:
+            if isinstance(colecao, PathCollection):
+                colecao.set_rasterized(len(colecao.get_offsets()) >= minimo)
+        for linha in ax.lines:
+            linha.set_rasterized(len(linha.get_xdata()) >= minimo)
+
+
+def _renderizar_pagina(desenhar, argumentos, perfil='padrao', aviso=None):
+    # Roda no processo filho: monta a Figure (API orientada a objetos, sem estado do pyplot)
+    # e devolve a página já gravada como PDF, junto com o tempo gasto (medido aqui, não no processo pai)
+    inicio = time.perf_counter()
+    buffer = io.BytesIO()
+    with desenhando():
+        fig = desenhar(**argumentos)
+        carimbo = _carimbar(fig, aviso)
+        if perfil == 'compacto':
+            _rasterizar_densos(fig, MINIMO_RASTER)
+            fig.savefig(buffer, format='pdf', dpi=DPI_RASTER)
+        else:
+            fig.savefig(buffer, format='pdf')
+        if carimbo is not None:
+            carimbo.remove()
+    return buffer.getvalue(), time.perf_counter() - inicio
+
+
+def _gravar_serial(paginas, output_file, relatorio, aviso=None):
+    with PdfPages(output_file) as pdf:
+        for desenhar, argumentos in paginas:
+            with metricas.PAGINA_SEGUNDOS.cronometrar(relatorio=relatorio), desenhando():
+                fig = desenhar(**argumentos)
+                carimbo = _carimbar(fig, aviso)
+                pdf.savefig(fig)
+                if carimbo is not None:
+                    carimbo.remove()
+    metricas.BYTES_ESCRITOS.incrementar(os.path.getsize(output_file), relatorio=relatorio)
+
+
+def _unir_fontes(escritor):
+    # Cada página gravada em separado traz suas fontes Type 3 só com os glifos que usa. O matplotlib dá
+    # sempre o mesmo código ao mesmo glifo de uma fonte, então as fontes de mesma família podem virar
+    # uma só, com a união dos glifos, e todas as páginas passam a apontar para ela
+    familias = {}
+    for pagina in escritor.pages:
+        fontes = pagina['/Resources'].get_object().get('/Font')
+        if fontes is None:
+            continue
+        fontes = fontes.get_object()
+        for chave, referencia in fontes.items():
+            fonte = referencia.get_object()
+            if fonte.get('/Subtype') == '/Type3':
+                familia = str(fonte['/BaseFont']).split('+')[-1]
+                familias.setdefault(familia, []).append((fontes, chave, fonte))
+
+    for usos in familias.values():
+        if len(usos) < 2:
+            continue
+        glifos, nomes = DictionaryObject(), {}
+        larguras = list(usos[0][2]['/Widths'])
+        for _, _, fonte in usos:
+            glifos.update(fonte['/CharProcs'].get_object())
+            codigo = 0
+            for item in fonte['/Encoding'].get_object()['/Differences']:
+                if isinstance(item, NameObject):
+                    nomes[codigo] = item
+                    larguras[codigo] = fonte['/Widths'][codigo]
+                    codigo += 1
+                else:
+                    codigo = int(item)
+
+        diferencas = ArrayObject()
+        for codigo in sorted(nomes):
+            if codigo - 1 not in nomes:
+                diferencas.append(NumberObject(codigo))
+            diferencas.append(nomes[codigo])
+        unida = DictionaryObject(usos[0][2])
+        unida[NameObject('/CharProcs')] = glifos
+        unida[NameObject('/Encoding')] = DictionaryObject({NameObject('/Type'): NameObject('/Encoding'),
+                                                           NameObject('/Differences'): diferencas})
+        unida[NameObject('/Widths')] = ArrayObject(larguras)
+        referencia = escritor._add_object(unida)
+        for fontes, chave, _ in usos:
+            fontes[NameObject(chave)] = referencia
+
+
+def _gravar(escritor, destino):
+    # Cada página vem com seus próprios recursos; os que forem idênticos são gravados uma vez só
+    escritor.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    escritor.write(destino)
+
+
+def _juntar(futuros, output_file, relatorio, perfil='padrao'):
+    # Junta as páginas na ordem original, independente da ordem em que ficaram prontas
+    escritor = PdfWriter()
+    for futuro in futuros:
+        conteudo, duracao = futuro.result()
+        metricas.PAGINA_SEGUNDOS.observar(duracao, relatorio=relatorio)
+        escritor.append(PdfReader(io.BytesIO(conteudo)))
+    with metricas.ESCRITA_SEGUNDOS.cronometrar(relatorio=relatorio):
+        if perfil == 'compacto':
+            # Tamanho que o perfil padrão gravaria, para medir a economia
+            padrao = io.BytesIO()
+            _gravar(escritor, padrao)
+            _unir_fontes(escritor)
+            for pagina in escritor.pages:
+                pagina.compress_content_streams(level=9)
+            # Uma segunda cópia renumera os objetos: a tabela xref não carrega as entradas dos removidos
+            compacto = io.BytesIO()
+            _gravar(escritor, compacto)
+            escritor = PdfWriter(clone_from=PdfReader(compacto))
+        with open(output_file, 'wb') as arquivo:
+            _gravar(escritor, arquivo)
+    tamanho = os.path.getsize(output_file)
+    metricas.BYTES_ESCRITOS.incrementar(tamanho, relatorio=relatorio)
+    if perfil == 'compacto':
+        economia = max(len(padrao.getvalue()) - tamanho, 0)
+        metricas.BYTES_ECONOMIZADOS.incrementar(economia, relatorio=relatorio)
+        logging.info(f"Perfil compacto: '{output_file}' com {tamanho / 1024:.1f} KiB, "
+                     f"{economia / 1024:.1f} KiB ({economia / max(len(padrao.getvalue()), 1):.0%}) a menos "
+                     f"que no perfil padrão (sem contar a rasterização).")
+    logging.info(f"{len(futuros)} páginas desenhadas e gravadas em '{output_file}'.")
+
+
+def renderizar_pdfs(documentos, processos=None, relatorio='pdf', perfil=None):
+    # Vários documentos de uma vez ({arquivo: paginas}): as páginas de todos vão juntas para o pool,
+    # e cada documento é gravado assim que as suas ficam prontas
+    processos = PROCESSOS if processos is None else processos
+    if _serial.get():
+        processos = 1
+    perfil = perfil or PERFIL
+    if perfil == 'compacto' and PdfWriter is None:
+        logging.warning("Perfil compacto precisa do pypdf; gravando no perfil padrão.")
+        perfil = 'padrao'
+
+    paralelo = processos > 1 and sum(len(paginas) for paginas in documentos.values()) >= 2 and PdfWriter is not None
+    aviso = _aviso.get()
+    if not paralelo and perfil != 'compacto':
+        for output_file, paginas in documentos.items():
+            _gravar_serial(paginas, output_file, relatorio, aviso)
+        return list(documentos)
+
+    # O perfil compacto sempre monta o documento a partir de páginas gravadas uma a uma,
+    # no pool ou, sem paralelismo, aqui mesmo
+    executor = _obter_executor() if paralelo else _ExecutorLocal()
+    futuros = {output_file: [executor.submit(_renderizar_pagina, desenhar, argumentos, perfil, aviso)
+                             for desenhar, argumentos in paginas]
+               for output_file, paginas in documentos.items()}
+    for output_file, futuros_documento in futuros.items():
+        _juntar(futuros_documento, output_file, relatorio, perfil)
+    return list(documentos)
+
+
+def renderizar_pdf(paginas, output_file, processos=None, relatorio='pdf', perfil=None):
+    # 'paginas' é uma lista de (função, argumentos); cada função precisa estar no nível do módulo
+    # (para ir ao processo filho) e devolver uma matplotlib.figure.Figure
+    renderizar_pdfs({output_file: paginas}, processos, relatorio, perfil)
+    return output_file
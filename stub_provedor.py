@@ -0,0 +1,146 @@
+# stub_provedor.py
+#
+# Provedor de preços falso para testes, no formato do ProvedorHTTP, servindo as fixtures do
+# ProvedorReplay e injetando falhas do serviço real (lentidão, erros 5xx, limite de taxa, travamentos):
+#
+#   python stub_provedor.py                                   # sem falhas, na porta 8765
+#   python stub_provedor.py --erros 0.3 --limite 0.1 --latencia 0.2 --travar 0.05
+#   python stub_provedor.py --fora-do-ar                      # todas as requisições com 503
+#   PROVEDOR_DADOS=http PROVEDOR_HTTP_URL=http://127.0.0.1:8765 python app.py
+#
+# As falhas podem ser trocadas com o servidor no ar, para simular quedas e recuperação:
+#
+#   curl -X POST localhost:8765/controle -d '{"fora_do_ar": true}'
+#   curl localhost:8765/controle                              # configuração atual e contadores
+
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import provedor_dados
+
+_configuracao = {'latencia': 0.0, 'erros': 0.0, 'limite': 0.0, 'travar': 0.0, 'tempo_travado': 30.0,
+                 'fora_do_ar': False}
+_contadores = {}
+_trava = threading.Lock()
+
+
+def _contar(resultado):
+    with _trava:
+        _contadores[resultado] = _contadores.get(resultado, 0) + 1
+
+
+class Manipulador(BaseHTTPRequestHandler):
+    provedor = None
+
+    def _responder(self, codigo, corpo=b'', tipo='text/plain; charset=utf-8', cabecalhos=None):
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _json(self, codigo, valor):
+        self._responder(codigo, json.dumps(valor).encode(), 'application/json')
+
+    def do_GET(self):
+        endereco = urlparse(self.path)
+        if endereco.path == '/controle':
+            with _trava:
+                return self._json(200, {'configuracao': _configuracao, 'contadores': _contadores})
+        if not endereco.path.startswith('/historico/'):
+            return self._responder(404, b'Rota desconhecida.')
+
+        with _trava:
+            configuracao = dict(_configuracao)
+        time.sleep(configuracao['latencia'] * random.uniform(0.5, 1.5))
+        sorteio = random.random()
+        if configuracao['fora_do_ar']:
+            _contar('fora_do_ar')
+            return self._responder(503, b'Servico indisponivel.')
+        if sorteio < configuracao['travar']:
+            # Segura a conexão além do tempo limite do cliente
+            _contar('travado')
+            time.sleep(configuracao['tempo_travado'])
+            return self._responder(504, b'Tempo esgotado.')
+        sorteio -= configuracao['travar']
+        if sorteio < configuracao['limite']:
+            _contar('limite')
+            return self._responder(429, b'Muitas requisicoes.', cabecalhos={'Retry-After': '1'})
+        sorteio -= configuracao['limite']
+        if sorteio < configuracao['erros']:
+            _contar('erro')
+            return self._responder(500, b'Erro interno.')
+
+        ticker = unquote(endereco.path[len('/historico/'):])
+        historico = self.provedor._ler(ticker)
+        if historico is None:
+            _contar('sem_dados')
+            return self._responder(404, f'Sem dados para {ticker}.'.encode())
+        consulta = parse_qs(endereco.query)
+        if 'inicio' in consulta:
+            historico = historico[historico.index >= pd.Timestamp(consulta['inicio'][0])]
+        if 'fim' in consulta:
+            historico = historico[historico.index < pd.Timestamp(consulta['fim'][0])]
+        _contar('ok')
+        self._responder(200, historico.to_csv(index_label='Date').encode(), 'text/csv; charset=utf-8')
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/controle':
+            return self._responder(404, b'Rota desconhecida.')
+        try:
+            corpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            alteracoes = {nome: type(_configuracao[nome])(valor) for nome, valor in corpo.items()}
+        except (ValueError, KeyError, TypeError) as e:
+            return self._json(400, {'erro': f'Configuração inválida: {e}'})
+        with _trava:
+            _configuracao.update(alteracoes)
+            logging.info(f"Configuração do stub: {_configuracao}")
+            return self._json(200, {'configuracao': _configuracao})
+
+    def log_message(self, formato, *argumentos):
+        logging.debug(formato % argumentos)
+
+
+def servir(porta=8765, pasta=None, **falhas):
+    _configuracao.update({nome: valor for nome, valor in falhas.items() if valor is not None})
+    Manipulador.provedor = provedor_dados.ProvedorReplay(pasta)
+    servidor = ThreadingHTTPServer(('127.0.0.1', porta), Manipulador)
+    servidor.daemon_threads = True
+    logging.info(f"Stub do provedor em http://127.0.0.1:{porta} com fixtures de '{Manipulador.provedor.pasta}'; "
+                 f"falhas: {_configuracao}")
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Provedor HTTP falso, com injeção de falhas, para testes.')
+    parser.add_argument('--porta', type=int, default=8765)
+    parser.add_argument('--pasta', help='Pasta das fixtures (padrão: PASTA_FIXTURES).')
+    parser.add_argument('--latencia', type=float, help='Latência média de cada resposta, em segundos.')
+    parser.add_argument('--erros', type=float, help='Fração das requisições respondidas com HTTP 500.')
+    parser.add_argument('--limite', type=float, help='Fração das requisições respondidas com HTTP 429.')
+    parser.add_argument('--travar', type=float, help='Fração das requisições que ficam presas sem resposta.')
+    parser.add_argument('--tempo-travado', type=float, help='Quanto tempo uma requisição presa demora.')
+    parser.add_argument('--fora-do-ar', action='store_true', default=None, help='Responde 503 a tudo.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    servidor = servir(args.porta, args.pasta, latencia=args.latencia, erros=args.erros, limite=args.limite,
+                      travar=args.travar, tempo_travado=args.tempo_travado, fora_do_ar=args.fora_do_ar)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# worker_relatorios.py
+#
+# Processo que gera os relatórios da fila durável (fila_duravel.py), separado do web. Opcional: só
+# serve quando o app roda com FILA_MODO=duravel e o banco da fila e a pasta de saída estão num volume
+# compartilhado por todos os processos (ver fila_duravel.py). Rode quantos forem necessários, na mesma
+# máquina ou em outras que montem esse volume:
+#
+#   FILA_MODO=duravel gunicorn app:app ...                    # o app só enfileira e serve os arquivos
+#   FILA_MODO=duravel python worker_relatorios.py --trabalhadores 2   # dois jobs por vez neste processo
+#
+# Cada job reivindicado tem o prazo de posse renovado por um batimento enquanto roda; se o processo
+# cair, o job volta para a fila quando o prazo vencer. SIGTERM termina os jobs em andamento e sai.
+
+import os
+import signal
+import socket
+import logging
+import argparse
+import threading
+import fila_duravel
+
+# Pasta de saída compartilhada com o app (o caminho gravado no job é o que o /download recebe)
+PASTA_SAIDA = os.environ.get('PASTA_SAIDA', 'outputs')
+
+# Intervalo entre consultas à fila quando não há job pendente
+INTERVALO_SEGUNDOS = float(os.environ.get('WORKER_INTERVALO_SEGUNDOS', '1'))
+
+_parando = threading.Event()
+
+
+def _batimento(job_id, trabalhador, fim):
+    while not fim.wait(fila_duravel.BATIMENTO_SEGUNDOS):
+        if not fila_duravel.renovar(job_id, trabalhador):
+            # Outro worker assumiu o job; o resultado deste não será gravado
+            logging.warning(f"Job {job_id}: {trabalhador} perdeu a posse.")
+            return
+
+
+def executar(job, trabalhador, pasta=PASTA_SAIDA):
+    import relatorios
+    import cache_relatorios
+    job_id = job['job_id']
+    logging.info(f"Job {job_id} ({job['tipo']}) com {trabalhador}, tentativa {job['tentativas']}.")
+    fim = threading.Event()
+    batimento = threading.Thread(target=_batimento, args=(job_id, trabalhador, fim), daemon=True)
+    batimento.start()
+
+    def progresso(etapa):
+        fila_duravel.marcar_etapa(job_id, trabalhador, etapa)
+
+    def gerar():
+        if job['tipo'] == 'todos':
+            return relatorios.gerar_todos(pasta, progresso=progresso)
+        return relatorios.gerar_relatorio(job['tipo'], pasta, progresso=progresso, parametros=job['parametros'],
+                                          forcar=job['perfilar'])
+
+    try:
+        perfil = None
+        if job['perfilar']:
+            import perfilamento
+            resultado, perfil = perfilamento.perfilar(gerar)
+        else:
+            resultado = gerar()
+        arquivos = list(resultado) if isinstance(resultado, (list, tuple)) else [resultado]
+        if not arquivos or not all(arquivo and os.path.exists(arquivo) for arquivo in arquivos):
+            # O gerador terminou sem erro e sem arquivo: outra tentativa daria no mesmo
+            fila_duravel.falhar(job_id, trabalhador, 'arquivo não gerado', permanente=True)
+            return
+        # Tickers que entraram com a última série guardada: o app não tem esse estado, vai junto no job
+        fila_duravel.concluir(job_id, trabalhador, arquivos, cache_relatorios.desatualizados(arquivos), perfil)
+    except Exception as e:
+        fila_duravel.falhar(job_id, trabalhador, e)
+    finally:
+        fim.set()
+        batimento.join()
+
+
+def _laco(trabalhador, pasta):
+    while not _parando.is_set():
+        try:
+            job = fila_duravel.reivindicar(trabalhador)
+        except Exception as e:
+            logging.error(f"{trabalhador}: erro ao consultar a fila: {e}")
+            job = None
+        if job is None:
+            _parando.wait(INTERVALO_SEGUNDOS)
+            continue
+        executar(job, trabalhador, pasta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera os relatórios pedidos na fila durável.')
+    parser.add_argument('--trabalhadores', type=int, default=int(os.environ.get('FILA_TRABALHADORES', '2')),
+                        help='Jobs gerados ao mesmo tempo por este processo.')
+    parser.add_argument('--pasta', default=PASTA_SAIDA, help='Pasta de saída compartilhada com o app.')
+    parser.add_argument('--sem-aquecimento', action='store_true', help='Não pré-carrega geradores e fontes.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    os.makedirs(args.pasta, exist_ok=True)
+    for sinal in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sinal, lambda *_: _parando.set())
+    if not args.sem_aquecimento:
+        import aquecimento
+        aquecimento.aquecer()
+
+    import agendador
+    agendador.iniciar(args.pasta)
+
+    prefixo = f'{socket.gethostname()}:{os.getpid()}'
+    threads = [threading.Thread(target=_laco, args=(f'{prefixo}:{i}', args.pasta), name=f'worker-{i}')
+               for i in range(args.trabalhadores)]
+    for thread in threads:
+        thread.start()
+    logging.info(f"Worker {prefixo} com {args.trabalhadores} trabalhadores na fila '{fila_duravel.CAMINHO_BANCO}'.")
+    # Espera com timeout para o sinal ser atendido na thread principal
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+    logging.info(f"Worker {prefixo} encerrado.")
+
+
+if __name__ == '__main__':
+    main()
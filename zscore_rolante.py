@@ -0,0 +1,106 @@
+# zscore_rolante.py
+
+import numpy as np
+import pandas as pd
+
+
+def _somas_acumuladas(valores):
+    # Somas acumuladas com uma linha de zeros no topo: soma da janela (t-w, t] = S[t] - S[t-w]
+    validos = ~np.isnan(valores)
+    zerados = np.where(validos, valores, 0.0)
+    zeros = np.zeros((1, valores.shape[1]))
+    return (np.vstack([zeros, np.cumsum(zerados, axis=0)]),
+            np.vstack([zeros, np.cumsum(zerados * zerados, axis=0)]),
+            np.vstack([zeros, np.cumsum(validos, axis=0)]))
+
+
+def _z(atual, soma, soma_q, contagem):
+    # Z-score com desvio padrão amostral (ddof=1), como o pandas
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = soma / contagem
+        variancia = np.maximum(soma_q - soma * media, 0.0) / (contagem - 1)
+        z = (atual - media) / np.sqrt(variancia)
+    return np.where(contagem > 1, z, np.nan)
+
+
+def serie_z_scores(precos, janela):
+    # Z-score de cada ativo em cada data para uma janela, numa única passada vetorizada
+    valores = precos.to_numpy(dtype=float)
+    referencia = np.nan_to_num(precos.bfill().iloc[0].to_numpy(dtype=float))
+    centrados = valores - referencia
+    soma, soma_q, contagem = _somas_acumuladas(centrados)
+    inicio = np.maximum(np.arange(1, len(valores) + 1) - janela, 0)
+    fim = np.arange(1, len(valores) + 1)
+    z = _z(centrados, soma[fim] - soma[inicio], soma_q[fim] - soma_q[inicio], contagem[fim] - contagem[inicio])
+    return pd.DataFrame(z, index=precos.index, columns=precos.columns)
+
+
+class ZScoreRolante:
+    # Mantém somas e somas de quadrados de várias janelas ao mesmo tempo para todos os ativos.
+    # Acrescentar um pregão atualiza todos os Z-scores em tempo constante por ativo
+    def __init__(self, janelas, ativos):
+        self.janelas = sorted(set(int(j) for j in janelas))
+        self.ativos = list(ativos)
+        self.maior = self.janelas[-1]
+        n = len(self.ativos)
+        self._buffer = np.full((self.maior, n), np.nan)
+        self._posicao = 0
+        self._referencia = np.zeros(n)
+        self._ultimo = np.full(n, np.nan)
+        self._soma = {j: np.zeros(n) for j in self.janelas}
+        self._soma_q = {j: np.zeros(n) for j in self.janelas}
+        self._contagem = {j: np.zeros(n) for j in self.janelas}
+        self.data = None
+
+    def carregar(self, precos):
+        # Inicializa o estado com o histórico inteiro usando somas acumuladas (sem laço por ativo)
+        precos = precos.reindex(columns=self.ativos)
+        valores = precos.to_numpy(dtype=float)
+        # Centrar pelo primeiro valor de cada ativo reduz o erro numérico de somas de quadrados
+        self._referencia = np.nan_to_num(precos.bfill().iloc[0].to_numpy(dtype=float)) if len(precos) else self._referencia
+        centrados = valores - self._referencia
+        soma, soma_q, contagem = _somas_acumuladas(centrados)
+        total = len(centrados)
+        for janela in self.janelas:
+            inicio = max(total - janela, 0)
+            self._soma[janela] = soma[total] - soma[inicio]
+            self._soma_q[janela] = soma_q[total] - soma_q[inicio]
+            self._contagem[janela] = contagem[total] - contagem[inicio]
+
+        recentes = centrados[-self.maior:]
+        self._buffer[:] = np.nan
+        self._buffer[self.maior - len(recentes):] = recentes
+        self._posicao = 0
+        self._ultimo = precos.ffill().iloc[-1].to_numpy(dtype=float) if total else self._ultimo
+        self.data = precos.index[-1] if total else None
+        return self
+
+    def adicionar(self, linha, data=None):
+        # Acrescenta um pregão: entra o valor novo e sai, de cada janela, o valor que ficou para trás.
+        # Ativos sem cotação no pregão repetem o último valor (como o ffill do relatório)
+        linha = pd.Series(linha).reindex(self.ativos).to_numpy(dtype=float)
+        linha = np.where(np.isnan(linha), self._ultimo, linha)
+        self._ultimo = linha
+        novo = linha - self._referencia
+        novo_valido = ~np.isnan(novo)
+        novo_zerado = np.where(novo_valido, novo, 0.0)
+
+        for janela in self.janelas:
+            saindo = self._buffer[(self._posicao - janela) % self.maior]
+            saindo_valido = ~np.isnan(saindo)
+            saindo_zerado = np.where(saindo_valido, saindo, 0.0)
+            self._soma[janela] += novo_zerado - saindo_zerado
+            self._soma_q[janela] += novo_zerado * novo_zerado - saindo_zerado * saindo_zerado
+            self._contagem[janela] += novo_valido.astype(float) - saindo_valido
+
+        self._buffer[self._posicao] = novo
+        self._posicao = (self._posicao + 1) % self.maior
+        self.data = data
+        return self
+
+    def z_scores(self):
+        # DataFrame janela x ativo com o Z-score do último pregão
+        atual = self._ultimo - self._referencia
+        linhas = {janela: _z(atual, self._soma[janela], self._soma_q[janela], self._contagem[janela])
+                  for janela in self.janelas}
+        return pd.DataFrame.from_dict(linhas, orient='index', columns=self.ativos)